@@ -1,13 +1,41 @@
 import os, sys
+import concurrent.futures
+import shutil
+import sqlite3
+import time
 import vtk, qt, ctk, slicer
 from slicer.ScriptedLoadableModule import *
 from slicer.util import VTKObservationMixin
 import platform
-import csv
 import logging
-import urllib
 import re
+import numpy as np
 from packaging import version
+from RegressionComputationLib.ShapeScan import ShapeDirectoryScanner, defaultNumberOfWorkers, listInputShapes
+from RegressionComputationLib.ShapeMetadataCache import ShapeMetadataCache
+from RegressionComputationLib.InputShapeParameters import (InputShapeParameters, NumberOfColumns, RootnameColumn,
+                                                            TimePointColumn, TrisColumn, WeightColumn, columnRanges)
+from RegressionComputationLib.RegressionParameters import RegressionParameters, readInputsCSV, writeInputFiles
+from RegressionComputationLib.ParameterSweep import ParameterSweep, parseParameterSets
+from RegressionComputationLib.RegressionResultCache import RegressionResultCache
+from RegressionComputationLib.Shape4DLog import Shape4DLogFileName, readShape4DLog
+from RegressionComputationLib.ConvergenceTelemetry import ConvergenceTelemetry, progressSnapshotFilePaths, snapshotIteration
+from RegressionComputationLib.RunLedger import RunLedger, RunLedgerFileName, shape4DVersionFuture
+from RegressionComputationLib.RunSupervisor import RunSupervisor, stopEarly
+from RegressionComputationLib.Multiresolution import MultiresolutionRegression
+from RegressionComputationLib.Alignment import alignInputs, readPoints
+from RegressionComputationLib.Benchmark import runBenchmark, writeSyntheticCohort
+from RegressionComputationLib.AutoTimeDiscretization import AutoTimeDiscretization
+from RegressionComputationLib.GroupRegression import GroupRegression
+from RegressionComputationLib.InputValidation import InputValidationReportFileName, validateInputs
+from RegressionComputationLib.JobQueue import JobQueue, JobRunner, writeJobInputFiles
+from RegressionComputationLib.Resampling import ResamplingRegression
+from RegressionComputationLib.ResourceMonitor import ResourceMonitor, ResourceUsageFileName
+from RegressionComputationLib.Resume import finishResumedRun, isResumedRun, resumeParameters, resumeReport
+from RegressionComputationLib.TrajectoryContainer import packRegressionOutputs
+from RegressionComputationLib.Preprocessing import PreprocessedShapeCache, preprocessInputs, preprocessingSettingsStruct
+from RegressionComputationLib.CostPlanner import loadCalibration, physicalMemory, planRegression, shapeMetadataForInputs
+from RegressionComputationLib.WarmStart import findInitialVelocityFile, setWarmStart, warmStartReport
 
 def _setSectionResizeMode(header, *args, **kwargs):
   """ To be compatible with Qt4 and Qt5 """
@@ -16,6 +44,120 @@ def _setSectionResizeMode(header, *args, **kwargs):
   else:
     header.setSectionResizeMode(*args, **kwargs)
 
+#
+# Input shape parameters table
+#
+
+class InputShapeParametersTableModel(qt.QAbstractTableModel):
+  """ Table model exposing the columns of an InputShapeParameters object """
+
+  headerLabels = [' Input Shapes ', ' Time Point ', ' Kernel Width ', ' Shape Index ', ' Weight ']
+
+  def __init__(self, parameters, parent=None):
+    qt.QAbstractTableModel.__init__(self, parent)
+    self.parameters = parameters
+    self.timePointsChangedCallback = None
+
+  def rowCount(self, parent=qt.QModelIndex()):
+    if parent.isValid():
+      return 0
+    return len(self.parameters)
+
+  def columnCount(self, parent=qt.QModelIndex()):
+    if parent.isValid():
+      return 0
+    return NumberOfColumns
+
+  def data(self, index, role=qt.Qt.DisplayRole):
+    if not index.isValid():
+      return None
+    if role == qt.Qt.DisplayRole or role == qt.Qt.EditRole:
+      return self.parameters.value(index.row(), index.column())
+    if role == qt.Qt.TextAlignmentRole:
+      return qt.Qt.AlignCenter
+    return None
+
+  def setData(self, index, value, role=qt.Qt.EditRole):
+    if role != qt.Qt.EditRole or index.column() == RootnameColumn:
+      return False
+    self.parameters.setValue(index.row(), index.column(), value)
+    self.dataChanged(index, index)
+    if index.column() == TimePointColumn:
+      self.onTimePointsChanged()
+    return True
+
+  def flags(self, index):
+    flags = qt.Qt.ItemIsEnabled | qt.Qt.ItemIsSelectable
+    if index.column() != RootnameColumn:
+      flags = flags | qt.Qt.ItemIsEditable
+    return flags
+
+  def headerData(self, section, orientation, role=qt.Qt.DisplayRole):
+    if role != qt.Qt.DisplayRole:
+      return None
+    if orientation == qt.Qt.Horizontal:
+      return self.headerLabels[section]
+    return section + 1
+
+  def onTimePointsChanged(self):
+    if self.timePointsChangedCallback is not None:
+      self.timePointsChangedCallback()
+
+  # Modifications of the parameters, notified to the views
+
+  def clearParameters(self):
+    self.beginResetModel()
+    self.parameters.clear()
+    self.endResetModel()
+
+  def insertShape(self, shapeMetadata):
+    # Keep the rows sorted by shape name whatever the order the shapes are read in
+    row = self.parameters.rowForRootname(shapeMetadata.rootname)
+    self.beginInsertRows(qt.QModelIndex(), row, row)
+    self.parameters.insertShape(row, shapeMetadata.filePath, shapeMetadata.timePoint, shapeMetadata.sigmaW)
+    self.endInsertRows()
+
+  def addShapes(self, shapeMetadataList):
+    self.beginResetModel()
+    self.parameters.addShapes([shapeMetadata.filePath for shapeMetadata in shapeMetadataList],
+                              [shapeMetadata.timePoint for shapeMetadata in shapeMetadataList],
+                              [shapeMetadata.sigmaW for shapeMetadata in shapeMetadataList])
+    self.endResetModel()
+
+  def parametersChanged(self, column=None):
+    """ To be called after the parameters were modified in bulk """
+    if len(self.parameters) == 0:
+      return
+    firstColumn = TimePointColumn if column is None else column
+    lastColumn = NumberOfColumns - 1 if column is None else column
+    self.dataChanged(self.index(0, firstColumn), self.index(len(self.parameters) - 1, lastColumn))
+    if firstColumn <= TimePointColumn <= lastColumn:
+      self.onTimePointsChanged()
+
+class InputShapeParametersDelegate(qt.QStyledItemDelegate):
+  """ Spin box editors for the parameters columns """
+
+  def createEditor(self, parent, option, index):
+    column = index.column()
+    # The 'Shape Index' column is an integer, the other ones are doubles
+    if column == TrisColumn:
+      editor = qt.QSpinBox(parent)
+    else:
+      editor = qt.QDoubleSpinBox(parent)
+      if column == WeightColumn:
+        editor.setSingleStep(0.1)
+    minimum, maximum = columnRanges[column]
+    editor.setRange(minimum, maximum)
+    editor.setAlignment(0x84)
+    return editor
+
+  def setEditorData(self, editor, index):
+    editor.value = index.model().data(index, qt.Qt.EditRole)
+
+  def setModelData(self, editor, model, index):
+    editor.interpretText()
+    model.setData(index, editor.value, qt.Qt.EditRole)
+
 #
 # RegressionComputation
 #
@@ -77,8 +219,20 @@ class RegressionComputationWidget(ScriptedLoadableModuleWidget):
     self.CollapsibleButton_RegressionComputationInput = self.getWidget('CollapsibleButton_RegressionComputationInput')
     self.tabWidget_InputShapes = self.getWidget('tabWidget_InputShapes')
     self.shapeInputDirectory = self.getWidget('DirectoryButton_ShapeInput')
-    self.tableWidget_inputShapeParameters = self.getWidget('tableWidget_inputShapeParameters')
+    self.tableView_inputShapeParameters = self.getWidget('tableView_inputShapeParameters')
+    self.bulkEditColumn = self.getWidget('comboBox_BulkEditColumn')
+    self.bulkEditValue = self.getWidget('lineEdit_BulkEditValue')
+    self.setColumnButton = self.getWidget('pushButton_SetColumn')
+    self.fillColumnFromRegexButton = self.getWidget('pushButton_FillColumnFromRegex')
+    self.pasteParametersButton = self.getWidget('pushButton_PasteParameters')
     self.PathLineEdit_ShapeInputsCSV = self.getWidget('PathLineEdit_ShapeInputsCSV')
+    self.scanWorkers = self.getWidget('spinBox_ScanWorkers')
+    self.widget_ShapeScanProgress = self.getWidget('widget_ShapeScanProgress')
+    self.progressBar_ShapeScan = self.getWidget('progressBar_ShapeScan')
+    self.cancelShapeScanButton = self.getWidget('pushButton_CancelShapeScan')
+    self.clearShapeMetadataCacheButton = self.getWidget('pushButton_ClearShapeMetadataCache')
+
+    self.scanWorkers.value = defaultNumberOfWorkers()
 
     # Times Parameters
     self.CollapsibleButton_TimeParemeters = self.getWidget('CollapsibleButton_TimeParemeters')
@@ -108,6 +262,10 @@ class RegressionComputationWidget(ScriptedLoadableModuleWidget):
     self.outputDirectory = self.getWidget('DirectoryButton_OutputDirectory')
     self.outputPrefix = self.getWidget('lineEdit_OutputRootname')
     self.saveEveryN = self.getWidget('spinBox_SaveEveryNIterations')
+    self.useResultCache = self.getWidget('checkBox_UseResultCache')
+    self.resultCacheSize = self.getWidget('doubleSpinBox_ResultCacheSize')
+    self.clearResultCacheButton = self.getWidget('pushButton_ClearResultCache')
+    self.trajectoryContainer = self.getWidget('ComboBox_TrajectoryContainer')
 
     self.outputPrefix.text = 'Regression_output_'
     self.saveEveryN.value = 50
@@ -118,16 +276,79 @@ class RegressionComputationWidget(ScriptedLoadableModuleWidget):
     self.optimMethod = self.getWidget('ComboBox_OptimizationMethod')
     self.breakRatio = self.getWidget('doubleSpinBox_BreakRatio')
     self.maxIters = self.getWidget('spinBox_MaxIterations')
+    self.warmStart = self.getWidget('checkBox_WarmStart')
+    self.warmStartDirectory = self.getWidget('DirectoryButton_WarmStart')
+    self.v0Weight = self.getWidget('doubleSpinBox_V0Weight')
+    self.wallClockBudget = self.getWidget('doubleSpinBox_WallClockBudget')
+    self.plateauImprovement = self.getWidget('doubleSpinBox_PlateauImprovement')
+    self.plateauIterations = self.getWidget('spinBox_PlateauIterations')
+    self.multiresolutionLevels = self.getWidget('spinBox_MultiresolutionLevels')
+    self.multiresolutionPointsFraction = self.getWidget('doubleSpinBox_MultiresolutionPointsFraction')
+    self.preprocessShapes = self.getWidget('checkBox_PreprocessShapes')
+    self.pointsPerKernelWidth = self.getWidget('doubleSpinBox_PointsPerKernelWidth')
+    self.poseAlignment = self.getWidget('ComboBox_PoseAlignment')
+    self.autoT = self.getWidget('checkBox_AutoT')
+    self.autoTTolerance = self.getWidget('doubleSpinBox_AutoTTolerance')
+
+    # Parameter Sweep
+    self.CollapsibleButton_ParameterSweep = self.getWidget('CollapsibleButton_ParameterSweep')
+    self.sweepParameters = self.getWidget('plainTextEdit_SweepParameters')
+    self.sweepCores = self.getWidget('spinBox_SweepCores')
+    self.sweepConcurrentRuns = self.getWidget('spinBox_SweepConcurrentRuns')
+    self.progressBar_Sweep = self.getWidget('progressBar_Sweep')
+    self.runSweepButton = self.getWidget('pushButton_RunSweep')
+    self.resamplingMethod = self.getWidget('ComboBox_Resampling')
+    self.bootstrapReplicates = self.getWidget('spinBox_BootstrapReplicates')
+    self.subjectPattern = self.getWidget('lineEdit_SubjectPattern')
+    self.runResamplingButton = self.getWidget('pushButton_RunResampling')
+    self.runGroupsButton = self.getWidget('pushButton_RunGroups')
+
+    self.sweepCores.value = os.cpu_count() or 1
+
+    # Job Queue
+    self.CollapsibleButton_JobQueue = self.getWidget('CollapsibleButton_JobQueue')
+    self.jobPriority = self.getWidget('spinBox_JobPriority')
+    self.concurrentJobs = self.getWidget('spinBox_ConcurrentJobs')
+    self.tableWidget_Jobs = self.getWidget('tableWidget_Jobs')
+    self.addJobButton = self.getWidget('pushButton_AddJob')
+    self.cancelJobButton = self.getWidget('pushButton_CancelJob')
+    self.retryJobButton = self.getWidget('pushButton_RetryJob')
+    self.setJobPriorityButton = self.getWidget('pushButton_SetJobPriority')
+    self.removeJobButton = self.getWidget('pushButton_RemoveJob')
+    self.runJobQueueButton = self.getWidget('pushButton_RunJobQueue')
+
+    # Run Ledger
+    self.CollapsibleButton_RunLedger = self.getWidget('CollapsibleButton_RunLedger')
+    self.runLedgerReport = self.getWidget('ComboBox_RunLedgerReport')
+    self.tableWidget_RunLedger = self.getWidget('tableWidget_RunLedger')
+    self.label_PerformanceRegressions = self.getWidget('label_PerformanceRegressions')
+    self.refreshRunLedgerButton = self.getWidget('pushButton_RefreshRunLedger')
+
+    # Cost Planner
+    self.estimateCostButton = self.getWidget('pushButton_EstimateCost')
+    self.memoryLimit = self.getWidget('doubleSpinBox_MemoryLimit')
+    self.label_CostEstimate = self.getWidget('label_CostEstimate')
+
+    self.memoryLimit.value = physicalMemory() / 1024.0 ** 3
+    self.label_CostEstimate.hide()
 
     # Run Shape4D
     self.applyButton = self.getWidget('pushButton_RunShape4D')
+    self.resumeButton = self.getWidget('pushButton_ResumeShape4D')
     self.CLIProgressBar_shape4D = self.getWidget('CLIProgressBar_shape4D')
+    self.label_Convergence = self.getWidget('label_Convergence')
+    self.label_ResourceUsage = self.getWidget('label_ResourceUsage')
 
     # Connect Functions
     self.CollapsibleButton_RegressionComputationInput.connect('clicked()',
                                                         lambda: self.onSelectedCollapsibleButtonOpen(
                                                           self.CollapsibleButton_RegressionComputationInput))
     self.shapeInputDirectory.connect('directoryChanged(const QString &)', self.onInputShapesDirectoryChanged)
+    self.cancelShapeScanButton.connect('clicked()', self.onCancelShapeScan)
+    self.clearShapeMetadataCacheButton.connect('clicked()', self.onClearShapeMetadataCache)
+    self.setColumnButton.connect('clicked()', self.onSetInputShapeParametersColumn)
+    self.fillColumnFromRegexButton.connect('clicked()', self.onFillInputShapeParametersColumnFromRegex)
+    self.pasteParametersButton.connect('clicked()', self.onPasteInputShapeParameters)
 
     self.CollapsibleButton_TimeParemeters.connect('clicked()',
                                                         lambda: self.onSelectedCollapsibleButtonOpen(
@@ -147,7 +368,33 @@ class RegressionComputationWidget(ScriptedLoadableModuleWidget):
     self.CollapsibleButton_OptionalParameters.connect('clicked()',
                                                         lambda: self.onSelectedCollapsibleButtonOpen(
                                                           self.CollapsibleButton_OptionalParameters))
+    self.CollapsibleButton_ParameterSweep.connect('clicked()',
+                                                        lambda: self.onSelectedCollapsibleButtonOpen(
+                                                          self.CollapsibleButton_ParameterSweep))
+    self.useResultCache.connect('toggled(bool)', self.onUseResultCacheToggled)
+    self.resultCacheSize.connect('valueChanged(double)', self.onResultCacheSizeChanged)
+    self.clearResultCacheButton.connect('clicked()', self.onClearResultCache)
+    self.runSweepButton.connect('clicked(bool)', self.onRunSweepButton)
+    self.runResamplingButton.connect('clicked(bool)', self.onRunResamplingButton)
+    self.runGroupsButton.connect('clicked(bool)', self.onRunGroupsButton)
+    self.CollapsibleButton_JobQueue.connect('clicked()',
+                                                        lambda: self.onSelectedCollapsibleButtonOpen(
+                                                          self.CollapsibleButton_JobQueue))
+    self.addJobButton.connect('clicked()', self.onAddJob)
+    self.cancelJobButton.connect('clicked()', self.onCancelJob)
+    self.retryJobButton.connect('clicked()', self.onRetryJob)
+    self.setJobPriorityButton.connect('clicked()', self.onSetJobPriority)
+    self.removeJobButton.connect('clicked()', self.onRemoveJob)
+    self.runJobQueueButton.connect('clicked(bool)', self.onRunJobQueueButton)
+    self.concurrentJobs.connect('valueChanged(int)', self.onConcurrentJobsChanged)
+    self.CollapsibleButton_RunLedger.connect('clicked()',
+                                                        lambda: self.onSelectedCollapsibleButtonOpen(
+                                                          self.CollapsibleButton_RunLedger))
+    self.runLedgerReport.connect('currentIndexChanged(int)', self.onRefreshRunLedger)
+    self.refreshRunLedgerButton.connect('clicked()', self.onRefreshRunLedger)
+    self.estimateCostButton.connect('clicked()', self.onEstimateCost)
     self.applyButton.connect('clicked(bool)', self.onApplyButton)
+    self.resumeButton.connect('clicked(bool)', self.onResumeButton)
 
 
 
@@ -155,10 +402,18 @@ class RegressionComputationWidget(ScriptedLoadableModuleWidget):
 
     # Widget Configuration
     #   Input Parameters Table Configuration
-    self.tableWidget_inputShapeParameters.setColumnCount(5)
-    self.tableWidget_inputShapeParameters.setHorizontalHeaderLabels([' Input Shapes ', ' Time Point ', ' Kernel Width ', ' Shape Index ', ' Weight '])
-    self.tableWidget_inputShapeParameters.setColumnWidth(0, 400)
-    horizontalHeader = self.tableWidget_inputShapeParameters.horizontalHeader()
+    #     The parameters are stored column by column and displayed through a model
+    self.inputShapeParameters = InputShapeParameters()
+    self.inputShapeParametersModel = InputShapeParametersTableModel(self.inputShapeParameters)
+    self.inputShapeParametersModel.timePointsChangedCallback = self.onSetTimePointRange
+    self.inputShapeParametersDelegate = InputShapeParametersDelegate()
+    self.tableView_inputShapeParameters.setModel(self.inputShapeParametersModel)
+    self.tableView_inputShapeParameters.setItemDelegate(self.inputShapeParametersDelegate)
+    self.tableView_inputShapeParameters.setEditTriggers(qt.QAbstractItemView.AllEditTriggers)
+    self.tableView_inputShapeParameters.setColumnWidth(0, 400)
+    self.pasteParametersShortcut = qt.QShortcut(qt.QKeySequence(qt.QKeySequence.Paste), self.tableView_inputShapeParameters)
+    self.pasteParametersShortcut.connect('activated()', self.onPasteInputShapeParameters)
+    horizontalHeader = self.tableView_inputShapeParameters.horizontalHeader()
     horizontalHeader.setStretchLastSection(False)
 
     _setSectionResizeMode(horizontalHeader, 0, qt.QHeaderView.Stretch)
@@ -167,21 +422,106 @@ class RegressionComputationWidget(ScriptedLoadableModuleWidget):
     _setSectionResizeMode(horizontalHeader, 3, qt.QHeaderView.ResizeToContents)
     _setSectionResizeMode(horizontalHeader, 4, qt.QHeaderView.ResizeToContents)
 
+    #   Shape Scan Configuration
+    #     The input directory is scanned in a pool of workers and the
+    #     table is filled from the GUI thread by polling the scanner
+    self.shapeScanner = ShapeDirectoryScanner()
+    self.shapeMetadataCache = ShapeMetadataCache(os.path.join(slicer.app.cachePath, self.moduleName, 'ShapeMetadataCache.json'))
+    self.shapeScanTimer = qt.QTimer()
+    self.shapeScanTimer.setInterval(100)
+    self.shapeScanTimer.connect('timeout()', self.onShapeScanTimeout)
+    self.widget_ShapeScanProgress.hide()
+
+    #   Parameter Sweep Configuration
+    #     The runs of the sweep are started and collected from the GUI thread
+    self.parameterSweep = None
+    self.sweepTimer = qt.QTimer()
+    self.sweepTimer.setInterval(1000)
+    self.sweepTimer.connect('timeout()', self.onSweepTimeout)
+    self.progressBar_Sweep.hide()
+
+    #   Resampling Statistics Configuration
+    #     The statistics of the replicates are computed in a worker thread and
+    #     loaded from the GUI thread by polling it
+    self.resamplingStatisticsExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    self.resamplingStatisticsFutures = []
+    self.resamplingStatisticsTimer = qt.QTimer()
+    self.resamplingStatisticsTimer.setInterval(100)
+    self.resamplingStatisticsTimer.connect('timeout()', self.onResamplingStatisticsTimeout)
+
+    #   Job Queue Configuration
+    #     The queue is kept on disk and polled from the GUI thread, each job
+    #     running in its own shape4D CLI node
+    self.jobQueueColumns = ['Id', 'Name', 'Priority', 'Status', 'Elapsed', 'Attempts', 'Output directory']
+    self.tableWidget_Jobs.setColumnCount(len(self.jobQueueColumns))
+    self.tableWidget_Jobs.setHorizontalHeaderLabels(self.jobQueueColumns)
+    self.tableWidget_Jobs.horizontalHeader().setStretchLastSection(True)
+    self.tableWidget_Jobs.verticalHeader().hide()
+    self.jobQueueTimer = qt.QTimer()
+    self.jobQueueTimer.setInterval(1000)
+    self.jobQueueTimer.connect('timeout()', self.onJobQueueTimeout)
+    try:
+      self.Logic.openJobQueue()
+      self.updateJobTable()
+    except (sqlite3.Error, OSError) as e:
+      logging.warning('The job queue could not be opened: {}'.format(e))
+
+    #   Run Ledger Configuration
+    self.tableWidget_RunLedger.horizontalHeader().setStretchLastSection(True)
+    self.tableWidget_RunLedger.verticalHeader().hide()
+    self.label_PerformanceRegressions.hide()
+
     #   Shape4D CLI Progress Bar Configuration
     self.CLIProgressBar_shape4D.hide()
 
+    #   Convergence Configuration
+    #     The output of shape4D is parsed while it runs to follow its convergence
+    self.convergenceTimer = qt.QTimer()
+    self.convergenceTimer.setInterval(1000)
+    self.convergenceTimer.connect('timeout()', self.onConvergenceTimeout)
+    self.label_Convergence.hide()
+    self.label_ResourceUsage.hide()
+
+    #   Multiresolution Configuration
+    #     The levels are run one after the other, polled from the GUI thread
+    self.multiresolution = None
+    self.multiresolutionTelemetry = None
+    self.multiresolutionTimer = qt.QTimer()
+    self.multiresolutionTimer.setInterval(1000)
+    self.multiresolutionTimer.connect('timeout()', self.onMultiresolutionTimeout)
+
+    #   Automatic T Configuration
+    #     The time discretizations are run one after the other, polled from the GUI thread
+    self.autoTimeDiscretization = None
+    self.autoTTelemetry = None
+    self.autoTTimer = qt.QTimer()
+    self.autoTTimer.setInterval(1000)
+    self.autoTTimer.connect('timeout()', self.onAutoTTimeout)
+
   def enter(self):
     pass
 
+  def cleanup(self):
+    self.stopShapeScan()
+    self.stopSweep()
+    self.stopResamplingStatistics()
+    self.resamplingStatisticsExecutor.shutdown(wait=False)
+    self.convergenceTimer.stop()
+    self.stopMultiresolution()
+    self.stopAutoT()
+    self.stopJobQueue()
+
   def onCloseScene(self, obj, event):
     # Reset Input shape parameters
     self.tabWidget_InputShapes.currentIndex = 0
     #self.shapeInputDirectory.directory
     self.PathLineEdit_ShapeInputsCSV.setCurrentPath(" ")
 
+    # Stop any running scan of the input directory
+    self.stopShapeScan()
+
     # Reset the Input Parameters Table
-    self.tableWidget_inputShapeParameters.clearContents()
-    self.tableWidget_inputShapeParameters.setRowCount(0)
+    self.inputShapeParametersModel.clearParameters()
 
     # Reset Time Point Parameters
     #self.defaultTimePointRange.setChecked(True)
@@ -239,7 +579,10 @@ class RegressionComputationWidget(ScriptedLoadableModuleWidget):
                                self.CollapsibleButton_TimeParemeters,
                                self.CollapsibleButton_DeformationParameters,
                                self.CollapsibleButton_OutputParameters,
-                               self.CollapsibleButton_OptionalParameters]
+                               self.CollapsibleButton_OptionalParameters,
+                               self.CollapsibleButton_ParameterSweep,
+                               self.CollapsibleButton_JobQueue,
+                               self.CollapsibleButton_RunLedger]
       for collapsibleButton in collapsibleButtonList:
         collapsibleButton.setChecked(False)
       selectedCollapsibleButton.setChecked(True)
@@ -260,85 +603,128 @@ class RegressionComputationWidget(ScriptedLoadableModuleWidget):
     # Set this directory as the default output directory as well
     self.outputDirectory.directory = str(inputShapesDirectory)
 
-    row = 0
-
-    allShapeSigmaWs = []
-
-    for curFile in sorted(os.listdir(inputShapesDirectory)):
-
-        if not (curFile.endswith(".vtk")):
-          continue
-
-        self.tableWidget_inputShapeParameters.setRowCount(row + 1)
-
-        # Read the vtk file to set a default kernel width
-        shapeFile = '%s/%s' %(inputShapesDirectory, curFile)
-        polyReader = vtk.vtkPolyDataReader()
-        polyReader.SetFileName(shapeFile)
-        polyReader.Update()
-        shape = polyReader.GetOutput()
-        shapeBounds = shape.GetBounds()
-        xRange = shapeBounds[1] - shapeBounds[0]
-        yRange = shapeBounds[3] - shapeBounds[2]
-        zRange = shapeBounds[5] - shapeBounds[4]
-        smallestRange = min(xRange, yRange, zRange)
-        initSigmaW = int(smallestRange*0.50)
-        allShapeSigmaWs.append(initSigmaW)
-
-        # Try to extract the time point as a suffix
-        curTimePoint = 0.0
-        numsInFilename = re.findall(r'[-+]?\d*\.\d+|\d+', curFile)
-        if (len(numsInFilename) > 0):
-          curTimePoint = numsInFilename[-1]   # We assume the final number in the filename is the time point
-
-        # Column 0:
-        #rootname = os.path.basename(curFile).split(".")[0]
-        rootname = os.path.splitext(os.path.basename(curFile))[0]
-        labelVTKFile = qt.QLabel(rootname)
-        labelVTKFile.setAlignment(0x84)
-        self.tableWidget_inputShapeParameters.setCellWidget(row, 0, labelVTKFile)
-
-        # Column 1-2-3-4: (Time Point, Sigma W, Tris, Weight)
-        # We might want to consider using different UI elements for Time Point and Kernel Width that do not have explicit ranges
-        for column in range(1,5):
-          widget = qt.QWidget()
-          layout = qt.QHBoxLayout(widget)
-
-          # If this is the 'Shape Index' column we limit this to an integer
-          if (column == 3):
-            spinBox = qt.QSpinBox()
-            spinBox.setRange(0,1000)
-            spinBox.value = 0
-          # The rest of the columns are doubles
-          else:
-            spinBox = qt.QDoubleSpinBox()
-
-            if column == 1: # Time Point
-              spinBox.value = float(curTimePoint)
-              spinBox.connect('valueChanged(double)', self.onSetTimePointRange)
-              spinBox.setRange(-1e10, 1e10)
-            if column == 2: # Kernel Width
-              spinBox.setRange(0.001, 1e10)
-              spinBox.value = initSigmaW
-            if column == 4: # Weight
-              spinBox.value = 1
-              spinBox.setRange(0,1e10)
-              spinBox.setSingleStep(0.1);
-
-          layout.addWidget(spinBox)
-          layout.setAlignment(0x84)
-          layout.setContentsMargins(0, 0, 0, 0)
-          widget.setLayout(layout)
-          self.tableWidget_inputShapeParameters.setCellWidget(row, column, widget)
-
-        row = row + 1
+    # Reset the Input Parameters Table
+    self.stopShapeScan()
+    self.inputShapeParametersModel.clearParameters()
+
+    shapeFilePaths = listInputShapes(inputShapesDirectory)
+    if len(shapeFilePaths) == 0:
+      return
+
+    # Shapes already read and not modified since are taken from the cache
+    shapeFilePathsToRead = []
+    cachedShapeMetadata = []
+    for shapeFilePath in shapeFilePaths:
+      shapeMetadata = self.shapeMetadataCache.get(shapeFilePath)
+      if shapeMetadata is None:
+        shapeFilePathsToRead.append(shapeFilePath)
+      else:
+        cachedShapeMetadata.append(shapeMetadata)
+    self.inputShapeParametersModel.addShapes(cachedShapeMetadata)
+    if len(shapeFilePathsToRead) == 0:
+      self.onShapeScanFinished()
+      return
+
+    # Read the other shapes in the background, the rows are added as they are read
+    self.progressBar_ShapeScan.setRange(0, len(shapeFilePathsToRead))
+    self.progressBar_ShapeScan.value = 0
+    self.widget_ShapeScanProgress.show()
+    self.shapeScanner.numberOfWorkers = self.scanWorkers.value
+    self.shapeScanner.start(shapeFilePathsToRead)
+    self.shapeScanTimer.start()
+
+  def onShapeScanTimeout(self):
+    for shapeMetadata in self.shapeScanner.takeFinished():
+      self.shapeMetadataCache.put(shapeMetadata)
+      self.inputShapeParametersModel.insertShape(shapeMetadata)
+    self.progressBar_ShapeScan.value = self.shapeScanner.numberOfCompleted
+
+    if not self.shapeScanner.isRunning():
+      self.onShapeScanFinished()
+
+  def onShapeScanFinished(self):
+    self.shapeScanTimer.stop()
+    self.widget_ShapeScanProgress.hide()
+    self.shapeMetadataCache.save()
+    if self.shapeScanner.cancelled and self.shapeScanner.numberOfNotRead > 0:
+      self.warningMessage('The scan was cancelled: {} of {} shape(s) were not read.'.format(
+                          self.shapeScanner.numberOfNotRead, self.shapeScanner.numberOfShapes),
+                          'Select the input directory again to read them.')
+    if self.shapeScanner.numberOfFailed > 0:
+      self.warningMessage('{} shape(s) could not be read.'.format(self.shapeScanner.numberOfFailed),
+                          'See the application log for details.')
+    if len(self.inputShapeParameters) == 0:
+      return
 
     # We can set a default for deformation kernel width as smallest shape kernel
-    self.defKernelWidth.value = min(allShapeSigmaWs)
+    self.defKernelWidth.value = float(self.inputShapeParameters.sigmaWs.min())
 
     # Update the time range (if time point suffixes provided initialization)
     self.onSetTimePointRange()
 
+  def onCancelShapeScan(self):
+    logging.info('Cancel input directory scan')
+    self.shapeScanner.cancel()
+    # The shapes read before the cancellation are kept
+    self.onShapeScanTimeout()
+
+  def onClearShapeMetadataCache(self):
+    # Forget what is known about the current input directory and read it again
+    inputShapesDirectory = self.shapeInputDirectory.directory
+    self.shapeMetadataCache.invalidate(inputShapesDirectory)
+    if os.path.isdir(inputShapesDirectory):
+      self.onInputShapesDirectoryChanged()
+
+  def stopShapeScan(self):
+    # The shapes already read are kept for the next time they are listed
+    for shapeMetadata in self.shapeScanner.reset():
+      self.shapeMetadataCache.put(shapeMetadata)
+    self.shapeScanTimer.stop()
+    self.widget_ShapeScanProgress.hide()
+
+  # Bulk edits of the input parameters table
+
+  def selectedInputShapeRows(self):
+    # All the rows if none is selected
+    selectedIndexes = self.tableView_inputShapeParameters.selectionModel().selectedIndexes()
+    if len(selectedIndexes) == 0:
+      return None
+    return sorted(set(index.row() for index in selectedIndexes))
+
+  def onSetInputShapeParametersColumn(self):
+    column = self.bulkEditColumn.currentIndex + 1
+    try:
+      value = float(self.bulkEditValue.text)
+    except ValueError:
+      self.warningMessage('The value to set is not a number.', None)
+      return
+    self.inputShapeParameters.setColumn(column, value, self.selectedInputShapeRows())
+    self.inputShapeParametersModel.parametersChanged(column)
+
+  def onFillInputShapeParametersColumnFromRegex(self):
+    column = self.bulkEditColumn.currentIndex + 1
+    try:
+      unmatchedRows = self.inputShapeParameters.fillColumnFromRegex(column, self.bulkEditValue.text, self.selectedInputShapeRows())
+    except re.error as e:
+      self.warningMessage('Invalid regular expression.', str(e))
+      return
+    self.inputShapeParametersModel.parametersChanged(column)
+    if len(unmatchedRows) > 0:
+      unmatchedRootnames = [self.inputShapeParameters.rootnames[row] for row in unmatchedRows]
+      self.warningMessage('No number found in {} shape name(s).'.format(len(unmatchedRows)),
+                          '\n'.join(unmatchedRootnames[:20]))
+
+  def onPasteInputShapeParameters(self):
+    currentIndex = self.tableView_inputShapeParameters.currentIndex()
+    startRow = max(currentIndex.row(), 0)
+    startColumn = max(currentIndex.column(), TimePointColumn)
+    try:
+      self.inputShapeParameters.pasteText(qt.QApplication.clipboard().text(), startRow, startColumn)
+    except ValueError as e:
+      self.warningMessage('The clipboard does not contain numbers.', str(e))
+      return
+    self.inputShapeParametersModel.parametersChanged()
+
   # I don't see a reason for requiring a user to uncheck a box to set t0 and tn (James)
 
   #def onEnableTimePointRange(self):
@@ -347,7 +733,7 @@ class RegressionComputationWidget(ScriptedLoadableModuleWidget):
   #  self.tn.enabled = not self.defaultTimePointRange.checkState()
 
   #  # Enable/Disable the auto set of the time point range
-  #  table = self.tableWidget_inputShapeParameters
+  #  table = self.tableView_inputShapeParameters
   #  for row in range(table.rowCount):
   #    widget = table.cellWidget(row, 1)
   #    tuple = widget.children()
@@ -360,9 +746,11 @@ class RegressionComputationWidget(ScriptedLoadableModuleWidget):
 
 
   def onSetTimePointRange(self):
-    self.Logic.sortInputCasesAges()
-    self.t0.value = self.Logic.age_list[0]
-    self.tn.value = self.Logic.age_list[-1]
+    timePoints = self.inputShapeParameters.timePoints
+    if len(timePoints) == 0:
+      return
+    self.t0.value = float(timePoints.min())
+    self.tn.value = float(timePoints.max())
 
   #def onSetMaximumStartingTimePoint(self):
   #  self.t0.setMaximum(self.tn.value)
@@ -370,18 +758,633 @@ class RegressionComputationWidget(ScriptedLoadableModuleWidget):
   #def onSetMinimumEndingTimePoint(self):
   #  self.tn.setMinimum(self.t0.value)
 
+  def regressionParameters(self):
+    """ Parameters of the regression set in the interface """
+    parameters = RegressionParameters()
+
+    if self.tabWidget_InputShapes.currentIndex == 0:
+      parameters.inputs = self.inputShapeParameters.regressionInputs()
+    else:
+      pathToCSV = self.PathLineEdit_ShapeInputsCSV.currentPath
+      if not os.path.exists(pathToCSV):
+        raise ValueError('The CSV filepath is not existing.')
+      parameters.inputs = readInputsCSV(pathToCSV)
+
+    parameters.t0 = self.t0.value
+    parameters.tn = self.tn.value
+    parameters.T = self.T.value
+
+    parameters.sigmaV = self.defKernelWidth.value
+    parameters.kernelType = self.kernelType.currentText
+    parameters.gammaR = self.regularityWeight.value
+
+    parameters.estimateBaseline = bool(self.estimateBaseline.checkState())
+    parameters.optimizer = self.optimMethod.currentText
+    parameters.breakRatio = self.breakRatio.value
+    parameters.maxIters = self.maxIters.value
+
+    parameters.outputDirectory = self.outputDirectory.directory
+    parameters.outputPrefix = self.outputPrefix.text
+    parameters.saveEveryN = self.saveEveryN.value
+    return parameters
+
+  def prepareRegression(self, parameters):
+    """ Validate, warm start, preprocess and align the inputs of a regression
+    about to be run, as set in the interface. Raises ValueError if they can not
+    be prepared, OSError if a shape can not be read or written.
+    """
+    # Before the shapes are transformed, so that the report points to the files of the user
+    self.Logic.validateInputs(parameters)
+    if self.warmStart.checked:
+      setWarmStart(parameters, self.warmStartDirectory.directory, self.v0Weight.value)
+    if self.preprocessShapes.checked:
+      settings = preprocessingSettingsStruct()
+      settings.pointsPerKernelWidth = self.pointsPerKernelWidth.value
+      self.Logic.preprocessInputs(parameters, settings)
+    if self.poseAlignment.currentIndex > 0:
+      method = 'procrustes' if 'Procrustes' in self.poseAlignment.currentText else 'icp'
+      self.Logic.alignInputs(parameters, method, scaling=self.poseAlignment.currentText.startswith('Similarity'))
+    return parameters
+
+  def onUseResultCacheToggled(self, checked):
+    if checked:
+      self.Logic.resultCache = RegressionResultCache(os.path.join(slicer.app.cachePath, self.moduleName, 'RegressionResults'),
+                                                     maximumSize=self.resultCacheSize.value * 1024 ** 3)
+    else:
+      self.Logic.resultCache = None
+
+  def onResultCacheSizeChanged(self, size):
+    if self.Logic.resultCache is not None:
+      self.Logic.resultCache.maximumSize = size * 1024 ** 3
+
+  def onClearResultCache(self):
+    # The cache of the logic keeps its index in memory: it must be the one cleared
+    if self.Logic.resultCache is not None:
+      self.Logic.resultCache.clear()
+    else:
+      RegressionResultCache(os.path.join(slicer.app.cachePath, self.moduleName, 'RegressionResults')).clear()
+
+  def regressionPlan(self, parameters):
+    plan = self.Logic.planRegression(parameters, self.memoryLimit.value * 1024 ** 3, self.shapeMetadataCache)
+    self.label_CostEstimate.text = plan.text()
+    self.label_CostEstimate.show()
+    return plan
+
+  def onEstimateCost(self):
+    try:
+      self.regressionPlan(self.regressionParameters())
+    except (ValueError, OSError) as e:
+      self.warningMessage(str(e), None)
+    except Exception as e:
+      logging.exception('The cost of the regression could not be estimated')
+      self.warningMessage('The cost of the regression could not be estimated: {}'.format(e), None)
+
   def onApplyButton(self):
     if self.applyButton.text == "Run Shape4D":
       logging.info('Widget: Running Shape4D')
-      self.CLIProgressBar_shape4D.show()
-      self.CLIProgressBar_shape4D.setCommandLineModuleNode(self.Logic.shape4D_cli_node)
-      self.applyButton.setText("Cancel")
-      self.Logic.runShape4D()
+      try:
+        # Planned on the shapes of the user, so that a regression refused for
+        # its memory is neither preprocessed nor aligned
+        parameters = self.regressionParameters()
+        plan = self.regressionPlan(parameters)
+        if plan.exceedsMemoryLimit:
+          raise ValueError('The regression is estimated to need {:.1f} GB of memory, above the limit of {:.1f} GB.'.format(
+            plan.estimate.peakMemory / 1024.0 ** 3, self.memoryLimit.value))
+        if plan.nearMemoryLimit:
+          logging.warning('The regression is estimated to need {:.1f} GB of memory, close to the limit of {:.1f} GB.'.format(
+            plan.estimate.peakMemory / 1024.0 ** 3, self.memoryLimit.value))
+        parameters = self.prepareRegression(parameters)
+        if self.multiresolutionLevels.value > 1:
+          self.multiresolution = self.Logic.runMultiresolution(parameters, self.multiresolutionLevels.value,
+                                                              self.multiresolutionPointsFraction.value)
+        elif self.autoT.checked:
+          self.autoTimeDiscretization = self.Logic.runAutoT(parameters, self.autoTTolerance.value)
+        else:
+          cli_node = self.Logic.run(parameters, supervisor=self.runSupervisor())
+      except (ValueError, OSError) as e:
+        self.warningMessage(str(e), None)
+        return
+      except Exception as e:
+        logging.exception('Shape4D could not be started')
+        self.warningMessage('Shape4D could not be started: {}'.format(e), None)
+        return
+      if self.multiresolution is not None:
+        self.multiresolutionTelemetry = None
+        self.onMultiresolutionTimeout()
+        self.label_Convergence.show()
+        self.multiresolutionTimer.start()
+        self.applyButton.setText("Cancel")
+        return
+      if self.autoTimeDiscretization is not None:
+        self.autoTTelemetry = None
+        self.onAutoTTimeout()
+        self.label_Convergence.show()
+        self.autoTTimer.start()
+        self.applyButton.setText("Cancel")
+        return
+      if cli_node is None:
+        qt.QMessageBox.information(slicer.util.mainWindow(), 'RegressionComputation',
+                                   'The results of this regression were restored from the cache in {}.'.format(parameters.outputDirectory))
+        return
+      self.showShape4DProgress()
+    elif self.multiresolution is not None:
+      logging.info('Cancel multiresolution Shape4D')
+      self.multiresolution.cancel()
+      self.onMultiresolutionFinished()
+    elif self.autoTimeDiscretization is not None:
+      logging.info('Cancel automatic T Shape4D')
+      self.autoTimeDiscretization.cancel()
+      self.onAutoTFinished()
     else:
       logging.info('Cancel Shape4D')
       self.applyButton.setText("Run Shape4D")
       self.Logic.shape4D_cli_node.SetStatus(self.Logic.shape4D_cli_node.Cancelling)
 
+  def runSupervisor(self):
+    """ Supervisor of a single regression, also set up its memory limit and the packing of its outputs """
+    self.Logic.memoryLimit = self.memoryLimit.value * 1024 ** 3
+    self.Logic.packTrajectory = self.trajectoryContainer.currentIndex > 0
+    self.Logic.quantizeTrajectory = self.trajectoryContainer.currentText.startswith('Quantized')
+    return RunSupervisor(self.wallClockBudget.value * 3600, self.plateauImprovement.value,
+                         self.plateauIterations.value)
+
+  def showShape4DProgress(self):
+    self.CLIProgressBar_shape4D.show()
+    self.CLIProgressBar_shape4D.setCommandLineModuleNode(self.Logic.shape4D_cli_node)
+    self.label_Convergence.text = self.Logic.telemetry.statusText()
+    self.label_Convergence.show()
+    self.label_ResourceUsage.text = self.Logic.resourceMonitor.statusText()
+    self.label_ResourceUsage.show()
+    self.convergenceTimer.start()
+    self.applyButton.setText("Cancel")
+
+  def onResumeButton(self):
+    if self.applyButton.text != "Run Shape4D":
+      self.warningMessage('Shape4D is running, cancel it before resuming a regression.', None)
+      return
+    logging.info('Widget: Resuming Shape4D')
+    try:
+      cli_node = self.Logic.resume(self.outputDirectory.directory, supervisor=self.runSupervisor())
+    except (ValueError, OSError) as e:
+      self.warningMessage(str(e), None)
+      return
+    if cli_node is None:
+      qt.QMessageBox.information(slicer.util.mainWindow(), 'RegressionComputation',
+                                 'The results of this regression were restored from the cache in {}.'.format(self.outputDirectory.directory))
+      return
+    self.showShape4DProgress()
+
+  def onConvergenceTimeout(self):
+    telemetry = self.Logic.updateTelemetry()
+    self.label_Convergence.text = telemetry.statusText()
+    self.label_ResourceUsage.text = self.Logic.resourceMonitor.statusText()
+    if not self.Logic.shape4D_cli_node.IsBusy():
+      self.convergenceTimer.stop()
+
+  def onMultiresolutionTimeout(self):
+    self.multiresolution.poll()
+    level = self.multiresolution.currentLevel
+    if level is None:
+      self.onMultiresolutionFinished()
+      return
+    if self.multiresolutionTelemetry is None or self.multiresolutionTelemetry.outputDirectory != level.parameters.outputDirectory:
+      self.multiresolutionTelemetry = ConvergenceTelemetry(level.parameters.maxIters, level.parameters.outputDirectory,
+                                                           level.parameters.outputPrefix)
+    self.multiresolutionTelemetry.updateFromLogFile(level.process.logFilePath)
+    self.label_Convergence.text = 'Level {} ({:.0%} of the points): {}'.format(
+      level.level, level.pointsFraction, self.multiresolutionTelemetry.statusText())
+
+  def onMultiresolutionFinished(self):
+    self.multiresolutionTimer.stop()
+    multiresolution = self.multiresolution
+    self.multiresolution = None
+    self.applyButton.setText("Run Shape4D")
+    self.label_Convergence.hide()
+    self.Logic.recordProcessRuns(multiresolution.levels, 'multiresolution', self.shapeMetadataCache)
+    lastLevel = [level for level in multiresolution.levels if level.status != 'Idle'][-1]
+    message = 'Multiresolution regression {} at level {}. Time per level: {}'.format(
+      lastLevel.status.lower(), lastLevel.level, multiresolution.levelTimesText())
+    logging.info(message)
+    qt.QMessageBox.information(slicer.util.mainWindow(), 'RegressionComputation', message)
+
+  def stopMultiresolution(self):
+    if self.multiresolution is not None:
+      self.multiresolution.cancel()
+      self.multiresolutionTimer.stop()
+      self.multiresolution = None
+
+  def onAutoTTimeout(self):
+    self.autoTimeDiscretization.poll()
+    level = self.autoTimeDiscretization.currentLevel
+    if level is None:
+      self.onAutoTFinished()
+      return
+    if self.autoTTelemetry is None or self.autoTTelemetry.outputDirectory != level.parameters.outputDirectory:
+      self.autoTTelemetry = ConvergenceTelemetry(level.parameters.maxIters, level.parameters.outputDirectory,
+                                                 level.parameters.outputPrefix)
+    self.autoTTelemetry.updateFromLogFile(level.process.logFilePath)
+    self.label_Convergence.text = 'T={}: {}'.format(level.T, self.autoTTelemetry.statusText())
+
+  def onAutoTFinished(self):
+    self.autoTTimer.stop()
+    autoTimeDiscretization = self.autoTimeDiscretization
+    self.autoTimeDiscretization = None
+    self.applyButton.setText("Run Shape4D")
+    self.label_Convergence.hide()
+    self.Logic.recordProcessRuns(autoTimeDiscretization.levels, 'autoT', self.shapeMetadataCache)
+    message = 'Automatic T: {}'.format(autoTimeDiscretization.reportText())
+    logging.info(message)
+    qt.QMessageBox.information(slicer.util.mainWindow(), 'RegressionComputation', message)
+
+  def stopAutoT(self):
+    if self.autoTimeDiscretization is not None:
+      self.autoTimeDiscretization.cancel()
+      self.autoTTimer.stop()
+      self.autoTimeDiscretization = None
+
+  def onRunSweepButton(self):
+    if self.parameterSweep is None:
+      logging.info('Widget: Running parameter sweep')
+      try:
+        parameterSets = parseParameterSets(self.sweepParameters.plainText)
+        parameters = self.prepareRegression(self.regressionParameters())
+        self.parameterSweep = self.Logic.runSweep(parameters, parameterSets, self.sweepCores.value,
+                                                  self.sweepConcurrentRuns.value)
+      except (ValueError, OSError) as e:
+        self.warningMessage(str(e), None)
+        return
+      self.startSweepProgress(self.runSweepButton, "Cancel Sweep")
+    else:
+      logging.info('Cancel parameter sweep')
+      self.parameterSweep.cancel()
+      self.onSweepFinished()
+
+  def onRunResamplingButton(self):
+    if self.parameterSweep is None:
+      logging.info('Widget: Running resampling')
+      try:
+        parameters = self.prepareRegression(self.regressionParameters())
+        method = 'bootstrap' if self.resamplingMethod.currentText == 'Bootstrap' else 'leave-one-out'
+        self.parameterSweep = self.Logic.runResampling(parameters, method, self.bootstrapReplicates.value,
+                                                       self.subjectPattern.text.strip() or None,
+                                                       self.sweepCores.value, self.sweepConcurrentRuns.value)
+      except (ValueError, OSError) as e:
+        self.warningMessage(str(e), None)
+        return
+      self.startSweepProgress(self.runResamplingButton, "Cancel Resampling")
+    else:
+      logging.info('Cancel resampling')
+      self.parameterSweep.cancel()
+      self.onSweepFinished()
+
+  def onRunGroupsButton(self):
+    if self.parameterSweep is None:
+      logging.info('Widget: Running group regressions')
+      try:
+        if self.tabWidget_InputShapes.currentIndex == 0:
+          raise ValueError('The group regressions need an input CSV file with a group column.')
+        parameters = self.prepareRegression(self.regressionParameters())
+        self.parameterSweep = self.Logic.runGroups(parameters, self.sweepCores.value, self.sweepConcurrentRuns.value)
+      except (ValueError, OSError) as e:
+        self.warningMessage(str(e), None)
+        return
+      self.startSweepProgress(self.runGroupsButton, "Cancel Group Regressions")
+    else:
+      logging.info('Cancel group regressions')
+      self.parameterSweep.cancel()
+      self.onSweepFinished()
+
+  def startSweepProgress(self, button, cancelText):
+    self.progressBar_Sweep.setMaximum(self.parameterSweep.numberOfRuns)
+    self.progressBar_Sweep.setValue(self.parameterSweep.numberOfFinishedRuns)
+    self.progressBar_Sweep.show()
+    # The sweep, the resampling and the group regressions share the progress bar
+    for sweepButton in (self.runSweepButton, self.runResamplingButton, self.runGroupsButton):
+      sweepButton.enabled = sweepButton is button
+    button.setText(cancelText)
+    self.sweepTimer.start()
+
+  def onSweepTimeout(self):
+    running = self.parameterSweep.poll()
+    self.progressBar_Sweep.setValue(self.parameterSweep.numberOfFinishedRuns)
+    if not running:
+      self.onSweepFinished()
+
+  def onSweepFinished(self):
+    self.sweepTimer.stop()
+    parameterSweep = self.parameterSweep
+    self.parameterSweep = None
+    self.runSweepButton.setText("Run Sweep")
+    self.runResamplingButton.setText("Run Resampling")
+    self.runGroupsButton.setText("Run Group Regressions")
+    for sweepButton in (self.runSweepButton, self.runResamplingButton, self.runGroupsButton):
+      sweepButton.enabled = True
+    self.progressBar_Sweep.hide()
+    if isinstance(parameterSweep, ResamplingRegression):
+      launcher = 'resampling'
+    elif isinstance(parameterSweep, GroupRegression):
+      launcher = 'groups'
+    else:
+      launcher = 'sweep'
+    self.Logic.recordProcessRuns(parameterSweep.runs, launcher, self.shapeMetadataCache)
+    if os.path.exists(parameterSweep.summaryFilePath):
+      slicer.util.loadTable(parameterSweep.summaryFilePath)
+    if isinstance(parameterSweep, ResamplingRegression) and len(parameterSweep.finishedOutputDirectories()) > 1:
+      logging.info('Computing the resampling statistics')
+      self.resamplingStatisticsFutures.append(self.resamplingStatisticsExecutor.submit(parameterSweep.computeStatistics))
+      self.resamplingStatisticsTimer.start()
+
+  def onResamplingStatisticsTimeout(self):
+    for future in [future for future in self.resamplingStatisticsFutures if future.done()]:
+      self.resamplingStatisticsFutures.remove(future)
+      try:
+        slicer.util.loadTable(future.result())
+      except (ValueError, OSError) as e:
+        self.warningMessage('The resampling statistics could not be computed.', str(e))
+    if len(self.resamplingStatisticsFutures) == 0:
+      self.resamplingStatisticsTimer.stop()
+
+  def stopResamplingStatistics(self):
+    # Statistics already being computed are finished by the worker, but not loaded
+    for future in self.resamplingStatisticsFutures:
+      future.cancel()
+    self.resamplingStatisticsFutures = []
+    self.resamplingStatisticsTimer.stop()
+
+  def stopSweep(self):
+    if self.parameterSweep is not None:
+      self.parameterSweep.cancel()
+      self.sweepTimer.stop()
+      self.parameterSweep = None
+
+  def selectedJobId(self):
+    row = self.tableWidget_Jobs.currentRow()
+    if row < 0 or self.tableWidget_Jobs.item(row, 0) is None:
+      self.warningMessage('Select a job in the queue.', None)
+      return None
+    return int(self.tableWidget_Jobs.item(row, 0).text())
+
+  def updateJobTable(self):
+    if self.Logic.jobQueue is None:
+      return
+    selectedJobId = None
+    row = self.tableWidget_Jobs.currentRow()
+    if row >= 0 and self.tableWidget_Jobs.item(row, 0) is not None:
+      selectedJobId = int(self.tableWidget_Jobs.item(row, 0).text())
+    jobs = self.Logic.jobQueue.jobs()
+    self.tableWidget_Jobs.setRowCount(len(jobs))
+    for row, job in enumerate(jobs):
+      status = job.status
+      if job.cancelRequested:
+        status += ' (cancelling)'
+      elif job.message:
+        status += ': ' + job.message
+      values = [job.id, job.name, job.priority, status, '{:.0f}s'.format(job.elapsedTime), job.attempts,
+                job.outputDirectory]
+      for column, value in enumerate(values):
+        item = qt.QTableWidgetItem(str(value))
+        self.tableWidget_Jobs.setItem(row, column, item)
+      if job.id == selectedJobId:
+        self.tableWidget_Jobs.setCurrentCell(row, 0)
+
+  def onAddJob(self):
+    logging.info('Widget: Adding a job to the queue')
+    try:
+      parameters = self.prepareRegression(self.regressionParameters())
+      self.Logic.submitJob(parameters, self.jobPriority.value)
+    except (ValueError, OSError, sqlite3.Error) as e:
+      self.warningMessage(str(e), None)
+      return
+    self.updateJobTable()
+
+  def onCancelJob(self):
+    jobId = self.selectedJobId()
+    if jobId is not None:
+      self.Logic.jobQueue.cancel(jobId)
+      self.updateJobTable()
+
+  def onRetryJob(self):
+    jobId = self.selectedJobId()
+    if jobId is not None:
+      self.Logic.jobQueue.retry(jobId)
+      self.updateJobTable()
+
+  def onSetJobPriority(self):
+    jobId = self.selectedJobId()
+    if jobId is not None:
+      self.Logic.jobQueue.setPriority(jobId, self.jobPriority.value)
+      self.updateJobTable()
+
+  def onRemoveJob(self):
+    jobId = self.selectedJobId()
+    if jobId is not None:
+      self.Logic.jobQueue.remove(jobId)
+      self.updateJobTable()
+
+  def onConcurrentJobsChanged(self, value):
+    if self.Logic.jobRunner is not None:
+      self.Logic.jobRunner.maximumRunningJobs = value
+
+  def onRunJobQueueButton(self):
+    if self.Logic.jobRunner is None:
+      logging.info('Widget: Running the job queue')
+      self.Logic.memoryLimit = self.memoryLimit.value * 1024 ** 3
+      try:
+        self.Logic.startJobQueue(self.concurrentJobs.value)
+      except (OSError, sqlite3.Error) as e:
+        self.warningMessage(str(e), None)
+        return
+      self.runJobQueueButton.setText("Stop Queue")
+      self.jobQueueTimer.start()
+      self.onJobQueueTimeout()
+    else:
+      logging.info('Stop the job queue')
+      self.stopJobQueue()
+      self.runJobQueueButton.setText("Run Queue")
+      self.updateJobTable()
+
+  def onJobQueueTimeout(self):
+    # The queue keeps running while it is started: jobs may be added at any time
+    self.Logic.jobRunner.poll()
+    self.updateJobTable()
+
+  def stopJobQueue(self):
+    """ Cancel the running jobs, which are queued again """
+    if self.Logic.jobRunner is not None:
+      self.jobQueueTimer.stop()
+      self.Logic.stopJobQueue()
+
+  def onRefreshRunLedger(self):
+    try:
+      runLedger = self.Logic.openRunLedger()
+      report = self.runLedgerReport.currentIndex
+      if report == 0:
+        table = runLedger.slowestRuns()
+      elif report == 1:
+        table = runLedger.timePerVertexIterationByKernel()
+      else:
+        table = runLedger.versionTrends()
+      regressions = runLedger.performanceRegressions()
+    except (OSError, sqlite3.Error) as e:
+      self.warningMessage('The run ledger could not be read.', str(e))
+      return
+    self.tableWidget_RunLedger.clear()
+    self.tableWidget_RunLedger.setColumnCount(len(table.columns))
+    self.tableWidget_RunLedger.setHorizontalHeaderLabels(table.columns)
+    self.tableWidget_RunLedger.setRowCount(len(table.rows))
+    for row, values in enumerate(table.rows):
+      for column, value in enumerate(values):
+        if isinstance(value, float):
+          value = '{:.4g}'.format(value)
+        self.tableWidget_RunLedger.setItem(row, column, qt.QTableWidgetItem('' if value is None else str(value)))
+    self.label_PerformanceRegressions.text = '\n'.join(
+      'Performance regression: {} is {:.1f} times slower than {} with the {} kernel'.format(version, ratio, previousVersion, kernelType)
+      for kernelType, previousVersion, version, ratio in regressions)
+    self.label_PerformanceRegressions.visible = len(regressions) > 0
+
+#
+# CLIShape4DProcess
+#
+class CLIShape4DProcess(object):
+  """ Run shape4D on a driver file in its own shape4D CLI node, with the
+  interface of Shape4DProcess. shape4D is started by the CLI module logic,
+  in the environment of the Slicer launcher, as for a single regression.
+  The output of shape4D is written in logFilePath as it is received.
+  """
+
+  def __init__(self, module, XMLdriverfilepath, name='Shape4D', finishedCallback=None):
+    self.module = module
+    self.XMLdriverfilepath = XMLdriverfilepath
+    self.logFilePath = os.path.join(os.path.dirname(XMLdriverfilepath), Shape4DLogFileName) if XMLdriverfilepath else None
+    # Called with the process when shape4D is finished
+    self.finishedCallback = finishedCallback
+    self.node = slicer.cli.createNode(module)
+    self.node.SetName(name)
+    self.resourceMonitor = None
+    self.cancelled = False
+    self.released = False
+    self.startTime = None
+    self.endTime = None
+    # Kept when the node is removed from the scene at the end of the run
+    self.status = None
+    self.statusText = None
+    self.outputText = ''
+
+  def start(self):
+    self.startTime = time.time()
+    open(self.logFilePath, 'w').close()
+    slicer.cli.run(self.module, self.node, {'inputXML': self.XMLdriverfilepath}, wait_for_completion=False)
+    return self
+
+  def isBusy(self):
+    return self.startTime is not None and self.endTime is None
+
+  def poll(self):
+    if self.endTime is not None:
+      return self.status
+    if self.node.IsBusy():
+      self.updateLogFile()
+      self.sampleResources()
+      return None
+    self.endTime = time.time()
+    self.status = self.node.GetStatus()
+    self.statusText = self.node.GetStatusString()
+    self.updateLogFile()
+    # One node per run would otherwise be left in the scene
+    self.removeNode()
+    if self.finishedCallback is not None:
+      self.finishedCallback(self)
+    return self.status
+
+  def updateLogFile(self):
+    """ Write the output of shape4D received since the last update in the log file """
+    outputText = self.node.GetOutputText()
+    if outputText == self.outputText:
+      return
+    if outputText.startswith(self.outputText):
+      with open(self.logFilePath, 'a') as logFile:
+        logFile.write(outputText[len(self.outputText):])
+    else:
+      with open(self.logFilePath, 'w') as logFile:
+        logFile.write(outputText)
+    self.outputText = outputText
+
+  def sampleResources(self):
+    pass
+
+  def statusString(self):
+    if self.node is None:
+      return self.statusText or 'Cancelled'
+    if self.cancelled:
+      return 'Cancelled'
+    return self.node.GetStatusString()
+
+  def cancel(self):
+    """ Cancel shape4D. The run is finished once shape4D stopped, even if it is not polled anymore. """
+    if self.node is None or not self.node.IsBusy():
+      return
+    self.cancelled = True
+    self.node.SetStatus(self.node.Cancelling)
+    self.release()
+
+  def removeNode(self):
+    if self.node is not None:
+      slicer.mrmlScene.RemoveNode(self.node)
+      self.node = None
+
+  def release(self):
+    """ Finish the run once shape4D stopped, for a run that is not polled anymore """
+    if self.endTime is not None or self.released:
+      return
+    self.released = True
+    if not self.node.IsBusy():
+      self.poll()
+      return
+    self.node.AddObserver(slicer.vtkMRMLCommandLineModuleNode().StatusModifiedEvent, self.onReleasedNodeModified)
+
+  def onReleasedNodeModified(self, node, event):
+    if not node.IsBusy():
+      # Not removed while it is invoking its own event
+      qt.QTimer.singleShot(0, self.poll)
+
+  @property
+  def wallTime(self):
+    if self.startTime is None:
+      return 0.0
+    return (self.endTime or time.time()) - self.startTime
+
+#
+# CLIJobProcess
+#
+class CLIJobProcess(CLIShape4DProcess):
+  """ Run a job of the queue in its own shape4D CLI node, with the
+  interface of Shape4DProcess used by JobRunner
+  """
+
+  def __init__(self, module, job, memoryLimit=None, finishedCallback=None):
+    CLIShape4DProcess.__init__(self, module, None, 'Shape4D {}'.format(job.name), finishedCallback)
+    self.job = job
+    self.memoryLimit = memoryLimit
+
+  def start(self):
+    self.XMLdriverfilepath = writeJobInputFiles(self.job)
+    self.logFilePath = os.path.join(self.job.parameters.outputDirectory, Shape4DLogFileName)
+    self.resourceMonitor = ResourceMonitor(commandLineArgument=self.XMLdriverfilepath, parentPid=os.getpid(),
+                                           memoryLimit=self.memoryLimit,
+                                           outputFilePath=os.path.join(self.job.parameters.outputDirectory, ResourceUsageFileName))
+    return CLIShape4DProcess.start(self)
+
+  def sampleResources(self):
+    if self.resourceMonitor.stopReason is None and self.resourceMonitor.sample() is not None:
+      if self.resourceMonitor.stopReason is not None:
+        logging.error("Job {} stopped: {}".format(self.job.id, self.resourceMonitor.stopReason))
+        self.cancel()
+
+  def statusString(self):
+    if self.resourceMonitor is not None and self.resourceMonitor.stopReason is not None:
+      return 'Completed with errors'
+    return CLIShape4DProcess.statusString(self)
+
 #
 # RegressionComputationLogic
 #
@@ -390,9 +1393,10 @@ class RegressionComputationLogic(ScriptedLoadableModuleLogic, VTKObservationMixi
   Uses ScriptedLoadableModuleLogic base class, available at:
   https://github.com/Slicer/Slicer/blob/master/Base/Python/slicer/ScriptedLoadableModule.py
   """
-  def __init__(self, interface):
+  def __init__(self, interface=None):
     VTKObservationMixin.__init__(self)
 
+    # The interface is optional: the logic only needs RegressionParameters
     self.interface = interface
     self.StatusModifiedEvent = slicer.vtkMRMLCommandLineModuleNode().StatusModifiedEvent
     self.shape4D_module = slicer.modules.shape4d
@@ -400,173 +1404,297 @@ class RegressionComputationLogic(ScriptedLoadableModuleLogic, VTKObservationMixi
     shape4D_cli_node_name = "Shape4D"
     self.shape4D_cli_node.SetName(shape4D_cli_node_name)
 
-  def runShape4D(self):
+    # The results of the regressions are only cached if a RegressionResultCache is set
+    self.resultCache = None
+    self.runningParameters = None
+    self.resultCacheKey = None
+
+    # Convergence of the running regression, and supervisor stopping it early
+    self.telemetry = None
+    self.supervisor = None
+    self.convergenceTableNode = None
+    self.convergenceChartNode = None
+
+    # Pack the final shapes of the completed regressions in a trajectory container
+    self.packTrajectory = False
+    self.quantizeTrajectory = False
+
+    # Resources used by the running regression, stopped before its memory crosses memoryLimit (bytes)
+    self.resourceMonitor = None
+    self.memoryLimit = None
+
+    # Persistent queue of regressions, and runner of its jobs in CLI nodes
+    self.jobQueue = None
+    self.jobRunner = None
+
+    # Ledger of the regressions run, opened at the first record
+    self.runLedger = None
+
+  def run(self, parameters, wait_for_completion=False, supervisor=None):
+    """ Write the CSV and driver files of the regression in its output
+    directory and run shape4D. Raises ValueError if the parameters are invalid.
+    Returns None instead of the CLI node if the results were restored from the
+    result cache. The RunSupervisor, if any, is checked at each telemetry update.
+    """
     logging.debug("Run Shape4D")
+    errorMessage = parameters.checkInputs()
+    if errorMessage is not None:
+      logging.error(errorMessage)
+      raise ValueError(errorMessage)
 
     # Write XML driver file input
-    XMLdriverfilepath = self.writeXMLdriverFile()
+    XMLdriverfilepath = writeInputFiles(parameters)
+    logging.debug(XMLdriverfilepath)
+
+    # Restore the results of the same regression if they are cached
+    if self.resultCache is not None:
+      self.resultCacheKey = self.resultCache.key(parameters)
+      if self.resultCache.restore(parameters, self.resultCacheKey) is not None:
+        logging.info("Shape4D results restored from the cache")
+        return None
+    self.runningParameters = parameters
+    self.telemetry = ConvergenceTelemetry(parameters.maxIters, parameters.outputDirectory, parameters.outputPrefix)
+    self.supervisor = supervisor if supervisor is not None and supervisor.enabled else None
+    # The CLI module runs shape4D as a child of Slicer, found by its driver file
+    self.resourceMonitor = ResourceMonitor(commandLineArgument=XMLdriverfilepath, parentPid=os.getpid(),
+                                           memoryLimit=self.memoryLimit,
+                                           outputFilePath=os.path.join(parameters.outputDirectory, ResourceUsageFileName))
 
     # Call Shape4D
-    if XMLdriverfilepath:
-      parameters = {}
-      logging.debug(XMLdriverfilepath)
-      parameters["inputXML"] = XMLdriverfilepath
-      self.addObserver(self.shape4D_cli_node, self.StatusModifiedEvent, self.onCLIModuleModified)
-      slicer.cli.run(self.shape4D_module, self.shape4D_cli_node, parameters, wait_for_completion=False)
-    else:
-      self.interface.applyButton.setText("Run Shape4D")
-
-  def writeXMLdriverFile(self):
-    logging.debug("Write XML driver file")
-
-    useFista = False
-    if (self.interface.optimMethod.currentText == "FISTA"):
-      useFista = True
-
-    if self.interface.tabWidget_InputShapes.currentIndex == 0:
-      # Write CSV file containing the parameters for each shapes
-      self.pathToCSV = self.writeCSVInputshapesparameters()
-    else:
-      self.pathToCSV = self.interface.PathLineEdit_ShapeInputsCSV.currentPath
-      if not os.path.exists(self.pathToCSV):
-        self.interface.warningMessage('The CSV filepath is not existing.', None)
-        return
-    # Read CSV file containing the parameters for each shapes
-    findInputShape = self.readCSVFile(self.pathToCSV)
-    if not findInputShape:
-      return False
-
-    if sys.platform == 'win32':
-      experimentName = "/ShapeRegression"
-      outputDir = self.interface.outputDirectory.directory
-      prefix = "/" + self.interface.outputPrefix.text
-    else:
-      experimentName = "ShapeRegression/"
-      outputDir = self.interface.outputDirectory.directory + "/"
-      prefix = self.interface.outputPrefix.text
-
-    # Write XML file
-    fileContents = ""
-
-    fileContents += "<?xml version=\"1.0\">\n"
-    fileContents += "<experiment name=\"" + experimentName + "\">\n"
-
-    fileContents += "  <algorithm name=\"RegressionAccel\">\n"
-    fileContents += "    <source>\n"
-    fileContents += "      <input>\n"
-    fileContents += "        <shape> " + self.shapePaths[0] + " </shape>\n"
-    fileContents += "      </input>\n"
-    fileContents += "      <sigmaV> " + str(self.interface.defKernelWidth.value) + " </sigmaV>\n"
-    fileContents += "      <gammaR> " + str(self.interface.regularityWeight.value) + " </gammaR>\n"
-    fileContents += "      <t0> " + str(self.interface.t0.value) + " </t0>\n"
-    fileContents += "      <tn> " + str(self.interface.tn.value) + " </tn>\n"
-    fileContents += "      <T> " + str(self.interface.T.value) + " </T>\n"
-    fileContents += "      <kernelType> " + self.interface.kernelType.currentText + " </kernelType>\n"
-    fileContents += "      <useInitV0> 0 </useInitV0>\n"
-    fileContents += "      <v0weight> 0.0 </v0weight>\n"
-    fileContents += "      <estimateBaseline> " + str(int(self.interface.estimateBaseline.checkState())) + " </estimateBaseline>\n"
-    fileContents += "      <useFista> " + str(int(useFista)) + " </useFista>\n"
-    fileContents += "      <maxIters> " + str(self.interface.maxIters.value) + " </maxIters>\n"
-    fileContents += "      <breakRatio> " + str(self.interface.breakRatio.value) + " </breakRatio>\n"
-    fileContents += "      <output>\n"
-    fileContents += "        <saveProgress> " + str(self.interface.saveEveryN.value) + " </saveProgress>\n"
-    fileContents += "        <dir> " + outputDir + " </dir>\n"
-    fileContents += "        <prefix> " + prefix + " </prefix>\n"
-    fileContents += "      </output>\n"
-    fileContents += "    </source>\n"
-    fileContents += "    <targets>\n"
-
-    for i in range(0, len(self.shapePaths)):
-
-      fileContents += "      <target>\n"
-      fileContents += "        <shape> " + self.shapePaths[i] + " </shape>\n"
-      fileContents += "        <type> SURFACE </type>\n"
-      fileContents += "        <tris> " + self.shapeIndices[i] + " </tris>\n"
-      fileContents += "        <sigmaW> " + self.sigmaWs[i] + " </sigmaW>\n"
-      fileContents += "        <timept> " + self.timepts[i] + " </timept>\n"
-      fileContents += "        <weight> " + self.weights[i] + " </weight>\n"
-      fileContents += "      </target>\n"
-
-    fileContents += "    </targets>\n"
-    fileContents += "  </algorithm>\n"
-    fileContents += "</experiment>\n"
-
-    XMLdriverfilepath = os.path.join(self.interface.outputDirectory.directory, "driver.xml")
-    f = open(XMLdriverfilepath, 'w')
-    f.write(fileContents)
-    f.close()
-    return XMLdriverfilepath
-
-  def sortInputCasesAges(self):
-    table = self.interface.tableWidget_inputShapeParameters
-    # Sort the shape input data according to their age
-    age_list = list()
-    for row in range(table.rowCount):
-      widget = table.cellWidget(row, 1)
-      tuple = widget.children()
-      spinbox = tuple[1]
-      age_list.append(spinbox.value)
-
-    self.age_list = sorted(age_list)
-
-  def writeCSVInputshapesparameters(self):
-    inputShapesDirectory = self.interface.shapeInputDirectory.directory
-    outputDirectory = self.interface.outputDirectory.directory
-    table = self.interface.tableWidget_inputShapeParameters
-
-    # Sort the shape input data according to their age
-    self.sortInputCasesAges()
-
-    parameters_list = list()
-    for row in range(table.rowCount):
-      temp_parameters = list()
-      inputshaperootname = table.cellWidget(row, 0).text
-      inputshapefilepath = inputShapesDirectory + "/" + inputshaperootname + ".vtk"
-      temp_parameters.append(inputshapefilepath)
-      for column in range(1, table.columnCount):
-        widget = table.cellWidget(row, column)
-        tuple = widget.children()
-        spinbox = tuple[1]
-        temp_parameters.append(spinbox.value)
-      parameters_list.append(temp_parameters)
-
-    parameters_sorted = sorted(parameters_list, key=lambda x: x[1])
-    # Write the parameters needed in a CSV file
-    CSVInputshapesparametersfilepath = os.path.join(outputDirectory, "CSVInputshapesparameters.csv")
-    file = open(CSVInputshapesparametersfilepath, 'w')
-    cw = csv.writer(file, delimiter=',', lineterminator='\n')
-    for index in range(len(parameters_sorted)):
-      parameters = parameters_sorted[index]
-      cw.writerow(parameters)
-    file.close()
-
-    return CSVInputshapesparametersfilepath
-
-  def readCSVFile(self, pathToCSV):
-
-    self.shapePaths = []
-    self.timepts = []
-    self.sigmaWs = []
-    self.shapeIndices = []
-    self.weights = []
-
-    with open(pathToCSV) as csvfile:
-      allRows = csv.reader(csvfile, delimiter=',', quotechar='|')
-      for row in allRows:
-        self.shapePaths.append(row[0].strip())
-        self.timepts.append(row[1].strip())
-        self.sigmaWs.append(row[2].strip())
-        self.shapeIndices.append(row[3].strip())
-        self.weights.append(row[4].strip())
-
-    if len(self.shapePaths) == 0:
-      self.interface.warningMessage('No shape input found', None)
-      return False
-    if len(self.shapePaths) == 1:
-      self.interface.warningMessage('Only one shape input found. The module need at least 2 shape inputs.', None)
-      return False
+    cliParameters = {}
+    cliParameters["inputXML"] = XMLdriverfilepath
+    self.addObserver(self.shape4D_cli_node, self.StatusModifiedEvent, self.onCLIModuleModified)
+    slicer.cli.run(self.shape4D_module, self.shape4D_cli_node, cliParameters, wait_for_completion=wait_for_completion)
+    return self.shape4D_cli_node
+
+  def resume(self, outputDirectory, parameters=None, wait_for_completion=False, supervisor=None):
+    """ Resume the interrupted regression in the output directory from its
+    latest progress snapshot, see Resume.resumeParameters. The parameters are
+    read from the driver file of the directory if not given. Raises ValueError
+    if the regression can not be resumed. Returns as run.
+    """
+    logging.debug("Resume Shape4D")
+    parameters = resumeParameters(outputDirectory, parameters)
+    logging.info(resumeReport(outputDirectory))
+    return self.run(parameters, wait_for_completion=wait_for_completion, supervisor=supervisor)
+
+  def validateInputs(self, parameters):
+    """ Check the input shapes before shape4D is launched, and write the
+    report in the output directory if it exists. Raises ValueError if the
+    inputs have errors. Returns the report.
+    """
+    report = validateInputs(parameters)
+    if os.path.isdir(parameters.outputDirectory):
+      report.writeReport(os.path.join(parameters.outputDirectory, InputValidationReportFileName))
+    for line in report.issueLines('warning'):
+      logging.warning(line)
+    if report.hasErrors:
+      raise ValueError('The input shapes have errors, shape4D is not launched:\n' + report.text())
+    return report
+
+  def preprocessInputs(self, parameters, settings):
+    """ Replace the input shapes of the regression by their triangulated,
+    cleaned and decimated version, from the cache of the processed shapes when
+    possible. Raises ValueError if the input shapes do not exist.
+    """
+    for regressionInput in parameters.inputs:
+      if not os.path.exists(regressionInput.shapePath):
+        raise ValueError('The input shape {} does not exist.'.format(regressionInput.shapePath))
+    cache = PreprocessedShapeCache(os.path.join(slicer.app.cachePath, 'RegressionComputation', 'PreprocessedShapes'))
+    return preprocessInputs(parameters, settings, cache)
+
+  def alignInputs(self, parameters, method='icp', scaling=True):
+    """ Align the input shapes of the regression on the shape of its earliest
+    time point, and replace them by the aligned shapes written in the output
+    directory. Raises ValueError if the parameters are invalid.
+    """
+    errorMessage = parameters.checkInputs()
+    if errorMessage is not None:
+      raise ValueError(errorMessage)
+    return alignInputs(parameters, method, scaling)
+
+  def planRegression(self, parameters, memoryLimit=None, shapeMetadataCache=None):
+    """ Estimate the runtime and the peak memory of the regression with each
+    kernel type. The estimates are calibrated by a benchmark of this machine,
+    run once. Raises ValueError if the parameters are invalid.
+    """
+    errorMessage = parameters.checkInputs()
+    if errorMessage is not None:
+      raise ValueError(errorMessage)
+    shapeMetadata = shapeMetadataForInputs(parameters.inputs, shapeMetadataCache)
+    if shapeMetadataCache is not None:
+      shapeMetadataCache.save()
+    calibration = loadCalibration(os.path.join(slicer.app.cachePath, 'RegressionComputation', 'CostCalibration.json'))
+    plan = planRegression(parameters, shapeMetadata, calibration, memoryLimit)
+    logging.info(plan.text())
+    return plan
+
+  def startShape4DProcess(self, XMLdriverfilepath, numberOfThreads=None):
+    """ Start shape4D on a driver file in its own CLI node, for the runs of
+    the sweeps and the levels of the multiresolution and automatic T
+    regressions. The number of threads of a CLI node can not be set:
+    numberOfThreads is not applied.
+    """
+    name = 'Shape4D {}'.format(os.path.basename(os.path.dirname(XMLdriverfilepath)))
+    return CLIShape4DProcess(self.shape4D_module, XMLdriverfilepath, name).start()
 
-    return True
+  def runMultiresolution(self, parameters, numberOfLevels, pointsFraction):
+    """ Start a coarse to fine regression. Returns the MultiresolutionRegression,
+    to be polled until it is finished. Raises ValueError if the parameters are invalid.
+    """
+    logging.debug("Run multiresolution Shape4D")
+    multiresolution = MultiresolutionRegression(parameters, numberOfLevels, pointsFraction,
+                                                startProcess=self.startShape4DProcess)
+    return multiresolution.start()
+
+  def runAutoT(self, parameters, tolerance, initialT=None):
+    """ Start the automatic selection of T, from initialT (by default a
+    quarter of parameters.T, at least 10) up to parameters.T.
+    Returns the AutoTimeDiscretization, to be polled until it is finished.
+    Raises ValueError if the parameters are invalid.
+    """
+    logging.debug("Run automatic T Shape4D")
+    autoTimeDiscretization = AutoTimeDiscretization(parameters, tolerance, initialT,
+                                                    startProcess=self.startShape4DProcess)
+    return autoTimeDiscretization.start()
+
+  def runSweep(self, parameters, parameterSets, numberOfCores=None, numberOfConcurrentRuns=None):
+    """ Start a sweep of the parameters sets, each run in its own subdirectory
+    of the output directory. Returns the ParameterSweep, to be polled until it
+    is finished. Raises ValueError if the parameters are invalid.
+    """
+    logging.debug("Run parameter sweep")
+    sweep = ParameterSweep(parameters, parameterSets, numberOfCores=numberOfCores,
+                           numberOfConcurrentRuns=numberOfConcurrentRuns, resultCache=self.resultCache,
+                           startProcess=self.startShape4DProcess)
+    return sweep.start()
+
+  def runGroups(self, parameters, numberOfCores=None, numberOfConcurrentRuns=None):
+    """ Start one regression per group of the inputs, in the Groups
+    subdirectory of the output directory. Returns the GroupRegression, to be
+    polled until it is finished. Raises ValueError if the parameters are invalid.
+    """
+    logging.debug("Run group regressions")
+    groupRegression = GroupRegression(parameters, numberOfCores=numberOfCores, numberOfConcurrentRuns=numberOfConcurrentRuns,
+                                      resultCache=self.resultCache, startProcess=self.startShape4DProcess)
+    return groupRegression.start()
+
+  def runResampling(self, parameters, method='leave-one-out', numberOfReplicates=100, subjectPattern=None,
+                    numberOfCores=None, numberOfConcurrentRuns=None, warmStartDirectory=None):
+    """ Start the replicates of a leave-one-subject-out or bootstrap
+    resampling, in the Resampling subdirectory of the output directory.
+    Returns the ResamplingRegression, to be polled until it is finished, and
+    whose statistics are then computed. Raises ValueError if the parameters
+    are invalid.
+    """
+    logging.debug("Run resampling")
+    resampling = ResamplingRegression(parameters, method, numberOfReplicates, subjectPattern,
+                                      warmStartDirectory=warmStartDirectory, numberOfCores=numberOfCores,
+                                      numberOfConcurrentRuns=numberOfConcurrentRuns, resultCache=self.resultCache,
+                                      startProcess=self.startShape4DProcess)
+    return resampling.start()
+
+  def runBenchmark(self, workingDirectory, cases=None, **caseOptions):
+    """ Time the phases of the pipeline on synthetic cohorts, see
+    Benchmark.runBenchmark. The phases of RegressionVisualization are timed
+    with its widget if the module is loaded. Returns the results, also
+    written in benchmark.json in workingDirectory.
+    """
+    logging.debug("Run benchmark")
+    return runBenchmark(workingDirectory, cases=cases, executable=self.shape4D_module.path,
+                        visualizationWidget=getattr(slicer.modules, 'RegressionVisualizationWidget', None), **caseOptions)
+
+  def openJobQueue(self, queueFilePath=None):
+    """ Open the persistent job queue, by default in the Slicer settings
+    directory, shared with the workers draining it headlessly
+    (python -m RegressionComputationLib.JobQueue <queueFilePath>).
+    """
+    if queueFilePath is None:
+      queueFilePath = os.path.join(os.path.dirname(slicer.app.slicerUserSettingsFilePath), 'RegressionComputation',
+                                   'JobQueue.sqlite')
+    self.stopJobQueue()
+    if self.jobQueue is not None:
+      self.jobQueue.close()
+    self.jobQueue = JobQueue(queueFilePath)
+    return self.jobQueue
+
+  def submitJob(self, parameters, priority=0, name=None):
+    """ Add a regression to the job queue. It is run in its own
+    subdirectory of Jobs in the output directory. Raises ValueError if the
+    parameters are invalid. Returns the job.
+    """
+    errorMessage = parameters.checkInputs()
+    if errorMessage is not None:
+      logging.error(errorMessage)
+      raise ValueError(errorMessage)
+    if self.jobQueue is None:
+      self.openJobQueue()
+    return self.jobQueue.submit(parameters, priority, name)
+
+  def startJobQueue(self, maximumRunningJobs=1):
+    """ Run the queued jobs, each in its own shape4D CLI node. Returns the
+    JobRunner, to be polled until the queue is stopped.
+    """
+    if self.jobQueue is None:
+      self.openJobQueue()
+    if self.jobRunner is None:
+      self.jobRunner = JobRunner(self.jobQueue, maximumRunningJobs,
+                                 startJob=lambda job: CLIJobProcess(self.shape4D_module, job, self.memoryLimit,
+                                                                    self.recordJobRun).start())
+    return self.jobRunner
+
+  def stopJobQueue(self):
+    if self.jobRunner is not None:
+      processes = [process for job, process in self.jobRunner.runningJobs.values()]
+      self.jobRunner.stop()
+      self.jobRunner = None
+      for process in processes:
+        process.release()
+
+  def openRunLedger(self, ledgerFilePath=None):
+    """ Open the run ledger, by default in the Slicer settings directory.
+    Returns the ledger already open if no path is given.
+    """
+    if ledgerFilePath is None:
+      if self.runLedger is not None:
+        return self.runLedger
+      ledgerFilePath = os.path.join(os.path.dirname(slicer.app.slicerUserSettingsFilePath), 'RegressionComputation',
+                                    RunLedgerFileName)
+    if self.runLedger is not None:
+      self.runLedger.close()
+    self.runLedger = RunLedger(ledgerFilePath)
+    # The version of shape4D is read in the background before the first run is recorded
+    shape4DVersionFuture(self.shape4D_module.path)
+    return self.runLedger
+
+  def recordRun(self, parameters, status, wallTime, iterations=None, finalObjective=None, peakMemory=None,
+                launcher='single', shapeMetadataCache=None):
+    """ Append a run to the run ledger. A run that can not be recorded is only logged. """
+    try:
+      return self.openRunLedger().recordRun(parameters, status, wallTime, iterations, finalObjective, peakMemory,
+                                            executable=self.shape4D_module.path, launcher=launcher,
+                                            shapeMetadataCache=shapeMetadataCache)
+    except (OSError, sqlite3.Error) as e:
+      logging.warning("The run could not be recorded in the run ledger: {}".format(e))
+      return None
+
+  def recordProcessRuns(self, runs, launcher, shapeMetadataCache=None):
+    """ Append the started runs of a sweep, a multiresolution or an automatic T regression to the run ledger """
+    try:
+      return self.openRunLedger().recordProcessRuns(runs, executable=self.shape4D_module.path, launcher=launcher,
+                                                    shapeMetadataCache=shapeMetadataCache)
+    except (OSError, sqlite3.Error) as e:
+      logging.warning("The runs could not be recorded in the run ledger: {}".format(e))
+      return []
+
+  def recordJobRun(self, process):
+    telemetry = ConvergenceTelemetry()
+    telemetry.update(process.outputText)
+    status = process.statusString()
+    if process.resourceMonitor.stopReason is not None:
+      status = 'Stopped by the resource monitor: {}'.format(process.resourceMonitor.stopReason)
+    return self.recordRun(process.job.parameters, status, process.wallTime, telemetry.iteration,
+                          telemetry.objective, process.resourceMonitor.peakMemory, launcher='job')
 
   def onCLIModuleModified(self, cli_node, event):
     statusForNode = None
@@ -575,8 +1703,48 @@ class RegressionComputationLogic(ScriptedLoadableModuleLogic, VTKObservationMixi
         self.removeObserver(cli_node, self.StatusModifiedEvent, self.onCLIModuleModified)
         statusForNode = None
 
+      # Keep the output of shape4D with the results, as done for the runs outside of Slicer.
+      # Each step is guarded, so that a step that fails does not skip the next ones.
+      parameters = self.runningParameters
+      self.runningParameters = None
+      if parameters is not None:
+        self.runFinishingStep('Writing the log of shape4D', self.writeShape4DLog, parameters, cli_node.GetOutputText())
+        self.runFinishingStep('Writing the convergence telemetry', self.writeTelemetry)
+        peakMemory = self.resourceMonitor.peakMemory if self.resourceMonitor is not None else None
+        if peakMemory is not None:
+          logging.info("Shape4D peak memory: {:.2f} GB".format(peakMemory / 1024.0 ** 3))
+        self.runFinishingStep('Recording the run in the run ledger', self.recordRun, parameters,
+                              self.runLedgerStatus(cli_node.GetStatusString()), self.telemetry.elapsedTime(),
+                              self.telemetry.iteration, self.telemetry.objective, peakMemory,
+                              shapeMetadataCache=self.interface.shapeMetadataCache if self.interface is not None else None)
+        if isResumedRun(parameters):
+          self.runFinishingStep('Finishing the resumed run', finishResumedRun, parameters.outputDirectory,
+                                cli_node.GetStatusString())
+
       if cli_node.GetStatusString() == 'Completed':
         statusForNode = cli_node.GetStatusString()
+        if self.resultCache is not None and parameters is not None:
+          self.runFinishingStep('Storing the results in the result cache', self.resultCache.store, parameters,
+                                self.resultCacheKey)
+        if parameters is not None and parameters.useInitV0 and not isResumedRun(parameters):
+          self.runFinishingStep('Reporting the warm start', self.reportWarmStart, parameters.outputDirectory)
+        if parameters is not None and self.packTrajectory:
+          self.runFinishingStep('Packing the trajectory', packRegressionOutputs, parameters.outputDirectory,
+                                parameters.outputPrefix, parameters.t0, parameters.tn, self.quantizeTrajectory)
+
+      elif cli_node.GetStatusString() == 'Cancelled' and self.resourceMonitor is not None and self.resourceMonitor.stopReason is not None:
+        self.ErrorMessage = "Shape4D stopped: {}".format(self.resourceMonitor.stopReason)
+        statusForNode = 'Completed with errors'
+
+      elif cli_node.GetStatusString() == 'Cancelled' and self.supervisor is not None and self.supervisor.stopReason is not None:
+        # Stopped by the supervisor: the latest progress snapshot is the result
+        if parameters is not None:
+          self.runFinishingStep('Keeping the latest progress snapshot', stopEarly, parameters.outputDirectory,
+                                parameters.outputPrefix, self.supervisor, self.telemetry)
+          if self.interface is not None:
+            qt.QMessageBox.information(slicer.util.mainWindow(), 'RegressionComputation',
+                                       'Shape4D stopped at iteration {}: {}'.format(self.telemetry.iteration,
+                                                                                   self.supervisor.stopReason))
 
       elif cli_node.GetStatusString() == 'Cancelled':
         self.ErrorMessage = "Shape4D cancelled"
@@ -591,11 +1759,93 @@ class RegressionComputationLogic(ScriptedLoadableModuleLogic, VTKObservationMixi
       # Create Error Message
       if statusForNode == 'Completed with errors' or statusForNode == 'Cancelled':
         logging.error(self.ErrorMessage)
-        qt.QMessageBox.critical(slicer.util.mainWindow(),
-                                'RegressionComputation',
-                                self.ErrorMessage)
+        if self.interface is not None:
+          qt.QMessageBox.critical(slicer.util.mainWindow(),
+                                  'RegressionComputation',
+                                  self.ErrorMessage)
+
+      if self.interface is not None:
+        self.interface.applyButton.text = 'Run Shape4D'
 
-      self.interface.applyButton.text = 'Run Shape4D'
+  def runFinishingStep(self, description, step, *args, **kwargs):
+    """ Run a step of the end of a regression. A step that fails is only
+    logged, so that the next steps are still run.
+    """
+    try:
+      return step(*args, **kwargs)
+    except Exception:
+      logging.exception("{} failed".format(description))
+      return None
+
+  def writeShape4DLog(self, parameters, outputText):
+    with open(os.path.join(parameters.outputDirectory, Shape4DLogFileName), 'w') as logFile:
+      logFile.write(outputText)
+
+  def writeTelemetry(self):
+    self.updateTelemetry()
+    self.telemetry.writeCSV()
+
+  def runLedgerStatus(self, statusString):
+    """ Status of the run in the run ledger: the reason of the stop for a run
+    stopped by the resource monitor or the supervisor, the status of the CLI
+    node otherwise
+    """
+    if self.resourceMonitor is not None and self.resourceMonitor.stopReason is not None:
+      return 'Stopped by the resource monitor: {}'.format(self.resourceMonitor.stopReason)
+    if statusString == 'Cancelled' and self.supervisor is not None and self.supervisor.stopReason is not None:
+      return 'Stopped by the supervisor: {}'.format(self.supervisor.stopReason)
+    return statusString
+
+  def updateTelemetry(self):
+    """ Parse the output of shape4D written since the last update and update the convergence plot """
+    self.telemetry.update(self.shape4D_cli_node.GetOutputText())
+    self.telemetry.updateSnapshots()
+    self.updateConvergencePlot()
+    if self.supervisor is not None and self.shape4D_cli_node.IsBusy() and self.supervisor.stopReason is None:
+      if self.supervisor.check(self.telemetry) is not None:
+        logging.info("Stopping Shape4D: {}".format(self.supervisor.stopReason))
+        self.shape4D_cli_node.SetStatus(self.shape4D_cli_node.Cancelling)
+    if self.resourceMonitor is not None and self.shape4D_cli_node.IsBusy() and self.resourceMonitor.stopReason is None:
+      self.resourceMonitor.sample()
+      if self.resourceMonitor.stopReason is not None:
+        logging.info("Stopping Shape4D: {}".format(self.resourceMonitor.stopReason))
+        self.shape4D_cli_node.SetStatus(self.shape4D_cli_node.Cancelling)
+    return self.telemetry
+
+  def updateConvergencePlot(self):
+    columns = self.telemetry.columns()
+    if len(columns['iteration']) == 0:
+      return
+    if self.convergenceTableNode is None or self.convergenceTableNode.GetScene() is None:
+      self.convergenceTableNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLTableNode', 'Shape4D convergence')
+      self.convergenceChartNode = None
+    names = ['iteration', 'objective', 'dataTerm', 'regularityTerm']
+    slicer.util.updateTableFromArray(self.convergenceTableNode, [np.array(columns[name]) for name in names], names)
+
+    if self.convergenceChartNode is None or self.convergenceChartNode.GetScene() is None:
+      self.convergenceChartNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLPlotChartNode', 'Shape4D convergence')
+      self.convergenceChartNode.SetXAxisTitle('Iteration')
+      self.convergenceChartNode.SetYAxisTitle('Objective')
+      for name in names[1:]:
+        seriesNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLPlotSeriesNode', name)
+        seriesNode.SetAndObserveTableNodeID(self.convergenceTableNode.GetID())
+        seriesNode.SetXColumnName('iteration')
+        seriesNode.SetYColumnName(name)
+        seriesNode.SetPlotType(slicer.vtkMRMLPlotSeriesNode.PlotTypeScatter)
+        seriesNode.SetMarkerStyle(slicer.vtkMRMLPlotSeriesNode.MarkerStyleNone)
+        self.convergenceChartNode.AddAndObservePlotSeriesNodeID(seriesNode.GetID())
+      if self.interface is not None:
+        slicer.modules.plots.logic().ShowChartInLayout(self.convergenceChartNode)
+
+  def reportWarmStart(self, outputDirectory):
+    report = warmStartReport(outputDirectory)
+    if report is None or report['iterationsSaved'] is None:
+      return
+    message = "Warm start: {} iterations instead of {} for the cold start, {} iterations saved".format(
+      report['iterations'], report['coldStartIterations'], report['iterationsSaved'])
+    logging.info(message)
+    if self.interface is not None:
+      qt.QMessageBox.information(slicer.util.mainWindow(), 'RegressionComputation', message)
 
 
 #
@@ -616,28 +1866,41 @@ class RegressionComputationTest(ScriptedLoadableModuleTest, VTKObservationMixin)
   def runTest(self):
     self.setUp()
     self.delayDisplay('Starting the tests')
+    self.test_Benchmark()
     self.test_RegressionComputation()
 
+  def test_Benchmark(self):
+    self.delayDisplay('Test : Benchmark on synthetic shapes')
+
+    # Smallest case, generated on the fly: no download is needed
+    benchmarkDirectoryPath = slicer.app.temporaryPath + '/RegressionComputationBenchmark'
+    if not os.path.exists(benchmarkDirectoryPath):
+      os.makedirs(benchmarkDirectoryPath)
+    results = RegressionComputationLogic().runBenchmark(benchmarkDirectoryPath, cases=[(1000, 5)], maxIters=5)
+
+    self.assertTrue(os.path.exists(os.path.join(benchmarkDirectoryPath, 'benchmark.json')))
+    self.assertEqual(len(results['cases']), 1)
+    phases = results['cases'][0]['phases']
+    for phase in ('scan', 'inputFiles', 'shape4D', 'sequence', 'colormaps', 'volumePlot'):
+      self.assertIn(phase, phases)
+    self.assertIsNotNone(phases['scan'])
+    self.assertIsNotNone(phases['inputFiles'])
+    self.delayDisplay('Benchmark: ' + ', '.join('{} {}'.format(phase, 'skipped' if seconds is None else '{:.3f}s'.format(seconds))
+                                                for phase, seconds in phases.items()))
+
   def test_RegressionComputation(self):
     self.delayDisplay('Test : Regression Computation')
 
     #   Creation of input folder
     inputDirectoryPath = slicer.app.temporaryPath + '/RegressionComputationInputData'
-    if not os.path.exists(inputDirectoryPath):
-      os.makedirs(inputDirectoryPath)
-
-    #   Download the shape input data
-    input_downloads = (
-      ('https://data.kitware.com/api/v1/file/5977a6558d777f16d01e9dd3/download', 'SphereToEllipsoid_00.vtk'),
-      ('https://data.kitware.com/api/v1/file/5977a6558d777f16d01e9dd6/download', 'SphereToEllipsoid_01.vtk'),
-      ('https://data.kitware.com/api/v1/file/5977a6568d777f16d01e9dd9/download', 'SphereToEllipsoid_02.vtk'),
-      ('https://data.kitware.com/api/v1/file/5977a6568d777f16d01e9ddc/download', 'SphereToEllipsoid_03.vtk'),
-      ('https://data.kitware.com/api/v1/file/5977a6568d777f16d01e9ddf/download', 'SphereToEllipsoid_04.vtk'),
-    )
-    inputRootnames = list()
-    for i in range(len(input_downloads)):
-      inputRootnames.append(input_downloads[i][1].split(".")[0])
-    self.download_files(inputDirectoryPath, input_downloads)
+    if os.path.exists(inputDirectoryPath):
+      shutil.rmtree(inputDirectoryPath)
+    os.makedirs(inputDirectoryPath)
+
+    #   Synthetic shapes, from a sphere at t=16 to an ellipsoid at t=24: no download is needed
+    self.inputs = writeSyntheticCohort(inputDirectoryPath, 5, 1000, t0=16.0, tn=24.0)
+    timePoints = dict((os.path.splitext(os.path.basename(regressionInput.shapePath))[0], regressionInput.timePoint)
+                      for regressionInput in self.inputs)
 
     #   Creation of output folder
     outputDirectoryPath =  slicer.app.temporaryPath + '/RegressionComputationOutputData'
@@ -648,16 +1911,14 @@ class RegressionComputationTest(ScriptedLoadableModuleTest, VTKObservationMixin)
 
     # Parameter by default
     moduleWidget.shapeInputDirectory.directory = inputDirectoryPath
-    inputShapeParameters = {'SphereToEllipsoid_00':[16,30,0,1], 'SphereToEllipsoid_01':[17,10,0,1], 'SphereToEllipsoid_02':[19,10,0,1], 'SphereToEllipsoid_03':[21,10,0,1], 'SphereToEllipsoid_04':[24,10,0,1] } #[age, sigmaW, tris, weight]
-
-    for row in range(0, moduleWidget.tableWidget_inputShapeParameters.rowCount):
-      inputshaperootname = moduleWidget.tableWidget_inputShapeParameters.cellWidget(row, 0).text
-      param = inputShapeParameters[inputshaperootname]
-      for column in range (0,moduleWidget.tableWidget_inputShapeParameters.columnCount - 1):
-        widget = moduleWidget.tableWidget_inputShapeParameters.cellWidget(row, column + 1)
-        tuple = widget.children()
-        spinBox = tuple[1]
-        spinBox.value = param[column]
+    while moduleWidget.shapeScanner.isRunning():
+      slicer.app.processEvents()
+    for row in range(0, len(moduleWidget.inputShapeParameters)):
+      inputshaperootname = moduleWidget.inputShapeParameters.rootnames[row]
+      param = [timePoints[inputshaperootname], 30 if row == 0 else 10, 0, 1] #[age, sigmaW, tris, weight]
+      for column in range (0, NumberOfColumns - 1):
+        moduleWidget.inputShapeParameters.setValue(row, column + 1, param[column])
+    moduleWidget.inputShapeParametersModel.parametersChanged()
 
     moduleWidget.t0.value = 16
     moduleWidget.tn.value = 24
@@ -702,114 +1963,51 @@ class RegressionComputationTest(ScriptedLoadableModuleTest, VTKObservationMixin)
   def test_Shape4D(self):
     self.delayDisplay('Test: Comparison of the outputs generated by Shape4D CLI')
 
-    # Checking the existence of the output directory Step3_ParaToSPHARMMesh
     outputDirectoryPath = slicer.app.temporaryPath + '/RegressionComputationOutputData'
 
-    # Downloading output data to compare with the ones generated by Shape Analysis Module during the tests
-    comparison_output_downloads = (
-      ('https://data.kitware.com/api/v1/file/5a66bad88d777f0649e0322c/download', 'comparison_regression_final_time_000.vtk'),
-      ('https://data.kitware.com/api/v1/file/5a66bad98d777f0649e0322f/download', 'comparison_regression_final_time_001.vtk'),
-      ('https://data.kitware.com/api/v1/file/5a66bad98d777f0649e03232/download', 'comparison_regression_final_time_002.vtk'),
-      ('https://data.kitware.com/api/v1/file/5a66bad98d777f0649e03235/download', 'comparison_regression_final_time_003.vtk'),
-      ('https://data.kitware.com/api/v1/file/5a66bad98d777f0649e03238/download', 'comparison_regression_final_time_004.vtk'),
-      ('https://data.kitware.com/api/v1/file/5a66bad98d777f0649e0323b/download', 'comparison_regression_final_time_005.vtk'),
-      ('https://data.kitware.com/api/v1/file/5a66bad98d777f0649e0323e/download', 'comparison_regression_final_time_006.vtk'),
-      ('https://data.kitware.com/api/v1/file/5a66bada8d777f0649e03241/download', 'comparison_regression_final_time_007.vtk'),
-      ('https://data.kitware.com/api/v1/file/5a66bada8d777f0649e03244/download', 'comparison_regression_final_time_008.vtk'),
-      ('https://data.kitware.com/api/v1/file/5a66bada8d777f0649e03247/download', 'comparison_regression_final_time_009.vtk'),
-    )
-    self.download_files(outputDirectoryPath, comparison_output_downloads)
-
-    comparison_filenames = [name for download, name in comparison_output_downloads]
-    for index, comparison_filename in enumerate(comparison_filenames):
-      # output_filename = "regression_final_time_0" + str(index).zfill(2) + ".vtk"
+    # The regression goes from the sphere to the ellipsoid: the first final
+    # shape is closer to the first input than to the last one, and conversely
+    firstInputPoints = readPoints(self.inputs[0].shapePath)
+    lastInputPoints = readPoints(self.inputs[-1].shapePath)
+    T = 10
+    for index in range(T):
       output_filename = "regression_final_time_" + "{:03}".format(index) + ".vtk"
       output_filepath = os.path.join(outputDirectoryPath, output_filename)
-      #   Checking the existence of the output files in the folder Step3_ParaToSPHARMMesh
       if not os.path.exists(output_filepath):
         logging.info("Fail: Path does not exist: {}".format(output_filepath))
         return False
-
-      #   Loading the 2 models for comparison
-      comparison_output_rootname = comparison_filename.split(".")[0]
-      output_rootname = output_filename.split(".")[0]
-      success, model1 = slicer.util.loadModel(os.path.join(outputDirectoryPath, comparison_filename), returnNode=True)
-      model1.SetName(comparison_output_rootname)
-      success, model2 = slicer.util.loadModel(output_filepath, returnNode=True)
-      model2.SetName(output_rootname)
-
-      #   Comparison
-      if not self.polydata_comparison(model1.GetPolyData(), model2.GetPolyData()):
-        logging.warning("Fail: Data comparison for data {}, {}.".format(index, output_filename))
+      success, model = slicer.util.loadModel(output_filepath, returnNode=True)
+      if not success or model.GetPolyData().GetNumberOfPoints() != len(firstInputPoints):
+        logging.warning("Fail: The output {} does not have the points of the inputs.".format(output_filename))
+        return False
+      if index not in (0, T - 1):
+        continue
+      points = readPoints(output_filepath)
+      firstDistance = np.sqrt(((points - firstInputPoints) ** 2).sum(axis=1).mean())
+      lastDistance = np.sqrt(((points - lastInputPoints) ** 2).sum(axis=1).mean())
+      if (firstDistance < lastDistance) != (index == 0):
+        logging.warning("Fail: The output {} is {} from the first input and {} from the last one."
+                        .format(output_filename, firstDistance, lastDistance))
         return False
 
-    return True
+    return self.checkShape4DOutputParsing(outputDirectoryPath, "regression_", 5)
 
-  def polydata_comparison(self, polydata1, polydata2):
-    # Number of points
-    nbPoints1 = polydata1.GetNumberOfPoints()
-    nbPoints2 = polydata2.GetNumberOfPoints()
-    if not nbPoints1 == nbPoints2:
-      logging.warning("Fail polydata_comparison in nbPoints. model1Points {} != model2Points {}".format(nbPoints1, nbPoints2))
+  def checkShape4DOutputParsing(self, outputDirectoryPath, outputPrefix, saveEveryN):
+    # The log and the file names of an actual run of shape4D, as parsed by the
+    # telemetry, the warm start and the resume
+    records = readShape4DLog(os.path.join(outputDirectoryPath, Shape4DLogFileName))
+    iterations = [record.iteration for record in records]
+    if len(records) == 0 or iterations != sorted(iterations):
+      logging.warning("Fail: Iterations parsed from the shape4D log: {}".format(iterations))
       return False
-
-    # Polydata
-    data1 = polydata1.GetPoints().GetData()
-    data2 = polydata2.GetPoints().GetData()
-
-    #   Number of Components
-    nbComponents1 = data1.GetNumberOfComponents()
-    nbComponents2 = data2.GetNumberOfComponents()
-    if not nbComponents1 == nbComponents2:
-      logging.warning("Fail polydata_comparison in nbComponents. model1Components {} != model2Components {}".format(nbComponents1, nbComponents2))
+    snapshotIterations = [snapshotIteration(filePath, outputPrefix)
+                          for filePath in progressSnapshotFilePaths(outputDirectoryPath, outputPrefix)]
+    # A run of saveEveryN iterations or more saves progress snapshots
+    if (len(snapshotIterations) == 0) != (iterations[-1] < saveEveryN) or \
+       (len(snapshotIterations) > 0 and max(snapshotIterations) > iterations[-1]):
+      logging.warning("Fail: Iterations of the progress snapshots: {}".format(snapshotIterations))
       return False
-
-    #   Points value
-    for i in range(nbPoints1):
-      for j in range(nbComponents1):
-        if not data1.GetTuple(i)[j] == data2.GetTuple(i)[j]:
-          logging.warning("Fail polydata_comparison in PointsValues. point:{}, component:{}".format(i, j))
-          return False
-
-    # Area
-    nbAreas1 = polydata1.GetPointData().GetNumberOfArrays()
-    nbAreas2 = polydata2.GetPointData().GetNumberOfArrays()
-    if not nbAreas1 == nbAreas2:
-      logging.warning("Fail polydata_comparison in nbAreas. model1Areas {} != model2Areas {}".format(nbAreas1, nbAreas2))
+    if findInitialVelocityFile(outputDirectoryPath) is None:
+      logging.warning("Fail: No V0 file found in {}".format(outputDirectoryPath))
       return False
-
-    for l in range(nbAreas1):
-      area1 = polydata1.GetPointData().GetArray(l)
-      area2 = polydata2.GetPointData().GetArray(l)
-
-      #   Name of the area
-      nameArea1 = area1.GetName()
-      nameArea2 = area2.GetName()
-      if not nameArea1 == nameArea2:
-        logging.warning("Fail polydata_comparison in name of areas. model1AreaName {} != model2AreaName {}".format(nameArea1, nameArea2))
-        return False
-
-      # Number of Components of the area
-      nbComponents1 = area1.GetNumberOfComponents()
-      nbComponents2 = area2.GetNumberOfComponents()
-      if not nbComponents1 == nbComponents2:
-        logging.warning("Fail polydata_comparison in nbComponents of areas. model1Components {} != model2Components {}".format(nbComponents1, nbComponents2))
-        return False
-
-      # Points value in the area
-      for i in range(nbPoints1):
-        for j in range(nbComponents1):
-          if not data1.GetTuple(i)[j] == data2.GetTuple(i)[j]:
-            logging.warning("Fail polydata_comparison in areas. point:{}, component:{}".format(i, j))
-            return False
-
     return True
-
-  def download_files(self, directoryPath, downloads):
-    self.delayDisplay('Starting download')
-    for url, name in downloads:
-      filePath = os.path.join(directoryPath, name)
-      if not os.path.exists(filePath) or os.stat(filePath).st_size == 0:
-        logging.info('Requesting download %s from %s...\n' % (name, url))
-        urllib.urlretrieve(url, filePath)
-    self.delayDisplay('Finished with download')
@@ -0,0 +1,223 @@
+import concurrent.futures
+import json
+import logging
+import os
+import time
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from .Multiresolution import readPolyData, writePolyData
+from .ShapeScan import defaultNumberOfWorkers
+
+try:
+  from scipy.spatial import cKDTree
+except ImportError:
+  cKDTree = None
+
+#
+# Pose alignment of the input shapes
+#
+# Before the driver file is written, the input shapes can be aligned on a
+# reference shape with a rigid or a similarity transform, so that shape4D does
+# not spend its deformation on pose differences between the subjects:
+#   - 'icp' finds the correspondences by closest points, with a KD-tree, and
+#     works with any meshes;
+#   - 'procrustes' is a generalized Procrustes alignment on the mean shape,
+#     for meshes in point to point correspondence.
+# The reference is the shape of the earliest time point. The aligned shapes
+# and their transforms are written in the Alignment subdirectory of the output
+# directory, and the driver file points to the aligned shapes.
+#
+
+AlignmentDirectoryName = 'Alignment'
+AlignmentRecordFileName = 'alignment.json'
+AlignmentMethods = ('icp', 'procrustes')
+
+# Memory of a block of pairwise distances when there is no KD-tree
+_nearestNeighborBlockSize = 2 ** 24
+
+def readPoints(filePath):
+  return numpy_support.vtk_to_numpy(readPolyData(filePath).GetPoints().GetData()).astype(np.float64)
+
+def writeTransformedShape(inputFilePath, outputFilePath, points):
+  """ Write a shape with its points replaced """
+  polyData = readPolyData(inputFilePath)
+  vtkPoints = vtk.vtkPoints()
+  vtkPoints.SetData(numpy_support.numpy_to_vtk(np.ascontiguousarray(points), deep=True))
+  polyData.SetPoints(vtkPoints)
+  return writePolyData(polyData, outputFilePath)
+
+def similarityTransform(points, targetPoints, scaling=True):
+  """ Least squares similarity (or rigid) transform mapping the points on the
+  target points in correspondence (Umeyama), as a 4x4 matrix
+  """
+  pointsMean = points.mean(axis=0)
+  targetMean = targetPoints.mean(axis=0)
+  centeredPoints = points - pointsMean
+  centeredTarget = targetPoints - targetMean
+  covariance = centeredTarget.T.dot(centeredPoints) / len(points)
+  U, singularValues, Vt = np.linalg.svd(covariance)
+  # No reflection
+  signs = np.ones(3)
+  if np.linalg.det(U) * np.linalg.det(Vt) < 0:
+    signs[2] = -1.0
+  rotation = (U * signs).dot(Vt)
+  scale = 1.0
+  if scaling:
+    variance = (centeredPoints ** 2).sum() / len(points)
+    if variance > 0:
+      scale = (singularValues * signs).sum() / variance
+  matrix = np.eye(4)
+  matrix[:3, :3] = scale * rotation
+  matrix[:3, 3] = targetMean - scale * rotation.dot(pointsMean)
+  return matrix
+
+def transformPoints(matrix, points):
+  return points.dot(matrix[:3, :3].T) + matrix[:3, 3]
+
+class _NearestNeighbors(object):
+  """ Closest reference point of a set of points, with a KD-tree if scipy is
+  available, by blocks of pairwise distances otherwise
+  """
+
+  def __init__(self, referencePoints):
+    self.referencePoints = referencePoints
+    self.tree = cKDTree(referencePoints) if cKDTree is not None else None
+    self.referenceSquaredNorms = (referencePoints ** 2).sum(axis=1)
+
+  def query(self, points):
+    if self.tree is not None:
+      return self.tree.query(points)
+    blockSize = max(1, _nearestNeighborBlockSize // len(self.referencePoints))
+    distances = np.empty(len(points))
+    indices = np.empty(len(points), dtype=np.int64)
+    for start in range(0, len(points), blockSize):
+      block = points[start:start + blockSize]
+      squaredDistances = ((block ** 2).sum(axis=1)[:, None] + self.referenceSquaredNorms[None, :] -
+                          2.0 * block.dot(self.referencePoints.T))
+      indices[start:start + blockSize] = squaredDistances.argmin(axis=1)
+      distances[start:start + blockSize] = squaredDistances[np.arange(len(block)), indices[start:start + blockSize]]
+    return np.sqrt(np.maximum(distances, 0.0)), indices
+
+class alignmentResultStruct(object):
+  def __init__(self, shapePath=None):
+    self.shapePath = shapePath
+    self.alignedShapePath = None
+    self.matrix = np.eye(4)
+    self.rootMeanSquareDistance = None
+    self.iterations = 0
+
+def alignPointsICP(points, nearestNeighbors, scaling=True, maximumIterations=50, tolerance=1e-6):
+  """ Align points on the reference points of nearestNeighbors by iterative closest points """
+  referencePoints = nearestNeighbors.referencePoints
+  # Initialization by the centroids and the spread of the points
+  matrix = np.eye(4)
+  if scaling:
+    spread = np.sqrt(((points - points.mean(axis=0)) ** 2).sum(axis=1).mean())
+    referenceSpread = np.sqrt(((referencePoints - referencePoints.mean(axis=0)) ** 2).sum(axis=1).mean())
+    if spread > 0:
+      matrix[:3, :3] *= referenceSpread / spread
+  matrix[:3, 3] = referencePoints.mean(axis=0) - matrix[:3, :3].dot(points.mean(axis=0))
+
+  result = alignmentResultStruct()
+  previousDistance = None
+  for iteration in range(1, maximumIterations + 1):
+    distances, indices = nearestNeighbors.query(transformPoints(matrix, points))
+    rootMeanSquareDistance = np.sqrt((distances ** 2).mean())
+    result.iterations = iteration
+    if previousDistance is not None and previousDistance - rootMeanSquareDistance <= tolerance * max(previousDistance, 1e-12):
+      break
+    previousDistance = rootMeanSquareDistance
+    matrix = similarityTransform(points, referencePoints[indices], scaling)
+  result.matrix = matrix
+  result.rootMeanSquareDistance = float(rootMeanSquareDistance)
+  return result
+
+def generalizedProcrustes(pointSets, referenceIndex=0, scaling=True, maximumIterations=20, tolerance=1e-6):
+  """ Align point sets in correspondence on their mean shape. The mean shape is
+  kept in the frame of the reference point set. Returns the alignment results.
+  """
+  meanPoints = pointSets[referenceIndex]
+  results = [alignmentResultStruct() for points in pointSets]
+  for iteration in range(1, maximumIterations + 1):
+    for result, points in zip(results, pointSets):
+      result.matrix = similarityTransform(points, meanPoints, scaling)
+      result.iterations = iteration
+    alignedPoints = np.stack([transformPoints(result.matrix, points) for result, points in zip(results, pointSets)])
+    newMeanPoints = alignedPoints.mean(axis=0)
+    # Keep the mean shape in the frame and at the scale of the reference
+    newMeanPoints = transformPoints(similarityTransform(newMeanPoints, pointSets[referenceIndex], scaling), newMeanPoints)
+    change = np.sqrt(((newMeanPoints - meanPoints) ** 2).sum(axis=1).mean())
+    meanPoints = newMeanPoints
+    if change <= tolerance * max(np.sqrt((meanPoints ** 2).sum(axis=1).mean()), 1e-12):
+      break
+  for result, points in zip(results, pointSets):
+    result.matrix = similarityTransform(points, meanPoints, scaling)
+    result.rootMeanSquareDistance = float(np.sqrt(((transformPoints(result.matrix, points) - meanPoints) ** 2).sum(axis=1).mean()))
+  return results
+
+def alignInputs(parameters, method='icp', scaling=True, numberOfWorkers=None):
+  """ Align the input shapes of the regression on the shape of its earliest
+  time point, write the aligned shapes and their transforms in the Alignment
+  subdirectory of the output directory and replace the input shapes by the
+  aligned ones. Returns the alignment results.
+  """
+  if method not in AlignmentMethods:
+    raise ValueError('Unknown alignment method {}, expected one of {}.'.format(method, ', '.join(AlignmentMethods)))
+  startTime = time.time()
+  alignmentDirectory = os.path.join(parameters.outputDirectory, AlignmentDirectoryName)
+  if not os.path.isdir(alignmentDirectory):
+    os.makedirs(alignmentDirectory)
+  parameters.sortInputsByTimePoint()
+  shapePaths = []
+  for regressionInput in parameters.inputs:
+    if regressionInput.shapePath not in shapePaths:
+      shapePaths.append(regressionInput.shapePath)
+  numberOfWorkers = numberOfWorkers or defaultNumberOfWorkers()
+
+  with concurrent.futures.ThreadPoolExecutor(max_workers=numberOfWorkers) as executor:
+    pointSets = list(executor.map(readPoints, shapePaths))
+    if method == 'procrustes':
+      if len(set(len(points) for points in pointSets)) > 1:
+        raise ValueError('The Procrustes alignment needs shapes with the same number of points, use ICP instead.')
+      results = generalizedProcrustes(pointSets, 0, scaling)
+    else:
+      nearestNeighbors = _NearestNeighbors(pointSets[0])
+      results = list(executor.map(lambda points: alignPointsICP(points, nearestNeighbors, scaling), pointSets))
+
+    alignedShapePaths = []
+    for index, (result, shapePath) in enumerate(zip(results, shapePaths)):
+      result.shapePath = shapePath
+      # The index keeps the names unique if shapes of different directories have the same name
+      result.alignedShapePath = os.path.join(alignmentDirectory, '{:03d}_{}'.format(index, os.path.basename(shapePath)))
+      alignedShapePaths.append(result.alignedShapePath)
+    list(executor.map(lambda item: writeTransformedShape(item[0].shapePath, item[0].alignedShapePath,
+                                                         transformPoints(item[0].matrix, item[1])),
+                      zip(results, pointSets)))
+
+  writeAlignmentRecord(os.path.join(alignmentDirectory, AlignmentRecordFileName), results, method, scaling)
+  alignedShapePathsByShape = dict(zip(shapePaths, alignedShapePaths))
+  for regressionInput in parameters.inputs:
+    regressionInput.shapePath = alignedShapePathsByShape[regressionInput.shapePath]
+  logging.info("Aligned {} input shapes ({}) in {:.1f}s".format(len(shapePaths), method, time.time() - startTime))
+  return results
+
+def writeAlignmentRecord(recordFilePath, results, method, scaling):
+  record = {
+    'method': method,
+    'scaling': scaling,
+    'reference': results[0].shapePath,
+    'shapes': [{
+      'shapePath': result.shapePath,
+      'alignedShapePath': result.alignedShapePath,
+      'matrix': result.matrix.tolist(),
+      'scale': float(np.cbrt(np.linalg.det(result.matrix[:3, :3]))),
+      'rootMeanSquareDistance': result.rootMeanSquareDistance,
+      'iterations': result.iterations,
+    } for result in results],
+  }
+  with open(recordFilePath, 'w') as recordFile:
+    json.dump(record, recordFile, indent=2)
+  return recordFilePath
@@ -0,0 +1,269 @@
+import copy
+import csv
+import logging
+import math
+import os
+import shutil
+import time
+
+import numpy as np
+
+from .Alignment import readPoints
+from .RegressionParameters import writeInputFiles
+from .RegressionResultCache import finalShapeFilePaths
+from .Shape4DLog import readShape4DLog
+from .Shape4DProcess import shape4DProcessStarter
+from .WarmStart import findInitialVelocityFile, setWarmStart
+
+#
+# Automatic selection of the time discretization T
+#
+# The regression is run with a coarse T first, then with T refined by a factor
+# at each level, each level starting from the V0 of the previous one. The
+# refinement stops when the regressed shapes at the observed time points move
+# by less than a tolerance (root mean square distance between the points)
+# from one level to the next: the coarser of the two levels is then accurate
+# enough, and its T is chosen. Its final shapes are copied in the output
+# directory of the parameters; the levels are written in its AutoT
+# subdirectory.
+#
+
+AutoTimeDiscretizationDirectoryName = 'AutoT'
+
+# Minimum T of the module
+MinimumT = 10
+
+def defaultInitialT(T, refinementFactor=2):
+  """ Coarsest T tried by default: T divided by the refinement factor twice,
+  so that T is reached in three levels, and at least MinimumT
+  """
+  return max(int(math.ceil(T / float(refinementFactor ** 2))), MinimumT)
+
+def observedTimePoints(outputDirectory, outputPrefix, timePoints, t0, tn):
+  """ Points of the regressed shape at each observed time point. The final
+  shapes are evenly spaced between t0 and tn: the points at a time point are
+  interpolated linearly between the two final shapes around it, so that
+  regressions with different T are compared at the same times.
+  """
+  finalShapes = finalShapeFilePaths(outputDirectory, outputPrefix)
+  if len(finalShapes) == 0:
+    return []
+  pointsByIndex = dict()
+  def finalPoints(index):
+    if index not in pointsByIndex:
+      pointsByIndex[index] = readPoints(finalShapes[index])
+    return pointsByIndex[index]
+  observedPoints = []
+  for timePoint in timePoints:
+    fraction = (timePoint - t0) / (tn - t0) if tn != t0 else 0.0
+    position = min(max(fraction, 0.0), 1.0) * (len(finalShapes) - 1)
+    index = min(int(np.floor(position)), len(finalShapes) - 1)
+    weight = position - index
+    points = finalPoints(index)
+    if weight > 0.0:
+      nextPoints = finalPoints(index + 1)
+      if nextPoints.shape != points.shape:
+        return []
+      points = (1.0 - weight) * points + weight * nextPoints
+    observedPoints.append(points)
+  return observedPoints
+
+def trajectoryChange(points, otherPoints):
+  """ Largest root mean square distance between the points of the observed
+  shapes of two regressions, or None if they can not be compared
+  """
+  if len(points) == 0 or len(points) != len(otherPoints):
+    return None
+  if any(pointSet.shape != otherPointSet.shape for pointSet, otherPointSet in zip(points, otherPoints)):
+    return None
+  squaredDistances = ((np.stack(points) - np.stack(otherPoints)) ** 2).sum(axis=2)
+  return float(np.sqrt(squaredDistances.mean(axis=1)).max())
+
+class timeDiscretizationLevelStruct(object):
+  def __init__(self, T=None, parameters=None):
+    self.T = T
+    self.parameters = parameters
+    self.process = None
+    self.status = 'Idle'
+    self.wallTime = 0.0
+    self.iterations = None
+    # Change of the observed shapes from the previous level
+    self.change = None
+
+class AutoTimeDiscretization(object):
+
+  def __init__(self, parameters, tolerance, initialT=None, maximumT=None, refinementFactor=2, executable=None,
+               numberOfThreads=None, startProcess=None):
+    """ tolerance is in the units of the coordinates of the shapes. The levels
+    go from initialT (defaultInitialT by default) to maximumT (parameters.T by
+    default). startProcess(XMLdriverfilepath, numberOfThreads) starts a level,
+    a Shape4DProcess of executable by default.
+    """
+    self.parameters = parameters
+    self.tolerance = tolerance
+    self.executable = executable
+    self.startProcess = startProcess
+    self.numberOfThreads = numberOfThreads
+    self.autoTDirectory = os.path.join(parameters.outputDirectory, AutoTimeDiscretizationDirectoryName)
+    maximumT = maximumT or parameters.T
+    if initialT is None:
+      initialT = defaultInitialT(maximumT, refinementFactor)
+    Ts = [min(initialT, maximumT)]
+    while Ts[-1] < maximumT:
+      Ts.append(min(Ts[-1] * refinementFactor, maximumT))
+    self.levels = []
+    for T in Ts:
+      levelParameters = copy.deepcopy(parameters)
+      levelParameters.T = T
+      levelParameters.outputDirectory = os.path.join(self.autoTDirectory, 'T_{}'.format(T))
+      self.levels.append(timeDiscretizationLevelStruct(T, levelParameters))
+    self.currentLevelIndex = None
+    self.chosenLevel = None
+    # 'converged', 'finestLevel' if the refinement did not converge,
+    # 'singleLevel' if there was no coarser T to compare with, None if no T was chosen
+    self.result = None
+    self.startTime = None
+    self.totalTime = 0.0
+
+  @property
+  def summaryFilePath(self):
+    return os.path.join(self.autoTDirectory, 'autoTSummary.csv')
+
+  @property
+  def currentLevel(self):
+    return self.levels[self.currentLevelIndex] if self.currentLevelIndex is not None else None
+
+  @property
+  def chosenT(self):
+    return self.chosenLevel.T if self.chosenLevel is not None else None
+
+  def start(self):
+    errorMessage = self.parameters.checkInputs()
+    if errorMessage is not None:
+      raise ValueError(errorMessage)
+    if self.startProcess is None:
+      self.startProcess = shape4DProcessStarter(self.executable)
+    self.startTime = time.time()
+    self.currentLevelIndex = None
+    self.chosenLevel = None
+    self.result = None
+    self._startNextLevel()
+    return self
+
+  def _startNextLevel(self):
+    self.currentLevelIndex = 0 if self.currentLevelIndex is None else self.currentLevelIndex + 1
+    level = self.currentLevel
+    if not os.path.isdir(level.parameters.outputDirectory):
+      os.makedirs(level.parameters.outputDirectory)
+    if self.currentLevelIndex > 0:
+      previousDirectory = self.levels[self.currentLevelIndex - 1].parameters.outputDirectory
+      try:
+        setWarmStart(level.parameters, previousDirectory, level.parameters.v0weight or 1.0)
+      except ValueError:
+        logging.warning("No V0 found for T={}, T={} starts from zero".format(self.levels[self.currentLevelIndex - 1].T, level.T))
+    XMLdriverfilepath = writeInputFiles(level.parameters)
+    logging.info("Auto T: running with T={}".format(level.T))
+    level.process = self.startProcess(XMLdriverfilepath, self.numberOfThreads)
+    level.status = 'Running'
+
+  def _observedPoints(self, level):
+    parameters = level.parameters
+    timePoints = sorted(set(float(regressionInput.timePoint) for regressionInput in parameters.inputs))
+    return observedTimePoints(parameters.outputDirectory, parameters.outputPrefix, timePoints, parameters.t0, parameters.tn)
+
+  def poll(self):
+    """ Start the next level when the current one is finished, until the
+    observed shapes converge. Returns True while the regression is running.
+    """
+    level = self.currentLevel
+    if level is None or level.process.poll() is None:
+      return level is not None
+    self._finishLevel(level)
+    if level.status == 'Completed':
+      if self.currentLevelIndex > 0:
+        previousLevel = self.levels[self.currentLevelIndex - 1]
+        level.change = trajectoryChange(self._observedPoints(previousLevel), self._observedPoints(level))
+        logging.info("Auto T: change of the observed shapes from T={} to T={}: {}".format(previousLevel.T, level.T, level.change))
+        if level.change is not None and level.change < self.tolerance:
+          self._finish(previousLevel, 'converged')
+          return False
+      if self.currentLevelIndex < len(self.levels) - 1:
+        self._startNextLevel()
+        return True
+      # The finest T did not converge: it is the best available
+      self._finish(level, 'singleLevel' if len(self.levels) == 1 else 'finestLevel')
+      return False
+    self._finish(None, None)
+    return False
+
+  def isRunning(self):
+    return self.currentLevel is not None
+
+  def wait(self, pollingInterval=1.0):
+    while self.poll():
+      time.sleep(pollingInterval)
+    return self.chosenLevel
+
+  def cancel(self):
+    level = self.currentLevel
+    if level is None:
+      return
+    level.process.cancel()
+    self._finishLevel(level)
+    self._finish(None, None)
+
+  def _finishLevel(self, level):
+    level.status = level.process.statusString()
+    level.wallTime = level.process.wallTime
+    try:
+      records = readShape4DLog(level.process.logFilePath)
+    except OSError:
+      records = []
+    if len(records) > 0:
+      level.iterations = records[-1].iteration
+    logging.info("Auto T: T={} {} in {:.1f}s".format(level.T, level.status.lower(), level.wallTime))
+
+  def _finish(self, chosenLevel, result):
+    self.chosenLevel = chosenLevel
+    self.result = result
+    self.totalTime = time.time() - self.startTime
+    self.currentLevelIndex = None
+    if chosenLevel is not None:
+      self._copyResults(chosenLevel)
+      logging.info(self.reportText())
+    self.writeSummary()
+
+  def _copyResults(self, level):
+    """ Copy the final shapes and the V0 of the chosen level in the output
+    directory, in place of the final shapes of a previous run
+    """
+    for filePath in finalShapeFilePaths(self.parameters.outputDirectory, self.parameters.outputPrefix):
+      os.remove(filePath)
+    filePaths = finalShapeFilePaths(level.parameters.outputDirectory, level.parameters.outputPrefix)
+    initV0 = findInitialVelocityFile(level.parameters.outputDirectory)
+    if initV0 is not None:
+      filePaths.append(initV0)
+    for filePath in filePaths:
+      shutil.copy2(filePath, os.path.join(self.parameters.outputDirectory, os.path.basename(filePath)))
+
+  def reportText(self):
+    if self.chosenLevel is None:
+      return 'No T was chosen'
+    resultTexts = {'converged': '', 'finestLevel': 'without convergence ', 'singleLevel': 'as the only level '}
+    return 'T={} chosen {}in {:.0f}s ({})'.format(
+      self.chosenT, resultTexts[self.result], self.totalTime,
+      ', '.join('T={}: {:.0f}s'.format(level.T, level.wallTime) for level in self.levels if level.status != 'Idle'))
+
+  def writeSummary(self):
+    if not os.path.isdir(self.autoTDirectory):
+      os.makedirs(self.autoTDirectory)
+    with open(self.summaryFilePath, 'w') as csvfile:
+      cw = csv.writer(csvfile, delimiter=',', lineterminator='\n')
+      cw.writerow(['T', 'status', 'wallTime', 'iterations', 'change', 'chosen', 'result', 'outputDirectory'])
+      for level in self.levels:
+        chosen = level is self.chosenLevel
+        cw.writerow([level.T, level.status, '{:.3f}'.format(level.wallTime),
+                     '' if level.iterations is None else level.iterations,
+                     '' if level.change is None else level.change,
+                     int(chosen), self.result if chosen else '', level.parameters.outputDirectory])
+    return self.summaryFilePath
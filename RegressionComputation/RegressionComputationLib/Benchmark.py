@@ -0,0 +1,314 @@
+import concurrent.futures
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import time
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from .Multiresolution import writePolyData
+from .RegressionParameters import RegressionParameters, regressionInputStruct, writeInputFiles
+from .Shape4DLog import readShape4DLog
+from .Shape4DProcess import Shape4DProcess, findShape4DExecutable
+from .ShapeScan import ShapeDirectoryScanner, defaultNumberOfWorkers, listInputShapes
+
+#
+# Benchmark of the regression pipeline on synthetic shapes
+#
+# The input shapes are generated on the fly, so that the benchmark needs no
+# download and scales freely: each subject is a sphere morphing into an
+# ellipsoid along its time point, with a scalar and a vector point data array,
+# at a chosen number of vertices. Each phase of the pipeline is timed
+# separately:
+#   - scan: reading the metadata of the input shapes, as the widget does;
+#   - inputFiles: writing the input CSV and the driver file;
+#   - shape4D: the regression, if the shape4D executable is found;
+#   - sequence, colormaps, volumePlot: the phases of RegressionVisualization,
+#     if its widget is given (in Slicer).
+# Without the shape4D executable, a synthetic regression output is written
+# instead, so that the visualization phases are still timed. The timings of
+# all the cases are written in a JSON file, to be compared between versions.
+#
+
+BenchmarkVertexCounts = (1000, 10000, 100000, 500000)
+BenchmarkSubjectCounts = (5, 50, 500, 5000)
+
+# Largest number of input points (vertices x subjects) of the default cases,
+# about 10 GB of input shapes
+DefaultMaximumTotalPoints = 2.5e8
+
+_resultsVersion = 1
+_sphereRadius = 50.0
+_ellipsoidAxes = np.array([1.4, 1.0, 0.6])
+
+def benchmarkCases(vertexCounts=BenchmarkVertexCounts, subjectCounts=BenchmarkSubjectCounts,
+                   maximumTotalPoints=DefaultMaximumTotalPoints):
+  """ (numberOfPoints, numberOfSubjects) of the cases, smallest first """
+  cases = [(numberOfPoints, numberOfSubjects) for numberOfPoints in vertexCounts for numberOfSubjects in subjectCounts
+           if maximumTotalPoints is None or numberOfPoints * numberOfSubjects <= maximumTotalPoints]
+  return sorted(cases, key=lambda case: (case[0] * case[1], case))
+
+def syntheticSphere(numberOfPoints):
+  """ Triangulated sphere of about numberOfPoints points """
+  # A sphere of resolutions (theta, phi) has theta * (phi - 2) + 2 points
+  phiResolution = max(3, int(round(np.sqrt(numberOfPoints / 2.0))) + 1)
+  sphereSource = vtk.vtkSphereSource()
+  sphereSource.SetRadius(_sphereRadius)
+  sphereSource.SetThetaResolution(2 * phiResolution)
+  sphereSource.SetPhiResolution(phiResolution)
+  sphereSource.Update()
+  return sphereSource.GetOutput()
+
+def syntheticShape(sphere, fraction, scale=1.0):
+  """ Sphere morphed into an ellipsoid by fraction (0 to 1), with the
+  displacement of its points from the sphere as point data
+  """
+  spherePoints = numpy_support.vtk_to_numpy(sphere.GetPoints().GetData()).astype(np.float64)
+  points = spherePoints * (scale * (1.0 + fraction * (_ellipsoidAxes - 1.0)))
+  displacement = points - spherePoints
+
+  shape = vtk.vtkPolyData()
+  shape.CopyStructure(sphere)
+  vtkPoints = vtk.vtkPoints()
+  vtkPoints.SetData(numpy_support.numpy_to_vtk(np.ascontiguousarray(points, dtype=np.float32), deep=True))
+  shape.SetPoints(vtkPoints)
+  displacementArray = numpy_support.numpy_to_vtk(np.ascontiguousarray(displacement, dtype=np.float32), deep=True)
+  displacementArray.SetName('Displacement')
+  shape.GetPointData().AddArray(displacementArray)
+  distanceArray = numpy_support.numpy_to_vtk(np.sqrt((displacement ** 2).sum(axis=1)).astype(np.float32), deep=True)
+  distanceArray.SetName('DisplacementMagnitude')
+  shape.GetPointData().AddArray(distanceArray)
+  return shape
+
+def writeSyntheticCohort(inputDirectory, numberOfSubjects, numberOfPoints, t0=0.0, tn=100.0, seed=0,
+                         numberOfWorkers=None):
+  """ Write one shape per subject, at time points evenly spread between t0
+  and tn, each with a small random scale. Returns the regression inputs.
+  """
+  if numberOfSubjects < 2:
+    raise ValueError('The benchmark needs at least 2 subjects, found {}.'.format(numberOfSubjects))
+  if not os.path.isdir(inputDirectory):
+    os.makedirs(inputDirectory)
+  sphere = syntheticSphere(numberOfPoints)
+  timePoints = np.linspace(t0, tn, numberOfSubjects)
+  scales = 1.0 + 0.02 * np.random.RandomState(seed).randn(numberOfSubjects)
+  scales[0] = 1.0
+  # The time point is the last number of the file name, as expected by the directory scan
+  shapePaths = [os.path.join(inputDirectory, 'synthetic_{:04d}_{:.2f}.vtk'.format(subject, timePoint))
+                for subject, timePoint in enumerate(timePoints)]
+
+  def writeSubject(subject):
+    fraction = (timePoints[subject] - t0) / (tn - t0) if tn != t0 else 0.0
+    return writePolyData(syntheticShape(sphere, fraction, scales[subject]), shapePaths[subject])
+
+  with concurrent.futures.ThreadPoolExecutor(max_workers=numberOfWorkers or defaultNumberOfWorkers()) as executor:
+    list(executor.map(writeSubject, range(numberOfSubjects)))
+  return [regressionInputStruct(shapePath, float(timePoint)) for shapePath, timePoint in zip(shapePaths, timePoints)]
+
+def writeSyntheticRegressionOutput(outputDirectory, outputPrefix, numberOfPoints, T, numberOfWorkers=None):
+  """ Final shapes of a regression from the sphere to the ellipsoid, in place of a shape4D run """
+  sphere = syntheticSphere(numberOfPoints)
+  shapePaths = [os.path.join(outputDirectory, '{}final_time_{:03d}.vtk'.format(outputPrefix, timeStep)) for timeStep in range(T)]
+  with concurrent.futures.ThreadPoolExecutor(max_workers=numberOfWorkers or defaultNumberOfWorkers()) as executor:
+    list(executor.map(lambda timeStep: writePolyData(syntheticShape(sphere, timeStep / max(T - 1, 1.0)), shapePaths[timeStep]),
+                      range(T)))
+  return shapePaths
+
+def scanShapes(shapeFilePaths, numberOfWorkers=None):
+  """ Metadata of the shapes, read as the widget does when the input directory is set """
+  scanner = ShapeDirectoryScanner(numberOfWorkers)
+  scanner.start(shapeFilePaths)
+  metadata = []
+  while scanner.isRunning():
+    metadata.extend(scanner.takeFinished())
+    time.sleep(0.001)
+  return metadata
+
+class benchmarkCaseStruct(object):
+  def __init__(self, numberOfPoints=None, numberOfSubjects=None):
+    self.numberOfPoints = numberOfPoints
+    self.numberOfSubjects = numberOfSubjects
+    # Seconds of each phase, None if the phase was skipped
+    self.phases = dict()
+    self.details = dict()
+
+  def toDict(self):
+    return {'numberOfPoints': self.numberOfPoints, 'numberOfSubjects': self.numberOfSubjects,
+            'phases': self.phases, 'details': self.details}
+
+class _PhaseTimer(object):
+  """ Record the wall time of a phase of a benchmark case """
+
+  def __init__(self, case, phase):
+    self.case = case
+    self.phase = phase
+
+  def __enter__(self):
+    self.startTime = time.perf_counter()
+    return self
+
+  def __exit__(self, exceptionType, exception, traceback):
+    if exceptionType is None:
+      self.case.phases[self.phase] = time.perf_counter() - self.startTime
+    return False
+
+def _directorySize(directory):
+  return sum(os.path.getsize(os.path.join(root, fileName)) for root, directories, fileNames in os.walk(directory)
+             for fileName in fileNames)
+
+def runBenchmarkCase(caseDirectory, numberOfPoints, numberOfSubjects, T=10, maxIters=10, kernelType='p3m',
+                     executable=None, shape4DTimeout=None, visualizationWidget=None, numberOfWorkers=None):
+  """ Time the phases of the pipeline on a synthetic cohort written in
+  caseDirectory. Returns the benchmarkCaseStruct.
+  """
+  case = benchmarkCaseStruct(numberOfPoints, numberOfSubjects)
+  inputDirectory = os.path.join(caseDirectory, 'Inputs')
+  outputDirectory = os.path.join(caseDirectory, 'Outputs')
+  for directory in (inputDirectory, outputDirectory):
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+
+  startTime = time.perf_counter()
+  writeSyntheticCohort(inputDirectory, numberOfSubjects, numberOfPoints, numberOfWorkers=numberOfWorkers)
+  case.details['generationTime'] = time.perf_counter() - startTime
+  case.details['inputSize'] = _directorySize(inputDirectory)
+
+  with _PhaseTimer(case, 'scan'):
+    metadata = scanShapes(listInputShapes(inputDirectory), numberOfWorkers)
+  case.details['actualNumberOfPoints'] = metadata[0].numberOfPoints
+
+  parameters = RegressionParameters()
+  parameters.inputs = [regressionInputStruct(shapeMetadata.filePath, shapeMetadata.timePoint, shapeMetadata.sigmaW)
+                       for shapeMetadata in metadata]
+  parameters.setDefaultTimeRange()
+  parameters.T = T
+  parameters.sigmaV = metadata[0].sigmaW
+  parameters.kernelType = kernelType
+  parameters.maxIters = maxIters
+  parameters.saveEveryN = maxIters
+  parameters.outputDirectory = outputDirectory
+  parameters.outputPrefix = 'benchmark_'
+  with _PhaseTimer(case, 'inputFiles'):
+    XMLdriverfilepath = writeInputFiles(parameters)
+
+  case.phases['shape4D'] = None
+  case.details['shape4DStatus'] = 'Skipped'
+  if executable is not None:
+    process = Shape4DProcess(executable, XMLdriverfilepath).start()
+    try:
+      process.wait(shape4DTimeout)
+    except subprocess.TimeoutExpired:
+      # The regression is too long for the benchmark
+      process.cancel()
+    case.details['shape4DStatus'] = process.statusString()
+    if case.details['shape4DStatus'] == 'Completed':
+      case.phases['shape4D'] = process.wallTime
+      try:
+        records = readShape4DLog(process.logFilePath)
+      except OSError:
+        records = []
+      if len(records) > 0:
+        case.details['iterations'] = records[-1].iteration
+        case.details['secondsPerIteration'] = process.wallTime / max(records[-1].iteration, 1)
+  if case.phases['shape4D'] is None:
+    writeSyntheticRegressionOutput(outputDirectory, parameters.outputPrefix, numberOfPoints, T, numberOfWorkers)
+
+  for phase in ('sequence', 'colormaps', 'volumePlot'):
+    case.phases[phase] = None
+  if visualizationWidget is not None:
+    _runVisualizationPhases(case, visualizationWidget, parameters)
+  return case
+
+def _runVisualizationPhases(case, widget, parameters):
+  """ Time the sequence creation, the colormap updates and the volume plot of a RegressionVisualization widget """
+  widget.inputDirectoryButton.directory = parameters.outputDirectory
+  widget.lineEdit_shapesRootname.text = parameters.outputPrefix + 'final_time_'
+  with _PhaseTimer(case, 'sequence'):
+    widget.onSequenceCreation()
+
+  # Every colormap, and every component of the vector ones; the first item is the solid color
+  numberOfUpdates = 0
+  with _PhaseTimer(case, 'colormaps'):
+    for colormapIndex in range(1, widget.comboBox_ColorMapChoice.count):
+      widget.comboBox_ColorMapChoice.setCurrentIndex(colormapIndex)
+      numberOfUpdates += 1
+      for typeIndex in range(1, widget.comboBox_3DColorMapChoice.count):
+        widget.comboBox_3DColorMapChoice.setCurrentIndex(typeIndex)
+        numberOfUpdates += 1
+  case.details['colormapUpdates'] = numberOfUpdates
+
+  widget.PathLineEdit_RegressionInputShapesCSV.setCurrentPath(parameters.CSVFilePath)
+  widget.readShapeObservationsCSV(parameters.CSVFilePath)
+  widget.setDefaultTimePointRange()
+  with _PhaseTimer(case, 'volumePlot'):
+    widget.onRegressionPlot()
+
+def benchmarkEnvironment(executable=None):
+  return {
+    'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    'platform': platform.platform(),
+    'python': platform.python_version(),
+    'numpy': np.__version__,
+    'vtk': vtk.vtkVersion.GetVTKVersion(),
+    'numberOfCores': os.cpu_count(),
+    'shape4D': executable,
+  }
+
+def runBenchmark(workingDirectory, resultsFilePath=None, cases=None, executable=None, keepData=False, **caseOptions):
+  """ Run the benchmark cases ((numberOfPoints, numberOfSubjects), all the
+  default ones if None) in workingDirectory and write their timings in a JSON
+  file (benchmark.json in workingDirectory by default). The options of
+  runBenchmarkCase are passed through. Returns the results.
+  """
+  if cases is None:
+    cases = benchmarkCases()
+  if executable is None:
+    executable = findShape4DExecutable()
+  if executable is None:
+    logging.warning("shape4D executable not found, the shape4D phase is skipped")
+  if resultsFilePath is None:
+    resultsFilePath = os.path.join(workingDirectory, 'benchmark.json')
+  results = {'version': _resultsVersion, 'environment': benchmarkEnvironment(executable), 'cases': []}
+  for numberOfPoints, numberOfSubjects in cases:
+    caseDirectory = os.path.join(workingDirectory, 'points_{}_subjects_{}'.format(numberOfPoints, numberOfSubjects))
+    logging.info("Benchmark: {} points, {} subjects".format(numberOfPoints, numberOfSubjects))
+    try:
+      case = runBenchmarkCase(caseDirectory, numberOfPoints, numberOfSubjects, executable=executable, **caseOptions)
+    finally:
+      if not keepData:
+        shutil.rmtree(caseDirectory, ignore_errors=True)
+    logging.info("Benchmark: " + ', '.join('{} {}'.format(phase, 'skipped' if seconds is None else '{:.3f}s'.format(seconds))
+                                           for phase, seconds in case.phases.items()))
+    results['cases'].append(case.toDict())
+    # Written after each case, so that the finished cases are kept if a larger one fails
+    writeBenchmarkResults(results, resultsFilePath)
+  return results
+
+def writeBenchmarkResults(results, resultsFilePath):
+  temporaryFilePath = resultsFilePath + '.tmp'
+  with open(temporaryFilePath, 'w') as resultsFile:
+    json.dump(results, resultsFile, indent=2)
+  os.replace(temporaryFilePath, resultsFilePath)
+  return resultsFilePath
+
+def compareBenchmarkResults(results, referenceResults, tolerance=0.2):
+  """ Phases of the cases slower than in the reference results by more than
+  tolerance (a fraction). Returns a list of (numberOfPoints, numberOfSubjects,
+  phase, seconds, referenceSeconds).
+  """
+  referenceCases = dict(((case['numberOfPoints'], case['numberOfSubjects']), case) for case in referenceResults['cases'])
+  regressions = []
+  for case in results['cases']:
+    referenceCase = referenceCases.get((case['numberOfPoints'], case['numberOfSubjects']))
+    if referenceCase is None:
+      continue
+    for phase, seconds in case['phases'].items():
+      referenceSeconds = referenceCase['phases'].get(phase)
+      if seconds is not None and referenceSeconds is not None and seconds > referenceSeconds * (1.0 + tolerance):
+        regressions.append((case['numberOfPoints'], case['numberOfSubjects'], phase, seconds, referenceSeconds))
+  return regressions
@@ -0,0 +1,199 @@
+import csv
+import glob
+import os
+import re
+import time
+
+from .Shape4DLog import parseIterationLine
+
+#
+# Convergence of a running regression
+#
+# The output of shape4D is parsed as it grows, from the output text of the CLI
+# node or from the log file of a Shape4DProcess, and the progress snapshots
+# saved every saveProgress iterations are counted. Only the lines added since
+# the previous update are parsed.
+#
+
+ConvergenceFileName = 'convergence.csv'
+
+# Progress snapshots are named as the final shapes, with the iteration in
+# place of 'final': <prefix>iter_0005_time_003.vtk, <prefix>iter_0005_V0.vtk
+_snapshotFileNameExpression = re.compile(r'iter_(\d+)_(time_\d+\.vtk|V0\.vtk)')
+
+def snapshotIteration(filePath, outputPrefix=''):
+  """ Iteration of a progress snapshot, from its file name, or None if the
+  file is not a progress snapshot of the regression with this output prefix
+  """
+  fileName = os.path.basename(filePath)
+  if not fileName.startswith(outputPrefix):
+    return None
+  match = _snapshotFileNameExpression.fullmatch(fileName[len(outputPrefix):])
+  return int(match.group(1)) if match is not None else None
+
+def progressSnapshotFilePaths(outputDirectory, outputPrefix):
+  """ Shapes saved by shape4D during the optimization """
+  filePaths = glob.glob(os.path.join(outputDirectory, glob.escape(outputPrefix) + 'iter_*.vtk'))
+  return sorted(filePath for filePath in filePaths if snapshotIteration(filePath, outputPrefix) is not None)
+
+def snapshotFinalFileName(fileName):
+  """ Name of the final shape corresponding to a progress snapshot, without
+  the output prefix, or None if it is not a progress snapshot
+  """
+  match = _snapshotFileNameExpression.fullmatch(fileName)
+  return 'final_' + match.group(2) if match is not None else None
+
+class ConvergenceTelemetry(object):
+
+  def __init__(self, maxIters=None, outputDirectory=None, outputPrefix=''):
+    self.maxIters = maxIters
+    self.outputDirectory = outputDirectory
+    self.outputPrefix = outputPrefix
+    self.reset()
+
+  def reset(self):
+    self.records = []
+    self.recordTimes = []
+    self.startTime = time.time()
+    self.parsedLength = 0
+    self.logFileOffset = 0
+    self.snapshotIteration = None
+
+  def update(self, outputText, now=None):
+    """ Parse the complete lines added to the output text since the last update """
+    if len(outputText) < self.parsedLength:
+      # The output text was reset
+      self.parsedLength = 0
+    end = outputText.rfind('\n') + 1
+    if end <= self.parsedLength:
+      return 0
+    numberOfRecords = self._parse(outputText[self.parsedLength:end], now)
+    self.parsedLength = end
+    return numberOfRecords
+
+  def updateFromLogFile(self, logFilePath, now=None):
+    """ Parse the complete lines added to the log file since the last update """
+    try:
+      with open(logFilePath, 'rb') as logFile:
+        logFile.seek(self.logFileOffset)
+        newText = logFile.read()
+    except OSError:
+      return 0
+    end = newText.rfind(b'\n') + 1
+    if end == 0:
+      return 0
+    self.logFileOffset += end
+    return self._parse(newText[:end].decode(errors='replace'), now)
+
+  def _parse(self, text, now):
+    if now is None:
+      now = time.time()
+    numberOfRecords = 0
+    for line in text.splitlines():
+      record = parseIterationLine(line)
+      if record is not None:
+        self.records.append(record)
+        self.recordTimes.append(now)
+        numberOfRecords += 1
+    return numberOfRecords
+
+  def updateSnapshots(self):
+    if self.outputDirectory is None:
+      return None
+    iterations = [snapshotIteration(filePath, self.outputPrefix)
+                  for filePath in progressSnapshotFilePaths(self.outputDirectory, self.outputPrefix)]
+    iterations = [iteration for iteration in iterations if iteration is not None]
+    if len(iterations) > 0:
+      self.snapshotIteration = max(iterations)
+    return self.snapshotIteration
+
+  def _last(self, attribute):
+    if len(self.records) == 0:
+      return None
+    return getattr(self.records[-1], attribute)
+
+  @property
+  def iteration(self):
+    """ Latest iteration reported by shape4D, or of the latest progress snapshot """
+    iteration = self._last('iteration')
+    if iteration is None or (self.snapshotIteration is not None and self.snapshotIteration > iteration):
+      return self.snapshotIteration
+    return iteration
+
+  @property
+  def objective(self):
+    return self._last('objective')
+
+  @property
+  def dataTerm(self):
+    return self._last('dataTerm')
+
+  @property
+  def regularityTerm(self):
+    return self._last('regularityTerm')
+
+  @property
+  def stepSize(self):
+    return self._last('stepSize')
+
+  def elapsedTime(self, now=None):
+    return (now or time.time()) - self.startTime
+
+  def iterationsPerSecond(self, now=None):
+    iteration = self.iteration
+    elapsedTime = self.elapsedTime(now)
+    if iteration is None or elapsedTime <= 0:
+      return None
+    return iteration / elapsedTime
+
+  def estimatedTimeRemaining(self, now=None):
+    """ Seconds left to reach the maximum number of iterations at the current speed """
+    iterationsPerSecond = self.iterationsPerSecond(now)
+    if not iterationsPerSecond or self.maxIters is None:
+      return None
+    return max(self.maxIters - self.iteration, 0) / iterationsPerSecond
+
+  def columns(self):
+    """ Values of the records, column by column, None values as NaN """
+    names = ['iteration', 'objective', 'dataTerm', 'regularityTerm', 'stepSize']
+    columns = dict()
+    for name in names:
+      columns[name] = [float('nan') if getattr(record, name) is None else getattr(record, name)
+                       for record in self.records]
+    columns['time'] = [recordTime - self.startTime for recordTime in self.recordTimes]
+    return columns
+
+  def writeCSV(self, filePath=None):
+    if filePath is None:
+      filePath = os.path.join(self.outputDirectory, ConvergenceFileName)
+    names = ['iteration', 'time', 'objective', 'dataTerm', 'regularityTerm', 'stepSize']
+    with open(filePath, 'w') as csvfile:
+      cw = csv.writer(csvfile, delimiter=',', lineterminator='\n')
+      cw.writerow(names)
+      for record, recordTime in zip(self.records, self.recordTimes):
+        cw.writerow([record.iteration, '{:.3f}'.format(recordTime - self.startTime)] +
+                    ['' if getattr(record, name) is None else getattr(record, name) for name in names[2:]])
+    return filePath
+
+  def statusText(self, now=None):
+    """ One line summary of the convergence, for display """
+    iteration = self.iteration
+    if iteration is None:
+      return 'Waiting for the first iteration'
+    text = 'Iteration {}'.format(iteration)
+    if self.maxIters is not None:
+      text += '/{}'.format(self.maxIters)
+    if self.objective is not None:
+      text += ', objective {:.6g}'.format(self.objective)
+    if self.dataTerm is not None and self.regularityTerm is not None:
+      text += ' (data {:.6g}, regularity {:.6g})'.format(self.dataTerm, self.regularityTerm)
+    if self.stepSize is not None:
+      text += ', step {:.3g}'.format(self.stepSize)
+    iterationsPerSecond = self.iterationsPerSecond(now)
+    if iterationsPerSecond:
+      text += ', {:.2f} it/s'.format(iterationsPerSecond)
+    estimatedTimeRemaining = self.estimatedTimeRemaining(now)
+    if estimatedTimeRemaining is not None:
+      seconds = int(estimatedTimeRemaining)
+      text += ', ETA {}:{:02d}:{:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+    return text
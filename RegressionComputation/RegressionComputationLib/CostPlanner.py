@@ -0,0 +1,228 @@
+import concurrent.futures
+import json
+import logging
+import math
+import os
+import time
+
+import numpy as np
+
+from .ShapeScan import defaultNumberOfWorkers, readShapeMetadata
+
+#
+# Runtime and memory estimates of a regression
+#
+# The cost of an iteration of shape4D is modeled from the number of points of
+# the source and target shapes, the number of time points T and the kernel
+# type:
+#   - the exact kernel sums the Gaussian kernel over all the pairs of points,
+#     at each time step for the flow and its adjoint, and for the data term;
+#   - p3m splats the points on a grid of spacing sigmaV / 3 and convolves the
+#     grid by FFT, so its cost grows with the volume of the shapes instead.
+# The data term is counted with the exact kernel for both kernel types. The
+# cost of a kernel evaluation and of a grid point are measured on the local
+# machine by a short benchmark, saved to be reused.
+#
+
+KernelTypes = ('exact', 'p3m')
+
+# Grid spacing of p3m relative to sigmaV, and padding of the grid in cells
+_p3mSpacingRatio = 3.0
+_p3mPadding = 8
+
+# Memory used by shape4D independently of the shapes
+_baseMemory = 64 * 1024 ** 2
+
+def physicalMemory():
+  try:
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+  except (AttributeError, ValueError, OSError):
+    return 16 * 1024 ** 3
+
+class costCalibrationStruct(object):
+  def __init__(self):
+    # Seconds per evaluation of the kernel on a pair of points
+    self.secondsPerKernelEvaluation = 5e-9
+    # Seconds per grid point and per level of the FFT (G log2 G)
+    self.secondsPerGridPoint = 2e-9
+    self.date = None
+
+def calibrate(numberOfPoints=2000, gridSize=64, repetitions=3):
+  """ Measure the cost of the kernel sums on the local machine """
+  calibration = costCalibrationStruct()
+  randomState = np.random.RandomState(0)
+  points = randomState.rand(numberOfPoints, 3)
+  vectors = randomState.rand(numberOfPoints, 3)
+  squaredNorms = (points ** 2).sum(axis=1)
+
+  bestTime = float('inf')
+  for repetition in range(repetitions):
+    startTime = time.perf_counter()
+    squaredDistances = squaredNorms[:, None] + squaredNorms[None, :] - 2.0 * points.dot(points.T)
+    np.exp(-squaredDistances / 0.1).dot(vectors)
+    bestTime = min(bestTime, time.perf_counter() - startTime)
+  calibration.secondsPerKernelEvaluation = bestTime / numberOfPoints ** 2
+
+  grid = randomState.rand(gridSize, gridSize, gridSize)
+  numberOfGridPoints = grid.size
+  bestTime = float('inf')
+  for repetition in range(repetitions):
+    startTime = time.perf_counter()
+    for component in range(3):
+      np.fft.irfftn(np.fft.rfftn(grid) * 0.5, grid.shape)
+    bestTime = min(bestTime, time.perf_counter() - startTime)
+  calibration.secondsPerGridPoint = bestTime / (3 * numberOfGridPoints * math.log2(numberOfGridPoints))
+  calibration.date = time.time()
+  return calibration
+
+def loadCalibration(calibrationFilePath):
+  """ Load the calibration of the local machine, measuring it if it was never done """
+  calibration = costCalibrationStruct()
+  try:
+    with open(calibrationFilePath) as calibrationFile:
+      calibration.__dict__.update(json.load(calibrationFile))
+    return calibration
+  except (OSError, ValueError):
+    pass
+  calibration = calibrate()
+  try:
+    calibrationDirectory = os.path.dirname(calibrationFilePath)
+    if calibrationDirectory and not os.path.exists(calibrationDirectory):
+      os.makedirs(calibrationDirectory)
+    with open(calibrationFilePath, 'w') as calibrationFile:
+      json.dump(calibration.__dict__, calibrationFile)
+  except OSError as e:
+    logging.warning("Can not save the cost calibration {}: {}".format(calibrationFilePath, e))
+  return calibration
+
+def shapeMetadataForInputs(inputs, shapeMetadataCache=None, numberOfWorkers=None):
+  """ Metadata of the shapes of the inputs, from the cache when possible """
+  shapePaths = sorted(set(regressionInput.shapePath for regressionInput in inputs))
+  metadata = dict()
+  if shapeMetadataCache is not None:
+    for shapePath in shapePaths:
+      cachedMetadata = shapeMetadataCache.get(shapePath)
+      if cachedMetadata is not None:
+        metadata[shapePath] = cachedMetadata
+  shapePathsToRead = [shapePath for shapePath in shapePaths if shapePath not in metadata]
+  if len(shapePathsToRead) > 0:
+    with concurrent.futures.ThreadPoolExecutor(max_workers=numberOfWorkers or defaultNumberOfWorkers()) as executor:
+      for shapePath, shapeMetadata in zip(shapePathsToRead, executor.map(readShapeMetadata, shapePathsToRead)):
+        metadata[shapePath] = shapeMetadata
+        if shapeMetadataCache is not None:
+          shapeMetadataCache.put(shapeMetadata)
+  return metadata
+
+class costEstimateStruct(object):
+  def __init__(self, kernelType=None):
+    self.kernelType = kernelType
+    self.secondsPerIteration = 0.0
+    self.runtime = 0.0
+    self.peakMemory = 0
+
+def _p3mNumberOfGridPoints(bounds, sigmaV):
+  spacing = max(sigmaV, 1e-6) / _p3mSpacingRatio
+  numberOfGridPoints = 1
+  for axis in range(3):
+    extent = max(bounds[2 * axis + 1] - bounds[2 * axis], 0.0)
+    numberOfGridPoints *= int(math.ceil(extent / spacing)) + 2 * _p3mPadding
+  return numberOfGridPoints
+
+def estimateCost(parameters, shapeMetadata, kernelType, calibration):
+  """ Runtime and peak memory of the regression with the kernel type, for
+  parameters.maxIters iterations. shapeMetadata maps the shape paths of the
+  inputs to their metadata.
+  """
+  inputs = sorted(parameters.inputs, key=lambda regressionInput: float(regressionInput.timePoint))
+  numberOfSourcePoints = shapeMetadata[inputs[0].shapePath].numberOfPoints
+  targetPoints = [shapeMetadata[regressionInput.shapePath].numberOfPoints for regressionInput in inputs]
+  T = parameters.T
+
+  # Data term and its gradient, for each target
+  kernelEvaluations = sum(numberOfSourcePoints ** 2 + 2 * numberOfSourcePoints * M for M in targetPoints)
+  gridWork = 0.0
+  memory = _baseMemory
+  # Positions, velocities and momenta at each time step, and the targets
+  memory += 3 * (T + 1) * numberOfSourcePoints * 3 * 8
+  memory += sum(targetPoints) * 3 * 8
+  if kernelType == 'p3m':
+    bounds = _unionBounds([shapeMetadata[regressionInput.shapePath].bounds for regressionInput in inputs])
+    numberOfGridPoints = _p3mNumberOfGridPoints(bounds, parameters.sigmaV)
+    # Flow and adjoint: one convolution of the 3 components per time step each
+    gridWork = 2 * T * 3 * numberOfGridPoints * math.log2(max(numberOfGridPoints, 2))
+    # Splatting and interpolation on the 27 neighboring grid points
+    kernelEvaluations += 2 * T * 2 * 27 * numberOfSourcePoints
+    # Grid of the 3 components, its transform and the kernel transform
+    memory += 4 * 3 * numberOfGridPoints * 8
+  else:
+    kernelEvaluations += 2 * T * numberOfSourcePoints ** 2
+
+  estimate = costEstimateStruct(kernelType)
+  estimate.secondsPerIteration = (kernelEvaluations * calibration.secondsPerKernelEvaluation +
+                                  gridWork * calibration.secondsPerGridPoint)
+  estimate.runtime = estimate.secondsPerIteration * parameters.maxIters
+  estimate.peakMemory = int(memory)
+  return estimate
+
+def _unionBounds(boundsList):
+  bounds = list(boundsList[0])
+  for otherBounds in boundsList[1:]:
+    for axis in range(3):
+      bounds[2 * axis] = min(bounds[2 * axis], otherBounds[2 * axis])
+      bounds[2 * axis + 1] = max(bounds[2 * axis + 1], otherBounds[2 * axis + 1])
+  return bounds
+
+def _formatDuration(seconds):
+  if seconds < 60:
+    return '{:.0f}s'.format(seconds)
+  if seconds < 3600:
+    return '{:.0f}min'.format(seconds / 60)
+  if seconds < 2 * 86400:
+    return '{:.1f}h'.format(seconds / 3600)
+  return '{:.1f} days'.format(seconds / 86400)
+
+class regressionPlanStruct(object):
+  def __init__(self):
+    self.estimates = dict()
+    self.kernelType = None
+    self.recommendedKernelType = None
+    self.memoryLimit = None
+
+  @property
+  def estimate(self):
+    return self.estimates[self.kernelType]
+
+  @property
+  def exceedsMemoryLimit(self):
+    return self.memoryLimit is not None and self.estimate.peakMemory > self.memoryLimit
+
+  @property
+  def nearMemoryLimit(self):
+    return self.memoryLimit is not None and self.estimate.peakMemory > 0.8 * self.memoryLimit
+
+  def text(self):
+    lines = []
+    for kernelType in KernelTypes:
+      estimate = self.estimates[kernelType]
+      lines.append('{}: up to {} ({:.2f}s per iteration), {:.2f} GB{}'.format(
+        kernelType, _formatDuration(estimate.runtime), estimate.secondsPerIteration,
+        estimate.peakMemory / 1024.0 ** 3, ' (recommended)' if kernelType == self.recommendedKernelType else ''))
+    if self.exceedsMemoryLimit:
+      lines.append('The {} kernel exceeds the memory limit of {:.1f} GB.'.format(self.kernelType, self.memoryLimit / 1024.0 ** 3))
+    return '\n'.join(lines)
+
+def planRegression(parameters, shapeMetadata, calibration, memoryLimit=None):
+  """ Estimate the cost of the regression with each kernel type and recommend
+  the fastest one that fits in the memory limit.
+  """
+  plan = regressionPlanStruct()
+  plan.kernelType = parameters.kernelType
+  plan.memoryLimit = memoryLimit
+  for kernelType in KernelTypes:
+    plan.estimates[kernelType] = estimateCost(parameters, shapeMetadata, kernelType, calibration)
+  candidates = [estimate for estimate in plan.estimates.values()
+                if memoryLimit is None or estimate.peakMemory <= memoryLimit]
+  if len(candidates) == 0:
+    candidates = list(plan.estimates.values())
+  plan.recommendedKernelType = min(candidates, key=lambda estimate: estimate.runtime).kernelType
+  return plan
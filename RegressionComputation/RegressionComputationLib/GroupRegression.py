@@ -0,0 +1,58 @@
+import collections
+import os
+import re
+
+from .ParameterSweep import ParameterSweep
+
+#
+# Regressions of the groups of a cohort
+#
+# The inputs of a cohort are split by their group (the optional sixth column
+# of the input CSV file, e.g. diagnosis or sex), and one regression is run per
+# group, as a parameter sweep on the inputs: the group regressions run at once
+# under the core budget of the sweep, each in its own subdirectory of the
+# Groups directory, with a combined summary. The time range of the cohort is
+# kept for every group so that the trajectories of the groups can be compared.
+#
+
+GroupsDirectoryName = 'Groups'
+
+def splitInputsByGroup(inputs):
+  """ Inputs of each group, in the order of the first shape of each group """
+  groups = collections.OrderedDict()
+  for regressionInput in inputs:
+    if regressionInput.group is None:
+      raise ValueError('The shape {} has no group.'.format(regressionInput.shapePath))
+    groups.setdefault(regressionInput.group, []).append(regressionInput)
+  return groups
+
+def groupDirectoryName(group):
+  return 'group_' + (re.sub(r'[^\w.+-]', '_', group) or '_')
+
+class GroupRegression(ParameterSweep):
+
+  def __init__(self, baseParameters, executable=None, numberOfCores=None, numberOfConcurrentRuns=None,
+               resultCache=None, startProcess=None):
+    groups = splitInputsByGroup(baseParameters.inputs)
+    groupsDirectory = os.path.join(baseParameters.outputDirectory, GroupsDirectoryName)
+    ParameterSweep.__init__(self, baseParameters, [{'inputs': groupInputs} for groupInputs in groups.values()],
+                            groupsDirectory, executable, numberOfCores, numberOfConcurrentRuns, resultCache,
+                            runNames=[groupDirectoryName(group) for group in groups], startProcess=startProcess)
+    self.parameterNames = ['group', 'shapes']
+    for run, (group, groupInputs) in zip(self.runs, groups.items()):
+      run.overrides = {'group': group, 'shapes': len(groupInputs)}
+
+  @property
+  def groupsDirectory(self):
+    return self.sweepDirectory
+
+  @property
+  def summaryFilePath(self):
+    return os.path.join(self.groupsDirectory, 'groupSummary.csv')
+
+  def start(self):
+    for run in self.runs:
+      if len(run.parameters.inputs) < 2:
+        raise ValueError('The group {} has only {} shape, at least 2 are needed.'.format(run.overrides['group'],
+                                                                                        len(run.parameters.inputs)))
+    return ParameterSweep.start(self)
@@ -0,0 +1,195 @@
+import bisect
+import os
+import re
+
+import numpy as np
+
+from .RegressionParameters import regressionInputStruct
+
+#
+# Parameters of the input shapes
+#
+# One row per input shape, stored column by column in NumPy arrays so that the
+# table, the bulk edits and the CSV export never go through per-cell widgets.
+# The rows are kept sorted by shape name.
+#
+
+RootnameColumn = 0
+TimePointColumn = 1
+SigmaWColumn = 2
+TrisColumn = 3
+WeightColumn = 4
+
+NumberOfColumns = 5
+
+_columnTypes = {
+  TimePointColumn: np.float64,
+  SigmaWColumn: np.float64,
+  TrisColumn: np.int32,
+  WeightColumn: np.float64,
+}
+
+# Ranges of the editable columns, as the spin boxes used to edit them
+columnRanges = {
+  TimePointColumn: (-1e10, 1e10),
+  SigmaWColumn: (0.001, 1e10),
+  TrisColumn: (0, 1000),
+  WeightColumn: (0, 1e10),
+}
+
+class InputShapeParameters(object):
+
+  def __init__(self):
+    self.clear()
+
+  def clear(self):
+    self.filePaths = []
+    self.rootnames = []
+    self.numberOfShapes = 0
+    self.columns = dict()
+    for column, columnType in _columnTypes.items():
+      self.columns[column] = np.zeros(16, dtype=columnType)
+
+  def __len__(self):
+    return self.numberOfShapes
+
+  def column(self, column):
+    """ Return a view on the values of the column """
+    return self.columns[column][:self.numberOfShapes]
+
+  @property
+  def timePoints(self):
+    return self.column(TimePointColumn)
+
+  @property
+  def sigmaWs(self):
+    return self.column(SigmaWColumn)
+
+  @property
+  def tris(self):
+    return self.column(TrisColumn)
+
+  @property
+  def weights(self):
+    return self.column(WeightColumn)
+
+  def _reserve(self, numberOfShapes):
+    capacity = len(self.columns[TimePointColumn])
+    if numberOfShapes <= capacity:
+      return
+    while capacity < numberOfShapes:
+      capacity *= 2
+    for column, values in self.columns.items():
+      resized = np.zeros(capacity, dtype=values.dtype)
+      resized[:self.numberOfShapes] = values[:self.numberOfShapes]
+      self.columns[column] = resized
+
+  def rowForRootname(self, rootname):
+    """ Row at which a shape with this name would be inserted """
+    return bisect.bisect(self.rootnames, rootname)
+
+  def insertShape(self, row, filePath, timePoint, sigmaW, tris=0, weight=1.0):
+    self._reserve(self.numberOfShapes + 1)
+    for column, values in self.columns.items():
+      values[row + 1:self.numberOfShapes + 1] = values[row:self.numberOfShapes]
+    self.columns[TimePointColumn][row] = timePoint
+    self.columns[SigmaWColumn][row] = sigmaW
+    self.columns[TrisColumn][row] = tris
+    self.columns[WeightColumn][row] = weight
+    self.filePaths.insert(row, filePath)
+    self.rootnames.insert(row, os.path.splitext(os.path.basename(filePath))[0])
+    self.numberOfShapes += 1
+
+  def addShapes(self, filePaths, timePoints, sigmaWs):
+    """ Add several shapes at once and sort all the rows by shape name """
+    numberOfShapes = self.numberOfShapes + len(filePaths)
+    self._reserve(numberOfShapes)
+    new = slice(self.numberOfShapes, numberOfShapes)
+    self.columns[TimePointColumn][new] = timePoints
+    self.columns[SigmaWColumn][new] = sigmaWs
+    self.columns[TrisColumn][new] = 0
+    self.columns[WeightColumn][new] = 1.0
+    self.filePaths.extend(filePaths)
+    self.rootnames.extend([os.path.splitext(os.path.basename(filePath))[0] for filePath in filePaths])
+    self.numberOfShapes = numberOfShapes
+
+    order = sorted(range(numberOfShapes), key=self.rootnames.__getitem__)
+    self.filePaths = [self.filePaths[i] for i in order]
+    self.rootnames = [self.rootnames[i] for i in order]
+    for column, values in self.columns.items():
+      values[:numberOfShapes] = values[:numberOfShapes][order]
+
+  def value(self, row, column):
+    if column == RootnameColumn:
+      return self.rootnames[row]
+    return self.columns[column][row].item()
+
+  def setValue(self, row, column, value):
+    minimum, maximum = columnRanges[column]
+    self.columns[column][row] = min(max(value, minimum), maximum)
+
+  def setColumn(self, column, value, rows=None):
+    """ Set the same value to all the rows, or to the given rows, of a column """
+    minimum, maximum = columnRanges[column]
+    values = self.column(column)
+    if rows is None:
+      values[:] = np.clip(value, minimum, maximum)
+    else:
+      values[np.asarray(rows, dtype=np.intp)] = np.clip(value, minimum, maximum)
+
+  def fillColumnFromRegex(self, column, pattern, rows=None):
+    """ Set the column from the number found in each shape name by the regular
+    expression (its first group if it has one). Returns the rows not matched.
+    """
+    expression = re.compile(pattern)
+    if rows is None:
+      rows = range(self.numberOfShapes)
+    matchedRows = []
+    matchedValues = []
+    unmatchedRows = []
+    for row in rows:
+      match = expression.search(self.rootnames[row])
+      try:
+        value = float(match.group(1) if expression.groups > 0 else match.group(0))
+      except (AttributeError, TypeError, ValueError):
+        unmatchedRows.append(row)
+        continue
+      matchedRows.append(row)
+      matchedValues.append(value)
+    if len(matchedRows) > 0:
+      minimum, maximum = columnRanges[column]
+      self.column(column)[np.asarray(matchedRows, dtype=np.intp)] = np.clip(matchedValues, minimum, maximum)
+    return unmatchedRows
+
+  def pasteText(self, text, startRow, startColumn):
+    """ Paste a block of tab or comma separated values (e.g. copied from a
+    spreadsheet) with its top left cell at (startRow, startColumn). The shape
+    names column is never modified. Returns the number of rows pasted.
+    """
+    lines = [line for line in text.splitlines() if line.strip() != '']
+    if len(lines) == 0:
+      return 0
+    delimiter = '\t' if '\t' in lines[0] else ','
+    block = [[cell.strip() for cell in line.split(delimiter)] for line in lines]
+    numberOfRows = min(len(block), self.numberOfShapes - startRow)
+    rows = np.arange(startRow, startRow + numberOfRows)
+    for offset in range(max(len(cells) for cells in block)):
+      column = startColumn + offset
+      if column not in self.columns:
+        continue
+      cells = [cells[offset] if offset < len(cells) else '' for cells in block[:numberOfRows]]
+      values = np.array([float(cell) if cell != '' else np.nan for cell in cells])
+      valid = ~np.isnan(values)
+      minimum, maximum = columnRanges[column]
+      self.column(column)[rows[valid]] = np.clip(values[valid], minimum, maximum)
+    return numberOfRows
+
+  def regressionInputs(self):
+    """ Return the inputs of a regression, sorted by time point """
+    order = np.argsort(self.timePoints, kind='stable')
+    timePoints = self.timePoints[order].tolist()
+    sigmaWs = self.sigmaWs[order].tolist()
+    tris = self.tris[order].tolist()
+    weights = self.weights[order].tolist()
+    return [regressionInputStruct(self.filePaths[i], timePoint, sigmaW, shapeTris, weight)
+            for i, timePoint, sigmaW, shapeTris, weight in zip(order, timePoints, sigmaWs, tris, weights)]
@@ -0,0 +1,225 @@
+import collections
+import concurrent.futures
+import csv
+import logging
+import os
+import time
+
+import numpy as np
+from vtk.util import numpy_support
+
+from .Multiresolution import readPolyData
+from .ShapeScan import defaultNumberOfWorkers
+
+#
+# Validation of the inputs before shape4D is launched
+#
+# Bad inputs otherwise only show up after shape4D has run for a while, or as a
+# bare "Completed with errors". Each input shape is read once, in a pool of
+# workers, and checked with NumPy on its point and cell arrays:
+#   - errors, which block the launch: missing or unreadable file, empty mesh,
+#     NaN or infinite coordinates, cells other than triangles, cells pointing
+#     to points that do not exist;
+#   - warnings: degenerate triangles.
+# The inputs are then checked against each other: scale of each shape against
+# the median scale of the cohort, duplicate rows, time points, kernel widths
+# and weights. The report has one row per input shape.
+#
+
+InputValidationReportFileName = 'inputValidation.csv'
+
+# Scale of a shape (root mean square distance of its points to their
+# centroid) relative to the median scale of the cohort
+ScaleWarningRatio = 2.0
+ScaleErrorRatio = 10.0
+
+class validationIssueStruct(object):
+  def __init__(self, severity='error', code=None, message=None):
+    self.severity = severity
+    self.code = code
+    self.message = message
+
+class shapeValidationStruct(object):
+  def __init__(self, shapePath=None):
+    self.shapePath = shapePath
+    self.timePoint = None
+    self.numberOfPoints = None
+    self.numberOfCells = None
+    # Root mean square distance of the points to their centroid
+    self.scale = None
+    self.issues = []
+
+  def addIssue(self, severity, code, message):
+    self.issues.append(validationIssueStruct(severity, code, message))
+
+  @property
+  def hasErrors(self):
+    return any(issue.severity == 'error' for issue in self.issues)
+
+  @property
+  def status(self):
+    if self.hasErrors:
+      return 'error'
+    return 'warning' if len(self.issues) > 0 else 'ok'
+
+def _cellCount(cellArray):
+  return cellArray.GetNumberOfCells() if cellArray is not None else 0
+
+def validateShape(shapePath):
+  """ Check that a shape is a non empty, finite triangle mesh """
+  validation = shapeValidationStruct(shapePath)
+  if not os.path.isfile(shapePath):
+    validation.addIssue('error', 'missing', 'file not found')
+    return validation
+  polyData = readPolyData(shapePath)
+  validation.numberOfPoints = polyData.GetNumberOfPoints()
+  validation.numberOfCells = polyData.GetNumberOfCells()
+  if validation.numberOfPoints == 0 or polyData.GetPoints() is None:
+    validation.addIssue('error', 'empty', 'no point (empty or unreadable mesh)')
+    return validation
+
+  points = numpy_support.vtk_to_numpy(polyData.GetPoints().GetData())
+  finite = np.isfinite(points).all(axis=1)
+  numberOfNonFinitePoints = int(len(points) - finite.sum())
+  if numberOfNonFinitePoints > 0:
+    validation.addIssue('error', 'nan', '{} points with NaN or infinite coordinates'.format(numberOfNonFinitePoints))
+  if finite.any():
+    finitePoints = points[finite].astype(np.float64)
+    validation.scale = float(np.sqrt(((finitePoints - finitePoints.mean(axis=0)) ** 2).sum(axis=1).mean()))
+
+  numberOfOtherCells = (_cellCount(polyData.GetVerts()) + _cellCount(polyData.GetLines()) +
+                        _cellCount(polyData.GetStrips()))
+  numberOfPolys = _cellCount(polyData.GetPolys())
+  if numberOfPolys == 0:
+    validation.addIssue('error', 'empty', 'no triangle')
+    return validation
+  # Legacy layout (n, id_0, ..., id_n-1): the polygons are all triangles if and only if every 4th value is 3
+  legacyCells = numpy_support.vtk_to_numpy(polyData.GetPolys().GetData())
+  if len(legacyCells) == 4 * numberOfPolys and (legacyCells[0::4] == 3).all():
+    triangles = legacyCells.reshape(-1, 4)[:, 1:]
+  else:
+    triangles = None
+    sizes = []
+    index = 0
+    while index < len(legacyCells):
+      sizes.append(legacyCells[index])
+      index += legacyCells[index] + 1
+    numberOfOtherCells += int((np.asarray(sizes) != 3).sum())
+  if numberOfOtherCells > 0:
+    validation.addIssue('error', 'cells', '{} of {} cells are not triangles'.format(numberOfOtherCells, validation.numberOfCells))
+  if triangles is None:
+    return validation
+
+  if triangles.min() < 0 or triangles.max() >= validation.numberOfPoints:
+    validation.addIssue('error', 'cells', 'triangles pointing to points that do not exist')
+    return validation
+  if numberOfNonFinitePoints == 0:
+    corners = points.astype(np.float64)[triangles]
+    doubleAreas = np.sqrt((np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0]) ** 2).sum(axis=1))
+    numberOfDegenerateTriangles = int((doubleAreas <= 1e-12 * max(validation.scale, 1e-12) ** 2).sum())
+    if numberOfDegenerateTriangles > 0:
+      validation.addIssue('warning', 'degenerate', '{} triangles of zero area'.format(numberOfDegenerateTriangles))
+  return validation
+
+class inputValidationReportStruct(object):
+  def __init__(self):
+    # One per input, in the order of the inputs
+    self.shapes = []
+    # Issues of the inputs as a whole
+    self.issues = []
+    self.validationTime = 0.0
+
+  @property
+  def hasErrors(self):
+    return (any(issue.severity == 'error' for issue in self.issues) or
+            any(shape.hasErrors for shape in self.shapes))
+
+  def issueLines(self, severity=None):
+    lines = ['{}: {}'.format(issue.severity, issue.message) for issue in self.issues
+             if severity is None or issue.severity == severity]
+    for shape in self.shapes:
+      lines.extend('{}: {}: {}'.format(issue.severity, os.path.basename(shape.shapePath), issue.message)
+                   for issue in shape.issues if severity is None or issue.severity == severity)
+    return lines
+
+  def text(self, maximumNumberOfLines=20):
+    lines = self.issueLines('error') + self.issueLines('warning')
+    if len(lines) == 0:
+      return '{} input shapes checked, no problem found'.format(len(self.shapes))
+    if len(lines) > maximumNumberOfLines:
+      lines = lines[:maximumNumberOfLines] + ['... and {} more'.format(len(lines) - maximumNumberOfLines)]
+    return '\n'.join(lines)
+
+  def writeReport(self, reportFilePath):
+    """ One row per input shape, with its issues """
+    with open(reportFilePath, 'w') as csvfile:
+      cw = csv.writer(csvfile, delimiter=',', lineterminator='\n')
+      cw.writerow(['shapePath', 'timePoint', 'status', 'numberOfPoints', 'numberOfCells', 'scale', 'issues'])
+      for shape in self.shapes:
+        cw.writerow([shape.shapePath, shape.timePoint, shape.status,
+                     '' if shape.numberOfPoints is None else shape.numberOfPoints,
+                     '' if shape.numberOfCells is None else shape.numberOfCells,
+                     '' if shape.scale is None else shape.scale,
+                     '; '.join('{}: {}'.format(issue.severity, issue.message) for issue in shape.issues)])
+    return reportFilePath
+
+def validateInputs(parameters, numberOfWorkers=None):
+  """ Check the input shapes of the regression and their parameters. Returns
+  the inputValidationReportStruct; the regression should not be launched if
+  it has errors.
+  """
+  startTime = time.time()
+  report = inputValidationReportStruct()
+  inputs = parameters.inputs
+  shapePaths = list(collections.OrderedDict.fromkeys(regressionInput.shapePath for regressionInput in inputs))
+  with concurrent.futures.ThreadPoolExecutor(max_workers=numberOfWorkers or defaultNumberOfWorkers()) as executor:
+    validations = dict(zip(shapePaths, executor.map(validateShape, shapePaths)))
+
+  # Shapes listed several times share the checks of their mesh
+  rows = collections.Counter((regressionInput.shapePath, float(regressionInput.timePoint)) for regressionInput in inputs)
+  for regressionInput in inputs:
+    meshValidation = validations[regressionInput.shapePath]
+    shape = shapeValidationStruct(regressionInput.shapePath)
+    shape.timePoint = float(regressionInput.timePoint)
+    shape.numberOfPoints = meshValidation.numberOfPoints
+    shape.numberOfCells = meshValidation.numberOfCells
+    shape.scale = meshValidation.scale
+    shape.issues = list(meshValidation.issues)
+    if rows[(shape.shapePath, shape.timePoint)] > 1:
+      shape.addIssue('error', 'duplicate', 'listed {} times at time point {}'.format(rows[(shape.shapePath, shape.timePoint)],
+                                                                                  shape.timePoint))
+    if not regressionInput.sigmaW > 0:
+      shape.addIssue('error', 'sigmaW', 'sigmaW {} is not positive'.format(regressionInput.sigmaW))
+    if not regressionInput.weight > 0:
+      shape.addIssue('error', 'weight', 'weight {} is not positive'.format(regressionInput.weight))
+    if parameters.tn > parameters.t0 and not parameters.t0 <= shape.timePoint <= parameters.tn:
+      shape.addIssue('warning', 'timePoint', 'time point {} outside of [{}, {}]'.format(shape.timePoint, parameters.t0, parameters.tn))
+    report.shapes.append(shape)
+
+  scales = np.array([shape.scale for shape in report.shapes if shape.scale is not None and shape.scale > 0])
+  if len(scales) > 1:
+    medianScale = float(np.median(scales))
+    for shape in report.shapes:
+      if shape.scale is None or medianScale <= 0:
+        continue
+      ratio = max(shape.scale / medianScale, medianScale / shape.scale) if shape.scale > 0 else np.inf
+      if ratio >= ScaleErrorRatio:
+        shape.addIssue('error', 'scale', 'scale {:.4g} is {:.1f} times away from the median scale {:.4g}'.format(
+          shape.scale, ratio, medianScale))
+      elif ratio >= ScaleWarningRatio:
+        shape.addIssue('warning', 'scale', 'scale {:.4g} is {:.1f} times away from the median scale {:.4g}'.format(
+          shape.scale, ratio, medianScale))
+
+  timePoints = sorted(float(regressionInput.timePoint) for regressionInput in inputs)
+  if len(timePoints) > 1 and timePoints[0] == timePoints[-1]:
+    report.issues.append(validationIssueStruct('error', 'timePoint', 'all the shapes are at the same time point {}'.format(timePoints[0])))
+  elif len(timePoints) > 1 and timePoints[0] == timePoints[1]:
+    # shape4D deforms the first shape of the earliest time point: the other ones are only targets
+    report.issues.append(validationIssueStruct('warning', 'timePoint', '{} shapes at the earliest time point {}, the source is the first one'.format(
+      timePoints.count(timePoints[0]), timePoints[0])))
+
+  report.validationTime = time.time() - startTime
+  numberOfErrors = len(report.issueLines('error'))
+  logging.info("Validated {} input shapes in {:.1f}s: {} errors, {} warnings".format(
+    len(shapePaths), report.validationTime, numberOfErrors, len(report.issueLines('warning'))))
+  return report
@@ -0,0 +1,330 @@
+import argparse
+import copy
+import json
+import logging
+import os
+import socket
+import sqlite3
+import sys
+import time
+
+from .RegressionParameters import RegressionParameters, regressionInputStruct, writeInputFiles
+from .Shape4DProcess import Shape4DExecutableEnvironmentVariable, Shape4DProcess, findShape4DExecutable
+
+#
+# Persistent queue of regressions
+#
+# The jobs are stored in a SQLite database, so that the queue survives a
+# restart of Slicer and can be shared by several processes: the module widget
+# and headless workers (python -m RegressionComputationLib.JobQueue) run the
+# jobs of the same queue. A job is claimed in a transaction, so that it is run
+# once, and only if fewer jobs than the concurrency limit are running in all
+# the processes. The queued jobs are run by decreasing priority, then in the
+# order they were submitted. Each job is run in its own output directory, in
+# the Jobs subdirectory of the output directory of its parameters.
+#
+# A job is cancelled by the process running it: the cancellation of a running
+# job is requested in the queue and applied at the next poll of its owner. The
+# jobs of a process that died are queued again when the queue is opened.
+#
+
+JobsDirectoryName = 'Jobs'
+
+_schemaVersion = 1
+
+_jobColumns = ('id', 'name', 'priority', 'status', 'parameters', 'outputDirectory', 'submitTime', 'startTime',
+               'endTime', 'attempts', 'owner', 'cancelRequested', 'message')
+
+class regressionJobStruct(object):
+  def __init__(self):
+    self.id = None
+    self.name = None
+    self.priority = 0
+    # 'Queued', 'Running', or the final status of the shape4D run
+    self.status = 'Queued'
+    self.parameters = None
+    self.outputDirectory = None
+    self.submitTime = None
+    self.startTime = None
+    self.endTime = None
+    self.attempts = 0
+    # Process running the job, as host:pid
+    self.owner = None
+    self.cancelRequested = False
+    self.message = None
+
+  @property
+  def isFinished(self):
+    return self.status not in ('Queued', 'Running')
+
+  @property
+  def elapsedTime(self):
+    if self.startTime is None:
+      return 0.0
+    return (self.endTime or time.time()) - self.startTime
+
+def parametersToDict(parameters):
+  description = dict(parameters.__dict__)
+  description['inputs'] = [dict(regressionInput.__dict__) for regressionInput in parameters.inputs]
+  return description
+
+def parametersFromDict(description):
+  parameters = RegressionParameters()
+  for name, value in description.items():
+    if name == 'inputs':
+      value = [regressionInputStruct(**regressionInput) for regressionInput in value]
+    setattr(parameters, name, value)
+  return parameters
+
+def currentOwner():
+  return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+def isOwnerAlive(owner):
+  """ False if the owner is a process of this host that does not exist anymore """
+  host, separator, pid = (owner or '').rpartition(':')
+  if host != socket.gethostname() or not pid.isdigit():
+    return True
+  if sys.platform == 'win32':
+    # os.kill would terminate the process on Windows
+    return True
+  try:
+    os.kill(int(pid), 0)
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    return True
+  return True
+
+class JobQueue(object):
+
+  def __init__(self, queueFilePath):
+    self.queueFilePath = queueFilePath
+    queueDirectory = os.path.dirname(os.path.abspath(queueFilePath))
+    if not os.path.isdir(queueDirectory):
+      os.makedirs(queueDirectory)
+    # Autocommit: the transactions are explicit
+    self.connection = sqlite3.connect(queueFilePath, timeout=30.0, isolation_level=None)
+    self.connection.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                            'id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, priority INTEGER NOT NULL DEFAULT 0, '
+                            'status TEXT NOT NULL, parameters TEXT NOT NULL, outputDirectory TEXT, submitTime REAL, '
+                            'startTime REAL, endTime REAL, attempts INTEGER NOT NULL DEFAULT 0, owner TEXT, '
+                            'cancelRequested INTEGER NOT NULL DEFAULT 0, message TEXT)')
+    self.connection.execute('PRAGMA user_version = {}'.format(_schemaVersion))
+    self.recoverJobs()
+
+  def close(self):
+    if self.connection is not None:
+      self.connection.close()
+      self.connection = None
+
+  def _job(self, row):
+    job = regressionJobStruct()
+    for name, value in zip(_jobColumns, row):
+      setattr(job, name, value)
+    job.parameters = parametersFromDict(json.loads(job.parameters))
+    job.cancelRequested = bool(job.cancelRequested)
+    return job
+
+  def _select(self, condition='', arguments=()):
+    cursor = self.connection.execute('SELECT {} FROM jobs {}'.format(', '.join(_jobColumns), condition), arguments)
+    return [self._job(row) for row in cursor.fetchall()]
+
+  def submit(self, parameters, priority=0, name=None):
+    """ Queue a regression. Its outputs are written in its own directory,
+    Jobs/job_<id> in the output directory of the parameters. Returns the job.
+    """
+    errorMessage = parameters.checkInputs()
+    if errorMessage is not None:
+      raise ValueError(errorMessage)
+    parameters = copy.deepcopy(parameters)
+    jobsDirectory = os.path.join(parameters.outputDirectory, JobsDirectoryName)
+    self.connection.execute('BEGIN IMMEDIATE')
+    try:
+      cursor = self.connection.execute('INSERT INTO jobs (name, priority, status, parameters, submitTime) VALUES (?, ?, ?, ?, ?)',
+                                       (name, priority, 'Queued', '{}', time.time()))
+      jobId = cursor.lastrowid
+      parameters.outputDirectory = os.path.join(jobsDirectory, 'job_{:04d}'.format(jobId))
+      self.connection.execute('UPDATE jobs SET name = ?, parameters = ?, outputDirectory = ? WHERE id = ?',
+                              (name or '{}job_{:04d}'.format(parameters.outputPrefix, jobId),
+                               json.dumps(parametersToDict(parameters)), parameters.outputDirectory, jobId))
+      self.connection.execute('COMMIT')
+    except Exception:
+      self.connection.execute('ROLLBACK')
+      raise
+    logging.info("Job {} queued in {}".format(jobId, self.queueFilePath))
+    return self.job(jobId)
+
+  def job(self, jobId):
+    jobs = self._select('WHERE id = ?', (jobId,))
+    return jobs[0] if len(jobs) > 0 else None
+
+  def jobs(self):
+    return self._select('ORDER BY id')
+
+  def numberOfJobs(self, status):
+    return self.connection.execute('SELECT COUNT(*) FROM jobs WHERE status = ?', (status,)).fetchone()[0]
+
+  def claimNextJob(self, owner, maximumRunningJobs):
+    """ Mark the next queued job as run by owner and return it, or None if
+    there is none or if maximumRunningJobs jobs are already running
+    """
+    self.connection.execute('BEGIN IMMEDIATE')
+    try:
+      jobId = None
+      if self.numberOfJobs('Running') < maximumRunningJobs:
+        row = self.connection.execute("SELECT id FROM jobs WHERE status = 'Queued' ORDER BY priority DESC, id LIMIT 1").fetchone()
+        if row is not None:
+          self.connection.execute("UPDATE jobs SET status = 'Running', owner = ?, startTime = ?, endTime = NULL, "
+                                  "attempts = attempts + 1, cancelRequested = 0, message = NULL WHERE id = ?",
+                                  (owner, time.time(), row[0]))
+          jobId = row[0]
+      self.connection.execute('COMMIT')
+    except Exception:
+      self.connection.execute('ROLLBACK')
+      raise
+    return self.job(jobId) if jobId is not None else None
+
+  def finishJob(self, jobId, status, message=None):
+    self.connection.execute('UPDATE jobs SET status = ?, endTime = ?, message = ?, cancelRequested = 0 WHERE id = ?',
+                            (status, time.time(), message, jobId))
+
+  def requeueJob(self, jobId):
+    """ Queue a job again, e.g. when its owner stops before it is finished """
+    self.connection.execute("UPDATE jobs SET status = 'Queued', owner = NULL, startTime = NULL, endTime = NULL, "
+                            "cancelRequested = 0 WHERE id = ?", (jobId,))
+
+  def cancel(self, jobId):
+    """ Cancel a queued job, or request the cancellation of a running one to its owner """
+    self.connection.execute("UPDATE jobs SET status = 'Cancelled', endTime = ? WHERE id = ? AND status = 'Queued'",
+                            (time.time(), jobId))
+    self.connection.execute("UPDATE jobs SET cancelRequested = 1 WHERE id = ? AND status = 'Running'", (jobId,))
+
+  def retry(self, jobId):
+    """ Queue a finished job again """
+    self.connection.execute("UPDATE jobs SET status = 'Queued', owner = NULL, startTime = NULL, endTime = NULL, "
+                            "cancelRequested = 0, message = NULL WHERE id = ? AND status NOT IN ('Queued', 'Running')",
+                            (jobId,))
+
+  def setPriority(self, jobId, priority):
+    self.connection.execute('UPDATE jobs SET priority = ? WHERE id = ?', (priority, jobId))
+
+  def remove(self, jobId):
+    """ Remove a job from the queue, unless it is running. Its outputs are kept. """
+    self.connection.execute("DELETE FROM jobs WHERE id = ? AND status != 'Running'", (jobId,))
+
+  def cancelRequestedJobIds(self, owner):
+    cursor = self.connection.execute("SELECT id FROM jobs WHERE status = 'Running' AND owner = ? AND cancelRequested = 1",
+                                     (owner,))
+    return [row[0] for row in cursor.fetchall()]
+
+  def recoverJobs(self):
+    """ Queue again the running jobs of the processes of this host that died """
+    for job in self._select("WHERE status = 'Running'"):
+      if not isOwnerAlive(job.owner):
+        logging.warning("Job {} was interrupted ({} stopped), it is queued again".format(job.id, job.owner))
+        self.requeueJob(job.id)
+
+class JobRunner(object):
+  """ Run the jobs of a queue from a single thread, which polls the runner.
+  The jobs are started with startJob(job), which returns a started process
+  with the interface of Shape4DProcess (poll, statusString, cancel);
+  by default a Shape4DProcess of the shape4D executable.
+  """
+
+  def __init__(self, queue, maximumRunningJobs=1, startJob=None, executable=None, numberOfThreads=None):
+    self.queue = queue
+    self.maximumRunningJobs = maximumRunningJobs
+    self.startJob = startJob or self._startShape4DProcess
+    self.executable = executable
+    self.numberOfThreads = numberOfThreads
+    self.owner = currentOwner()
+    # Job id -> (job, process)
+    self.runningJobs = dict()
+    self.cancellingJobIds = set()
+    # The jobs of a previous runner of this process can not be followed anymore
+    for job in self.queue.jobs():
+      if job.status == 'Running' and job.owner == self.owner:
+        self.queue.requeueJob(job.id)
+
+  def _startShape4DProcess(self, job):
+    if self.executable is None:
+      self.executable = findShape4DExecutable()
+    if self.executable is None:
+      raise ValueError('shape4D executable not found, set the {} environment variable.'.format(Shape4DExecutableEnvironmentVariable))
+    return Shape4DProcess(self.executable, writeJobInputFiles(job), numberOfThreads=self.numberOfThreads).start()
+
+  def poll(self):
+    """ Apply the cancellation requests, collect the finished jobs and start
+    the next ones. Returns True while jobs of this runner are running.
+    """
+    for jobId in self.queue.cancelRequestedJobIds(self.owner):
+      if jobId in self.runningJobs and jobId not in self.cancellingJobIds:
+        logging.info("Cancel job {}".format(jobId))
+        self.cancellingJobIds.add(jobId)
+        self.runningJobs[jobId][1].cancel()
+    for jobId, (job, process) in list(self.runningJobs.items()):
+      if process.poll() is not None:
+        self._finishJob(job, process)
+    while len(self.runningJobs) < self.maximumRunningJobs:
+      job = self.queue.claimNextJob(self.owner, self.maximumRunningJobs)
+      if job is None:
+        break
+      logging.info("Start job {} ({})".format(job.id, job.name))
+      try:
+        self.runningJobs[job.id] = (job, self.startJob(job))
+      except (ValueError, OSError) as e:
+        logging.error("Job {} could not be started: {}".format(job.id, e))
+        self.queue.finishJob(job.id, 'Completed with errors', str(e))
+    return self.isRunning()
+
+  def isRunning(self):
+    return len(self.runningJobs) > 0
+
+  def _finishJob(self, job, process):
+    del self.runningJobs[job.id]
+    self.cancellingJobIds.discard(job.id)
+    status = process.statusString()
+    self.queue.finishJob(job.id, status)
+    logging.info("Job {} {}".format(job.id, status.lower()))
+
+  def stop(self):
+    """ Stop the running jobs of this runner and queue them again """
+    for jobId, (job, process) in list(self.runningJobs.items()):
+      process.cancel()
+      self.queue.requeueJob(jobId)
+    self.runningJobs = dict()
+    self.cancellingJobIds = set()
+
+  def drain(self, pollingInterval=5.0):
+    """ Run jobs until the queue has no queued job and no job of this runner is running """
+    try:
+      while self.poll() or self.queue.numberOfJobs('Queued') > 0:
+        time.sleep(pollingInterval)
+    except KeyboardInterrupt:
+      self.stop()
+      raise
+
+def writeJobInputFiles(job):
+  """ Write the CSV and driver files of a job in its output directory. Returns the driver file path. """
+  if not os.path.isdir(job.parameters.outputDirectory):
+    os.makedirs(job.parameters.outputDirectory)
+  return writeInputFiles(job.parameters)
+
+def main(arguments=None):
+  """ Headless worker draining a queue: python -m RegressionComputationLib.JobQueue queue.sqlite """
+  parser = argparse.ArgumentParser(description='Run the regressions of a job queue.')
+  parser.add_argument('queueFilePath')
+  parser.add_argument('--jobs', type=int, default=1, help='maximum number of jobs running at once in all the processes')
+  parser.add_argument('--threads', type=int, default=None, help='number of threads of each shape4D run')
+  parser.add_argument('--executable', default=None, help='shape4D executable')
+  parser.add_argument('--interval', type=float, default=5.0, help='polling interval in seconds')
+  options = parser.parse_args(arguments)
+  logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+  queue = JobQueue(options.queueFilePath)
+  try:
+    JobRunner(queue, options.jobs, executable=options.executable, numberOfThreads=options.threads).drain(options.interval)
+  finally:
+    queue.close()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,168 @@
+import logging
+import mmap
+import re
+
+import numpy as np
+
+#
+# Header-only reader for legacy VTK polydata files
+#
+# Only the POINTS block is decoded, directly from a memory map of the file:
+# the cells and the point data arrays are never read, only the headers of the
+# cell sections are used to count the cells. Files this reader does not
+# understand are reported with a None result so that the caller can fall back
+# to vtkPolyDataReader.
+#
+
+_pointsDataTypes = {
+  'float': 'f4',
+  'double': 'f8',
+}
+
+# Size of the offsets/connectivity arrays of the version 5 file format. The
+# writer stores the vtkIdType arrays as 32 bit integers.
+_cellArrayItemSizes = {
+  'vtkidtype': 4,
+  'vtktypeint32': 4,
+  'vtktypeint64': 8,
+}
+
+_cellSections = ('VERTICES', 'LINES', 'POLYGONS', 'TRIANGLE_STRIPS')
+
+# In an ASCII file the points block ends with the next section keyword
+_sectionKeyword = re.compile(rb'^[A-Z_]{4,}', re.MULTILINE)
+_asciiCellSectionHeader = re.compile(
+  rb'^(VERTICES|LINES|POLYGONS|TRIANGLE_STRIPS|POINT_DATA|CELL_DATA)[ \t]+(\d+)', re.MULTILINE)
+
+class legacyVTKInformationStruct(object):
+  def __init__(self):
+    self.numberOfPoints = None
+    self.bounds = None
+    self.numberOfCells = None
+
+def _readLine(mm):
+  line = mm.readline()
+  if not line:
+    raise EOFError
+  return line.decode('ascii', errors='replace').strip()
+
+def _readNonEmptyLine(mm):
+  line = ''
+  while line == '':
+    line = _readLine(mm)
+  return line
+
+def _emptyBounds():
+  # Same convention as vtkPolyData::GetBounds() for an empty dataset
+  return (1.0, -1.0, 1.0, -1.0, 1.0, -1.0)
+
+def readLegacyVTKInformation(shapeFilePath):
+  """ Return the number of points, the bounds and the number of cells of a
+  legacy VTK polydata file, or None if the file can not be handled by this
+  reader. The number of cells is None if the cell sections can not be parsed.
+  """
+  try:
+    with open(shapeFilePath, 'rb') as f:
+      with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return _readInformation(mm)
+  except (OSError, ValueError, EOFError, UnicodeDecodeError) as e:
+    logging.debug("Fast reader unable to read {}: {}".format(shapeFilePath, e))
+    return None
+
+def _readInformation(mm):
+  # Header: version, title, file type and dataset type
+  versionLine = _readLine(mm)
+  if not versionLine.startswith('# vtk DataFile'):
+    return None
+  version = re.search(r'(\d+)\.\d+', versionLine)
+  version5 = version is not None and int(version.group(1)) >= 5
+  _readLine(mm)
+  fileType = _readLine(mm).upper()
+  if fileType not in ('ASCII', 'BINARY'):
+    return None
+  dataset = _readLine(mm).split()
+  if len(dataset) != 2 or dataset[0].upper() != 'DATASET' or dataset[1].upper() != 'POLYDATA':
+    return None
+
+  # The POINTS keyword has to come first (no field data before the points)
+  pointsHeader = _readNonEmptyLine(mm).split()
+  if len(pointsHeader) != 3 or pointsHeader[0].upper() != 'POINTS':
+    return None
+  dataType = _pointsDataTypes.get(pointsHeader[2].lower())
+  if dataType is None:
+    return None
+
+  information = legacyVTKInformationStruct()
+  information.numberOfPoints = int(pointsHeader[1])
+  start = mm.tell()
+  numberOfValues = 3 * information.numberOfPoints
+  if fileType == 'BINARY':
+    # Legacy binary files are big endian
+    end = start + numberOfValues * np.dtype(dataType).itemsize
+    if end > len(mm):
+      return None
+    points = np.frombuffer(mm, dtype='>' + dataType, count=numberOfValues, offset=start)
+    information.bounds = _bounds(points)
+    # Release the view on the map before it is closed
+    del points
+    information.numberOfCells = _countCellsBinary(mm, end, version5)
+  else:
+    match = _sectionKeyword.search(mm, start)
+    end = match.start() if match else len(mm)
+    try:
+      points = np.array(mm[start:end].split(), dtype=np.float64)
+    except ValueError:
+      return None
+    if points.size < numberOfValues:
+      return None
+    information.bounds = _bounds(points[:numberOfValues])
+    information.numberOfCells = _countCellsASCII(mm, end, version5)
+  return information
+
+def _countCells(numberOfCellsInHeader, version5):
+  # In the version 5 file format the header gives the number of offsets
+  if version5:
+    return max(numberOfCellsInHeader - 1, 0)
+  return numberOfCellsInHeader
+
+def _countCellsASCII(mm, position, version5):
+  numberOfCells = 0
+  while True:
+    match = _asciiCellSectionHeader.search(mm, position)
+    if match is None or match.group(1) in (b'POINT_DATA', b'CELL_DATA'):
+      return numberOfCells
+    numberOfCells += _countCells(int(match.group(2)), version5)
+    position = match.end()
+
+def _countCellsBinary(mm, position, version5):
+  numberOfCells = 0
+  mm.seek(position)
+  try:
+    while True:
+      header = _readNonEmptyLine(mm).split()
+      if len(header) != 3 or header[0].upper() not in _cellSections:
+        return numberOfCells
+      numberOfCellsInHeader, size = int(header[1]), int(header[2])
+      numberOfCells += _countCells(numberOfCellsInHeader, version5)
+      if version5:
+        # OFFSETS and CONNECTIVITY arrays
+        for numberOfItems in (numberOfCellsInHeader, size):
+          arrayHeader = _readNonEmptyLine(mm).split()
+          itemSize = _cellArrayItemSizes[arrayHeader[1].lower()]
+          mm.seek(mm.tell() + numberOfItems * itemSize)
+      else:
+        mm.seek(mm.tell() + size * 4)
+  except EOFError:
+    return numberOfCells
+  except (ValueError, KeyError, IndexError):
+    return None
+
+def _bounds(points):
+  if points.size == 0:
+    return _emptyBounds()
+  points = points.reshape(-1, 3)
+  minimum = points.min(axis=0)
+  maximum = points.max(axis=0)
+  return (float(minimum[0]), float(maximum[0]),
+          float(minimum[1]), float(maximum[1]),
+          float(minimum[2]), float(maximum[2]))
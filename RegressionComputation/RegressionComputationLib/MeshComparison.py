@@ -0,0 +1,157 @@
+import concurrent.futures
+import csv
+import glob
+import os
+
+import numpy as np
+from vtk.util import numpy_support
+
+from .Multiresolution import readPolyData
+from .ShapeScan import defaultNumberOfWorkers
+
+#
+# Comparison of meshes with tolerances
+#
+# The points, the cells and every point data array of two meshes are compared
+# on NumPy views of their VTK arrays. Values a and b are equal within the
+# tolerances if |a - b| <= absoluteTolerance + relativeTolerance * |b|, as
+# numpy.isclose, and the maximum and root mean square errors of each array are
+# reported over its finite values. Directories of outputs, e.g. of two versions
+# of shape4D, are compared file by file in parallel.
+#
+
+_cellTypes = ('Verts', 'Lines', 'Polys', 'Strips')
+
+class arrayComparisonStruct(object):
+  def __init__(self, name=None):
+    self.name = name
+    self.maximumError = 0.0
+    self.rootMeanSquareError = 0.0
+    self.numberOfMismatches = 0
+
+  @property
+  def equal(self):
+    return self.numberOfMismatches == 0
+
+def compareArrays(name, values1, values2, absoluteTolerance=0.0, relativeTolerance=0.0):
+  """ Errors between two arrays of the same shape. NaN and infinite values
+  are only equal to the same value; the errors are computed over the values
+  that are finite in both arrays.
+  """
+  comparison = arrayComparisonStruct(name)
+  if values1.size == 0:
+    return comparison
+  values1 = np.asarray(values1, dtype=np.float64)
+  values2 = np.asarray(values2, dtype=np.float64)
+  finite = np.isfinite(values1) & np.isfinite(values2)
+  nonFiniteEqual = (values1[~finite] == values2[~finite]) | (np.isnan(values1[~finite]) & np.isnan(values2[~finite]))
+  errors = np.abs(values1[finite] - values2[finite])
+  if errors.size > 0:
+    comparison.maximumError = float(errors.max())
+    comparison.rootMeanSquareError = float(np.sqrt((errors ** 2).mean()))
+  mismatches = errors > absoluteTolerance + relativeTolerance * np.abs(values2[finite])
+  comparison.numberOfMismatches = int(mismatches.sum()) + int((~nonFiniteEqual).sum())
+  return comparison
+
+class meshComparisonStruct(object):
+  def __init__(self, name=None):
+    self.name = name
+    # Differences of structure: number of points, cells, names and components of the arrays
+    self.differences = []
+    self.arrays = []
+
+  @property
+  def equal(self):
+    return len(self.differences) == 0 and all(comparison.equal for comparison in self.arrays)
+
+  def text(self):
+    lines = list(self.differences)
+    for comparison in self.arrays:
+      if not comparison.equal:
+        lines.append('{}: {} values differ, maximum error {:.6g}, RMS error {:.6g}'.format(
+          comparison.name, comparison.numberOfMismatches, comparison.maximumError, comparison.rootMeanSquareError))
+    return '; '.join(lines) if len(lines) > 0 else 'equal'
+
+def _legacyCells(polyData, cellType):
+  return numpy_support.vtk_to_numpy(getattr(polyData, 'Get' + cellType)().GetData())
+
+def _pointDataArrays(polyData):
+  arrays = dict()
+  pointData = polyData.GetPointData()
+  for index in range(pointData.GetNumberOfArrays()):
+    array = pointData.GetAbstractArray(index)
+    arrays[array.GetName() or 'Array {}'.format(index)] = array
+  return arrays
+
+def comparePolyData(polyData1, polyData2, absoluteTolerance=0.0, relativeTolerance=0.0, name=None):
+  """ Compare the points, the cells and the point data arrays of two vtkPolyData """
+  comparison = meshComparisonStruct(name)
+  numberOfPoints1 = polyData1.GetNumberOfPoints()
+  numberOfPoints2 = polyData2.GetNumberOfPoints()
+  if numberOfPoints1 != numberOfPoints2:
+    comparison.differences.append('{} points != {} points'.format(numberOfPoints1, numberOfPoints2))
+    return comparison
+  if numberOfPoints1 > 0:
+    comparison.arrays.append(compareArrays('Points', numpy_support.vtk_to_numpy(polyData1.GetPoints().GetData()),
+                                           numpy_support.vtk_to_numpy(polyData2.GetPoints().GetData()),
+                                           absoluteTolerance, relativeTolerance))
+
+  for cellType in _cellTypes:
+    cells1 = _legacyCells(polyData1, cellType)
+    cells2 = _legacyCells(polyData2, cellType)
+    if cells1.shape != cells2.shape or not np.array_equal(cells1, cells2):
+      comparison.differences.append('{} differ'.format(cellType))
+
+  arrays1 = _pointDataArrays(polyData1)
+  arrays2 = _pointDataArrays(polyData2)
+  for arrayName in sorted(set(arrays1) ^ set(arrays2)):
+    comparison.differences.append('point data array {} only in {}'.format(arrayName, 'the first mesh' if arrayName in arrays1 else 'the second mesh'))
+  for arrayName in sorted(set(arrays1) & set(arrays2)):
+    array1 = arrays1[arrayName]
+    array2 = arrays2[arrayName]
+    if array1.GetNumberOfComponents() != array2.GetNumberOfComponents():
+      comparison.differences.append('point data array {}: {} components != {} components'.format(
+        arrayName, array1.GetNumberOfComponents(), array2.GetNumberOfComponents()))
+      continue
+    if not (array1.IsNumeric() and array2.IsNumeric()):
+      continue
+    comparison.arrays.append(compareArrays(arrayName, numpy_support.vtk_to_numpy(array1), numpy_support.vtk_to_numpy(array2),
+                                           absoluteTolerance, relativeTolerance))
+  return comparison
+
+def compareMeshFiles(filePath1, filePath2, absoluteTolerance=0.0, relativeTolerance=0.0):
+  return comparePolyData(readPolyData(filePath1), readPolyData(filePath2), absoluteTolerance, relativeTolerance,
+                         name=os.path.basename(filePath2))
+
+def compareDirectories(directory1, directory2, pattern='*.vtk', absoluteTolerance=0.0, relativeTolerance=0.0,
+                       numberOfWorkers=None):
+  """ Compare the meshes of the same name in two directories. The meshes found
+  in one directory only are reported as differences.
+  """
+  fileNames1 = set(os.path.basename(filePath) for filePath in glob.glob(os.path.join(directory1, pattern)))
+  fileNames2 = set(os.path.basename(filePath) for filePath in glob.glob(os.path.join(directory2, pattern)))
+  comparisons = []
+  for fileName in sorted(fileNames1 ^ fileNames2):
+    comparison = meshComparisonStruct(fileName)
+    comparison.differences.append('only in {}'.format(directory1 if fileName in fileNames1 else directory2))
+    comparisons.append(comparison)
+  fileNames = sorted(fileNames1 & fileNames2)
+  with concurrent.futures.ThreadPoolExecutor(max_workers=numberOfWorkers or defaultNumberOfWorkers()) as executor:
+    comparisons.extend(executor.map(lambda fileName: compareMeshFiles(os.path.join(directory1, fileName),
+                                                                      os.path.join(directory2, fileName),
+                                                                      absoluteTolerance, relativeTolerance),
+                                    fileNames))
+  return sorted(comparisons, key=lambda comparison: comparison.name)
+
+def writeComparisonReport(comparisons, reportFilePath):
+  """ One row per array of each mesh, and one row per mesh with differences of structure """
+  with open(reportFilePath, 'w') as csvfile:
+    cw = csv.writer(csvfile, delimiter=',', lineterminator='\n')
+    cw.writerow(['mesh', 'array', 'equal', 'mismatches', 'maximumError', 'rootMeanSquareError', 'differences'])
+    for comparison in comparisons:
+      if len(comparison.differences) > 0:
+        cw.writerow([comparison.name, '', 0, '', '', '', '; '.join(comparison.differences)])
+      for arrayComparison in comparison.arrays:
+        cw.writerow([comparison.name, arrayComparison.name, int(arrayComparison.equal), arrayComparison.numberOfMismatches,
+                     arrayComparison.maximumError, arrayComparison.rootMeanSquareError, ''])
+  return reportFilePath
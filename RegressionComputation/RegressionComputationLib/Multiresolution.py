@@ -0,0 +1,237 @@
+import concurrent.futures
+import copy
+import csv
+import logging
+import math
+import os
+import time
+
+import vtk
+
+from .RegressionParameters import writeInputFiles
+from .Shape4DLog import readShape4DLog
+from .Shape4DProcess import shape4DProcessStarter
+from .ShapeScan import defaultNumberOfWorkers
+from .WarmStart import findInitialVelocityFile
+
+#
+# Coarse to fine regression
+#
+# The input shapes are decimated into a pyramid of resolutions. The regression
+# is run on the coarsest level first, with kernels scaled with the spacing of
+# the points, and the V0 of each level is interpolated on the source shape of
+# the next finer level to initialize it. The finest level is the regression on
+# the original shapes, written in the output directory of the parameters; the
+# coarser levels are written in its Multiresolution subdirectory.
+#
+
+MultiresolutionDirectoryName = 'Multiresolution'
+
+def readPolyData(filePath):
+  reader = vtk.vtkPolyDataReader()
+  reader.SetFileName(filePath)
+  reader.Update()
+  return reader.GetOutput()
+
+def writePolyData(polyData, filePath):
+  writer = vtk.vtkPolyDataWriter()
+  writer.SetFileName(filePath)
+  writer.SetInputData(polyData)
+  writer.SetFileTypeToBinary()
+  writer.Write()
+  return filePath
+
+def decimateShape(inputFilePath, outputFilePath, pointsFraction):
+  """ Decimate a shape to about pointsFraction of its points """
+  triangleFilter = vtk.vtkTriangleFilter()
+  triangleFilter.SetInputData(readPolyData(inputFilePath))
+  decimation = vtk.vtkQuadricDecimation()
+  decimation.SetInputConnection(triangleFilter.GetOutputPort())
+  decimation.SetTargetReduction(1.0 - pointsFraction)
+  decimation.VolumePreservationOn()
+  decimation.Update()
+  return writePolyData(decimation.GetOutput(), outputFilePath)
+
+def interpolateInitialVelocity(initV0FilePath, sourceShapeFilePath, outputFilePath, kernelRadius):
+  """ Interpolate the point data of a V0 file on the points of another source shape """
+  interpolator = vtk.vtkPointInterpolator()
+  interpolator.SetInputData(readPolyData(sourceShapeFilePath))
+  interpolator.SetSourceData(readPolyData(initV0FilePath))
+  kernel = vtk.vtkGaussianKernel()
+  kernel.SetRadius(kernelRadius)
+  kernel.SetSharpness(2.0)
+  interpolator.SetKernel(kernel)
+  interpolator.SetNullPointsStrategyToClosestPoint()
+  interpolator.Update()
+  return writePolyData(interpolator.GetOutput(), outputFilePath)
+
+class multiresolutionLevelStruct(object):
+  def __init__(self, level=0, pointsFraction=1.0, parameters=None):
+    self.level = level
+    self.pointsFraction = pointsFraction
+    # Ratio between the spacing of the points of the level and of the original shapes
+    self.spacingScale = 1.0 / math.sqrt(pointsFraction)
+    self.parameters = parameters
+    self.process = None
+    self.status = 'Idle'
+    self.decimationTime = 0.0
+    self.wallTime = 0.0
+    self.iterations = None
+
+class MultiresolutionRegression(object):
+
+  def __init__(self, parameters, numberOfLevels=3, pointsFraction=0.25, executable=None,
+               numberOfThreads=None, numberOfWorkers=None, startProcess=None):
+    """ pointsFraction is the fraction of the points kept from one level to
+    the next coarser one. startProcess(XMLdriverfilepath, numberOfThreads)
+    starts a level, a Shape4DProcess of executable by default.
+    """
+    self.parameters = parameters
+    self.executable = executable
+    self.startProcess = startProcess
+    self.numberOfThreads = numberOfThreads
+    self.numberOfWorkers = numberOfWorkers or defaultNumberOfWorkers()
+    self.multiresolutionDirectory = os.path.join(parameters.outputDirectory, MultiresolutionDirectoryName)
+    # From the coarsest level to the original shapes
+    self.levels = []
+    for level in reversed(range(numberOfLevels)):
+      levelParameters = copy.deepcopy(parameters)
+      if level > 0:
+        levelParameters.outputDirectory = os.path.join(self.multiresolutionDirectory, 'level_{}'.format(level))
+      self.levels.append(multiresolutionLevelStruct(level, pointsFraction ** level, levelParameters))
+    self.currentLevelIndex = None
+
+  @property
+  def summaryFilePath(self):
+    return os.path.join(self.multiresolutionDirectory, 'multiresolutionSummary.csv')
+
+  @property
+  def currentLevel(self):
+    return self.levels[self.currentLevelIndex] if self.currentLevelIndex is not None else None
+
+  def start(self):
+    errorMessage = self.parameters.checkInputs()
+    if errorMessage is not None:
+      raise ValueError(errorMessage)
+    if self.startProcess is None:
+      self.startProcess = shape4DProcessStarter(self.executable)
+    self.currentLevelIndex = None
+    self._startNextLevel()
+    return self
+
+  def _prepareLevel(self, level):
+    """ Decimate the shapes of a coarse level and scale its kernels """
+    parameters = level.parameters
+    if not os.path.isdir(parameters.outputDirectory):
+      os.makedirs(parameters.outputDirectory)
+    if level.level == 0:
+      return
+    shapesDirectory = os.path.join(parameters.outputDirectory, 'shapes')
+    if not os.path.isdir(shapesDirectory):
+      os.makedirs(shapesDirectory)
+    shapePaths = sorted(set(regressionInput.shapePath for regressionInput in parameters.inputs))
+    # Inputs of different directories may have the same name
+    decimatedShapePaths = dict((shapePath, os.path.join(shapesDirectory, '{:03d}_{}'.format(index, os.path.basename(shapePath))))
+                               for index, shapePath in enumerate(shapePaths))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=self.numberOfWorkers) as executor:
+      list(executor.map(lambda shapePath: decimateShape(shapePath, decimatedShapePaths[shapePath], level.pointsFraction),
+                        shapePaths))
+    # Kernels below the spacing of the points of the level can not be resolved
+    parameters.sigmaV = parameters.sigmaV * level.spacingScale
+    for regressionInput in parameters.inputs:
+      regressionInput.shapePath = decimatedShapePaths[regressionInput.shapePath]
+      regressionInput.sigmaW = regressionInput.sigmaW * level.spacingScale
+
+  def _initializeLevel(self, level, previousLevel):
+    """ Initialize a level with the V0 of the previous coarser level """
+    initV0 = findInitialVelocityFile(previousLevel.parameters.outputDirectory)
+    if initV0 is None:
+      logging.warning("No V0 found for level {}, it starts from zero".format(previousLevel.level))
+      return
+    parameters = level.parameters
+    parameters.sortInputsByTimePoint()
+    interpolatedInitV0 = os.path.join(previousLevel.parameters.outputDirectory, 'initialVelocityForLevel{}.vtk'.format(level.level))
+    interpolateInitialVelocity(initV0, parameters.inputs[0].shapePath, interpolatedInitV0,
+                               kernelRadius=previousLevel.parameters.sigmaV)
+    parameters.useInitV0 = True
+    parameters.initV0 = interpolatedInitV0
+    if not parameters.v0weight:
+      parameters.v0weight = 1.0
+
+  def _startNextLevel(self):
+    self.currentLevelIndex = 0 if self.currentLevelIndex is None else self.currentLevelIndex + 1
+    level = self.currentLevel
+    startTime = time.time()
+    self._prepareLevel(level)
+    if self.currentLevelIndex > 0:
+      self._initializeLevel(level, self.levels[self.currentLevelIndex - 1])
+    elif level.level > 0 and level.parameters.useInitV0:
+      # A warm start of the whole regression initializes its coarsest level
+      parameters = level.parameters
+      parameters.sortInputsByTimePoint()
+      interpolatedInitV0 = os.path.join(parameters.outputDirectory, 'initialVelocity.vtk')
+      interpolateInitialVelocity(parameters.initV0, parameters.inputs[0].shapePath, interpolatedInitV0,
+                                 kernelRadius=parameters.sigmaV)
+      parameters.initV0 = interpolatedInitV0
+    level.decimationTime = time.time() - startTime
+    XMLdriverfilepath = writeInputFiles(level.parameters)
+    logging.info("Multiresolution level {} ({:.0%} of the points)".format(level.level, level.pointsFraction))
+    level.process = self.startProcess(XMLdriverfilepath, self.numberOfThreads)
+    level.status = 'Running'
+
+  def poll(self):
+    """ Start the next level when the current one is finished. Returns True while the regression is running. """
+    level = self.currentLevel
+    if level is None or level.process.poll() is None:
+      return level is not None
+    self._finishLevel(level)
+    if level.status == 'Completed' and self.currentLevelIndex < len(self.levels) - 1:
+      self._startNextLevel()
+      return True
+    self.writeSummary()
+    self.currentLevelIndex = None
+    return False
+
+  def isRunning(self):
+    return self.currentLevel is not None
+
+  def wait(self, pollingInterval=1.0):
+    while self.poll():
+      time.sleep(pollingInterval)
+    return self.levels
+
+  def cancel(self):
+    level = self.currentLevel
+    if level is None:
+      return
+    level.process.cancel()
+    self._finishLevel(level)
+    self.writeSummary()
+    self.currentLevelIndex = None
+
+  def _finishLevel(self, level):
+    level.status = level.process.statusString()
+    level.wallTime = level.process.wallTime
+    try:
+      records = readShape4DLog(level.process.logFilePath)
+    except OSError:
+      records = []
+    if len(records) > 0:
+      level.iterations = records[-1].iteration
+    logging.info("Multiresolution level {} {} in {:.1f}s".format(level.level, level.status.lower(), level.wallTime))
+
+  def writeSummary(self):
+    if not os.path.isdir(self.multiresolutionDirectory):
+      os.makedirs(self.multiresolutionDirectory)
+    with open(self.summaryFilePath, 'w') as csvfile:
+      cw = csv.writer(csvfile, delimiter=',', lineterminator='\n')
+      cw.writerow(['level', 'pointsFraction', 'sigmaV', 'status', 'decimationTime', 'wallTime', 'iterations', 'outputDirectory'])
+      for level in self.levels:
+        cw.writerow([level.level, level.pointsFraction, level.parameters.sigmaV, level.status,
+                     '{:.3f}'.format(level.decimationTime), '{:.3f}'.format(level.wallTime),
+                     '' if level.iterations is None else level.iterations, level.parameters.outputDirectory])
+    return self.summaryFilePath
+
+  def levelTimesText(self):
+    return ', '.join('level {}: {:.0f}s'.format(level.level, level.decimationTime + level.wallTime)
+                     for level in self.levels if level.status != 'Idle')
@@ -0,0 +1,249 @@
+import copy
+import csv
+import itertools
+import logging
+import os
+import re
+import time
+
+from .RegressionParameters import RegressionParameters, writeInputFiles
+from .Shape4DLog import readShape4DLog
+from .Shape4DProcess import shape4DProcessStarter
+
+#
+# Sweep of the regression parameters
+#
+# Each set of parameters is run in its own subdirectory of the sweep directory,
+# with its own CSV and driver files. Several runs are executed at once and the
+# cores of the sweep are divided between them. With a result cache, the runs
+# already computed are restored instead of being run. A summary CSV with the wall
+# time, the number of iterations and the final objective of each run is written
+# in the sweep directory at the end.
+#
+
+# Parameters that are the same for all the runs of a sweep
+_fixedParameters = ('inputs', 'outputDirectory')
+
+def parseParameterValue(name, text):
+  """ Convert the text to the type of the default value of the parameter.
+  Only the attributes of the parameters can be swept, not their properties or
+  methods.
+  """
+  defaultValues = vars(RegressionParameters())
+  if name in _fixedParameters or name not in defaultValues:
+    raise ValueError('Unknown sweep parameter: {}'.format(name))
+  defaultValue = defaultValues[name]
+  text = text.strip()
+  if isinstance(defaultValue, bool):
+    return text.lower() in ('1', 'true', 'yes', 'on')
+  if isinstance(defaultValue, int):
+    return int(float(text))
+  if isinstance(defaultValue, float):
+    return float(text)
+  return text
+
+def parseParameterGrid(text):
+  """ Parse the description of a grid of parameters such as
+
+      sigmaV = 50, 70; gammaR = 0.01, 0.1
+
+  into a dictionary of the values of each parameter. Raises ValueError if the
+  text is invalid.
+  """
+  grid = dict()
+  for assignment in text.split(';'):
+    if assignment.strip() == '':
+      continue
+    if '=' not in assignment:
+      raise ValueError('Invalid sweep parameter: {}'.format(assignment.strip()))
+    name, values = assignment.split('=', 1)
+    name = name.strip()
+    grid[name] = [parseParameterValue(name, value) for value in values.split(',') if value.strip() != '']
+  return grid
+
+def expandParameterGrid(grid):
+  """ Return the list of all the combinations of the values of a grid """
+  names = list(grid.keys())
+  return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+def parseParameterSets(text):
+  """ Each line of the text is a grid, the parameter sets of all the lines are concatenated """
+  parameterSets = []
+  for line in text.splitlines():
+    if line.strip() == '' or line.strip().startswith('#'):
+      continue
+    parameterSets.extend(expandParameterGrid(parseParameterGrid(line)))
+  return parameterSets
+
+def sweepRunName(index, overrides):
+  name = 'run_{:03d}'.format(index)
+  for parameterName, value in overrides.items():
+    name += '_{}-{}'.format(parameterName, value)
+  return re.sub(r'[^\w.+-]', '', name)
+
+def sweepConcurrency(numberOfRuns, numberOfCores=None, numberOfConcurrentRuns=None):
+  """ Number of concurrent runs and number of threads of each run for a core budget """
+  if not numberOfCores:
+    numberOfCores = os.cpu_count() or 1
+  if not numberOfConcurrentRuns:
+    numberOfConcurrentRuns = numberOfCores
+  numberOfConcurrentRuns = max(1, min(numberOfConcurrentRuns, numberOfRuns, numberOfCores))
+  return numberOfConcurrentRuns, max(1, numberOfCores // numberOfConcurrentRuns)
+
+class sweepRunStruct(object):
+  def __init__(self, index=0, overrides=None, parameters=None, name=None):
+    self.index = index
+    self.overrides = overrides if overrides is not None else dict()
+    self.parameters = parameters
+    self.name = name if name is not None else sweepRunName(index, self.overrides)
+    self.process = None
+    self.status = 'Idle'
+    self.wallTime = 0.0
+    self.iterations = None
+    self.finalObjective = None
+
+class ParameterSweep(object):
+
+  def __init__(self, baseParameters, parameterSets, sweepDirectory=None, executable=None,
+               numberOfCores=None, numberOfConcurrentRuns=None, resultCache=None, runNames=None, startProcess=None):
+    """ The runs are named by runNames if given, from their parameters
+    otherwise (see sweepRunName). Their directories are named after them.
+    startProcess(XMLdriverfilepath, numberOfThreads) starts a run, a
+    Shape4DProcess of executable by default (see shape4DProcessStarter).
+    """
+    if sweepDirectory is None:
+      sweepDirectory = os.path.join(baseParameters.outputDirectory, 'Sweep')
+    self.baseParameters = baseParameters
+    self.sweepDirectory = sweepDirectory
+    self.executable = executable
+    self.startProcess = startProcess
+    self.resultCache = resultCache
+    self.numberOfConcurrentRuns, self.numberOfThreadsPerRun = sweepConcurrency(len(parameterSets), numberOfCores,
+                                                                               numberOfConcurrentRuns)
+    self.parameterNames = []
+    self.runs = []
+    self.resultCacheKeys = dict()
+    for index, overrides in enumerate(parameterSets):
+      for name in overrides:
+        if name not in self.parameterNames:
+          self.parameterNames.append(name)
+      parameters = copy.deepcopy(baseParameters)
+      # Each run owns its values, e.g. inputs warm started or preprocessed run by run
+      for name, value in overrides.items():
+        setattr(parameters, name, copy.deepcopy(value))
+      run = sweepRunStruct(index, overrides, parameters, runNames[index] if runNames is not None else None)
+      parameters.outputDirectory = os.path.join(sweepDirectory, run.name)
+      self.runs.append(run)
+    self.pendingRuns = []
+    self.runningRuns = []
+
+  @property
+  def summaryFilePath(self):
+    return os.path.join(self.sweepDirectory, 'sweepSummary.csv')
+
+  @property
+  def numberOfRuns(self):
+    return len(self.runs)
+
+  @property
+  def numberOfFinishedRuns(self):
+    return len([run for run in self.runs if run.status not in ('Idle', 'Running')])
+
+  def start(self):
+    """ Write the input files of all the runs and start the first ones.
+    Raises ValueError if the sweep can not be run.
+    """
+    if len(self.runs) == 0:
+      raise ValueError('No sweep parameter set found')
+    # The sweep directory and the output directories of the runs are created
+    # by the sweep, only the directory containing them has to exist
+    parameters = copy.copy(self.baseParameters)
+    parameters.outputDirectory = os.path.dirname(os.path.abspath(self.sweepDirectory))
+    errorMessage = parameters.checkInputs()
+    if errorMessage is not None:
+      raise ValueError(errorMessage)
+    if self.startProcess is None:
+      self.startProcess = shape4DProcessStarter(self.executable)
+
+    for run in self.runs:
+      if not os.path.isdir(run.parameters.outputDirectory):
+        os.makedirs(run.parameters.outputDirectory)
+      writeInputFiles(run.parameters)
+    logging.info("Sweep of {} runs, {} at once with {} threads each".format(
+      len(self.runs), self.numberOfConcurrentRuns, self.numberOfThreadsPerRun))
+    self.pendingRuns = list(self.runs)
+    self.runningRuns = []
+    self.poll()
+    return self
+
+  def poll(self):
+    """ Collect the finished runs and start the next ones. Returns True while the sweep is running. """
+    for run in list(self.runningRuns):
+      if run.process.poll() is not None:
+        self._finishRun(run)
+    while len(self.pendingRuns) > 0 and len(self.runningRuns) < self.numberOfConcurrentRuns:
+      run = self.pendingRuns.pop(0)
+      if self._restoreRun(run):
+        continue
+      run.process = self.startProcess(run.parameters.driverFilePath, self.numberOfThreadsPerRun)
+      run.status = 'Running'
+      self.runningRuns.append(run)
+    return self.isRunning()
+
+  def _restoreRun(self, run):
+    """ Restore the results of the run from the result cache. Returns True if they were cached. """
+    if self.resultCache is None:
+      return False
+    self.resultCacheKeys[run.index] = self.resultCache.key(run.parameters)
+    if self.resultCache.restore(run.parameters, self.resultCacheKeys[run.index]) is None:
+      return False
+    run.status = 'Restored'
+    logging.info("Sweep run {} restored from the cache".format(run.name))
+    if not self.isRunning():
+      self.writeSummary()
+    return True
+
+  def isRunning(self):
+    return len(self.runningRuns) > 0 or len(self.pendingRuns) > 0
+
+  def wait(self, pollingInterval=1.0):
+    while self.poll():
+      time.sleep(pollingInterval)
+    return self.runs
+
+  def cancel(self):
+    for run in self.pendingRuns:
+      run.status = 'Cancelled'
+    self.pendingRuns = []
+    for run in list(self.runningRuns):
+      run.process.cancel()
+      self._finishRun(run)
+
+  def _finishRun(self, run):
+    self.runningRuns.remove(run)
+    run.status = run.process.statusString()
+    run.wallTime = run.process.wallTime
+    try:
+      records = readShape4DLog(run.process.logFilePath)
+    except OSError:
+      records = []
+    if len(records) > 0:
+      run.iterations = records[-1].iteration
+      run.finalObjective = records[-1].objective
+    if self.resultCache is not None and run.status == 'Completed':
+      self.resultCache.store(run.parameters, self.resultCacheKeys[run.index])
+    logging.info("Sweep run {} {} in {:.1f}s".format(run.name, run.status.lower(), run.wallTime))
+    if not self.isRunning():
+      self.writeSummary()
+
+  def writeSummary(self):
+    with open(self.summaryFilePath, 'w') as csvfile:
+      cw = csv.writer(csvfile, delimiter=',', lineterminator='\n')
+      cw.writerow(['run'] + self.parameterNames + ['status', 'wallTime', 'iterations', 'finalObjective', 'outputDirectory'])
+      for run in self.runs:
+        cw.writerow([run.name] + [run.overrides.get(name, '') for name in self.parameterNames] +
+                    [run.status, '{:.3f}'.format(run.wallTime),
+                     '' if run.iterations is None else run.iterations,
+                     '' if run.finalObjective is None else run.finalObjective,
+                     run.parameters.outputDirectory])
+    return self.summaryFilePath
@@ -0,0 +1,205 @@
+import concurrent.futures
+import hashlib
+import json
+import logging
+import math
+import os
+import sys
+import time
+
+import vtk
+
+from .Multiresolution import readPolyData
+from .RegressionResultCache import fileContentHash
+from .ShapeScan import defaultNumberOfWorkers
+
+#
+# Preprocessing of the input shapes
+#
+# Before the driver file is written, each input shape can be triangulated,
+# cleaned of its duplicate points and decimated to the number of points its
+# kernel width sigmaW can resolve. The processed shapes are stored in a cache
+# directory under a hash of the content of the input shape and of the
+# preprocessing settings, and the driver file points to them. The content
+# hashes are kept in the index of the cache and only computed again when the
+# size or the modification time of a shape changed, as in the result cache.
+#
+
+_cacheVersion = 1
+
+class preprocessingSettingsStruct(object):
+  def __init__(self):
+    self.triangulate = True
+    self.clean = True
+    self.decimate = True
+    # Average number of points per kernel width along the surface
+    self.pointsPerKernelWidth = 4.0
+
+def pointBudget(surfaceArea, sigmaW, pointsPerKernelWidth):
+  """ Number of points of a triangle mesh of the given area with an edge length of sigmaW / pointsPerKernelWidth """
+  edgeLength = sigmaW / pointsPerKernelWidth
+  # Each point of a regular triangle mesh accounts for two triangles
+  return int(math.ceil(surfaceArea / (math.sqrt(3) / 2 * edgeLength ** 2)))
+
+def preprocessShape(inputFilePath, outputFilePath, sigmaW, settings):
+  """ Triangulate, clean and decimate a shape. Returns its numbers of points before and after. """
+  shape = readPolyData(inputFilePath)
+  numberOfInputPoints = shape.GetNumberOfPoints()
+
+  if settings.triangulate or settings.decimate:
+    triangleFilter = vtk.vtkTriangleFilter()
+    triangleFilter.SetInputData(shape)
+    triangleFilter.Update()
+    shape = triangleFilter.GetOutput()
+  if settings.clean:
+    cleanFilter = vtk.vtkCleanPolyData()
+    cleanFilter.SetInputData(shape)
+    cleanFilter.Update()
+    shape = cleanFilter.GetOutput()
+  if settings.decimate and sigmaW > 0:
+    massProperties = vtk.vtkMassProperties()
+    massProperties.SetInputData(shape)
+    massProperties.Update()
+    budget = pointBudget(massProperties.GetSurfaceArea(), sigmaW, settings.pointsPerKernelWidth)
+    if shape.GetNumberOfPoints() > budget:
+      decimation = vtk.vtkQuadricDecimation()
+      decimation.SetInputData(shape)
+      decimation.SetTargetReduction(1.0 - float(budget) / shape.GetNumberOfPoints())
+      decimation.VolumePreservationOn()
+      decimation.Update()
+      shape = decimation.GetOutput()
+
+  # Written to a temporary file first so that the cache never holds a partial shape
+  writer = vtk.vtkPolyDataWriter()
+  writer.SetFileName(outputFilePath + '.tmp')
+  writer.SetInputData(shape)
+  writer.SetFileTypeToBinary()
+  writer.Write()
+  os.replace(outputFilePath + '.tmp', outputFilePath)
+  return numberOfInputPoints, shape.GetNumberOfPoints()
+
+def _preprocessShapeTask(task):
+  inputFilePath, outputFilePath, sigmaW, settings = task
+  return preprocessShape(inputFilePath, outputFilePath, sigmaW, settings)
+
+def _usesProcesses():
+  # Inside Slicer the interpreter is the application itself, which can not be
+  # used as a worker process: the shapes are processed in threads instead.
+  return 'slicer' not in sys.modules and os.path.basename(sys.executable).lower().startswith('python')
+
+class PreprocessedShapeCache(object):
+
+  def __init__(self, cacheDirectory, maximumSize=20 * 1024 ** 3):
+    self.cacheDirectory = cacheDirectory
+    self.maximumSize = maximumSize
+    self.fileHashes = dict()
+    self.modified = False
+    self.load()
+
+  @property
+  def indexFilePath(self):
+    return os.path.join(self.cacheDirectory, 'index.json')
+
+  def load(self):
+    self.fileHashes = dict()
+    self.modified = False
+    if not os.path.exists(self.indexFilePath):
+      return
+    try:
+      with open(self.indexFilePath) as indexFile:
+        content = json.load(indexFile)
+      if content.get('version') == _cacheVersion:
+        self.fileHashes = content['fileHashes']
+    except (OSError, ValueError, KeyError) as e:
+      logging.warning("Ignoring the index of the preprocessed shape cache {}: {}".format(self.cacheDirectory, e))
+
+  def save(self):
+    if not self.modified:
+      return
+    if not os.path.exists(self.cacheDirectory):
+      os.makedirs(self.cacheDirectory)
+    for filePath in [filePath for filePath in self.fileHashes if not os.path.exists(filePath)]:
+      del self.fileHashes[filePath]
+    temporaryFilePath = self.indexFilePath + '.tmp'
+    with open(temporaryFilePath, 'w') as indexFile:
+      json.dump({'version': _cacheVersion, 'fileHashes': self.fileHashes}, indexFile)
+    os.replace(temporaryFilePath, self.indexFilePath)
+    self.modified = False
+
+  def _fileHash(self, filePath):
+    """ Content hash of a file, only computed again if its size or modification time changed """
+    fileStat = os.stat(filePath)
+    key = os.path.abspath(filePath)
+    known = self.fileHashes.get(key)
+    if known is not None and known['size'] == fileStat.st_size and known['mtime'] == fileStat.st_mtime_ns:
+      return known['sha256']
+    sha256 = fileContentHash(filePath)
+    self.fileHashes[key] = {'size': fileStat.st_size, 'mtime': fileStat.st_mtime_ns, 'sha256': sha256}
+    self.modified = True
+    return sha256
+
+  def key(self, shapeFilePath, sigmaW, settings):
+    description = dict(settings.__dict__)
+    description['version'] = _cacheVersion
+    description['sigmaW'] = float(sigmaW) if settings.decimate else None
+    description['shape'] = self._fileHash(shapeFilePath)
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+  def filePath(self, key):
+    return os.path.join(self.cacheDirectory, key + '.vtk')
+
+  def evict(self):
+    """ Remove the least recently used shapes above the maximum size of the cache """
+    filePaths = [os.path.join(self.cacheDirectory, fileName) for fileName in os.listdir(self.cacheDirectory)
+                 if fileName.endswith('.vtk')]
+    fileStats = dict((filePath, os.stat(filePath)) for filePath in filePaths)
+    size = sum(fileStat.st_size for fileStat in fileStats.values())
+    for filePath in sorted(filePaths, key=lambda filePath: fileStats[filePath].st_mtime):
+      if size <= self.maximumSize:
+        break
+      size -= fileStats[filePath].st_size
+      os.remove(filePath)
+
+  def clear(self):
+    if not os.path.isdir(self.cacheDirectory):
+      return
+    for fileName in os.listdir(self.cacheDirectory):
+      if fileName.endswith('.vtk'):
+        os.remove(os.path.join(self.cacheDirectory, fileName))
+    self.fileHashes = dict()
+    self.modified = True
+    self.save()
+
+def preprocessInputs(parameters, settings, cache, numberOfWorkers=None):
+  """ Replace the shapes of the inputs of the regression by their processed
+  version, processing the shapes that are not in the cache in parallel.
+  """
+  if not os.path.isdir(cache.cacheDirectory):
+    os.makedirs(cache.cacheDirectory)
+  startTime = time.time()
+  # The same shape may be used with different kernel widths
+  tasks = dict()
+  processedShapePaths = []
+  for regressionInput in parameters.inputs:
+    key = cache.key(regressionInput.shapePath, regressionInput.sigmaW, settings)
+    processedShapePath = cache.filePath(key)
+    processedShapePaths.append(processedShapePath)
+    if os.path.exists(processedShapePath):
+      # Keep track of the last use for the eviction
+      os.utime(processedShapePath)
+    elif processedShapePath not in tasks:
+      tasks[processedShapePath] = (regressionInput.shapePath, processedShapePath, regressionInput.sigmaW, settings)
+
+  if len(tasks) > 0:
+    executorClass = concurrent.futures.ProcessPoolExecutor if _usesProcesses() else concurrent.futures.ThreadPoolExecutor
+    with executorClass(max_workers=numberOfWorkers or defaultNumberOfWorkers()) as executor:
+      for task, (numberOfInputPoints, numberOfPoints) in zip(tasks.values(), executor.map(_preprocessShapeTask, tasks.values())):
+        logging.debug("Preprocessed {}: {} to {} points".format(task[0], numberOfInputPoints, numberOfPoints))
+    cache.evict()
+
+  for regressionInput, processedShapePath in zip(parameters.inputs, processedShapePaths):
+    regressionInput.shapePath = processedShapePath
+  cache.save()
+  logging.info("Preprocessed {} input shapes ({} from the cache) in {:.1f}s".format(
+    len(parameters.inputs), len(parameters.inputs) - len(tasks), time.time() - startTime))
+  return parameters
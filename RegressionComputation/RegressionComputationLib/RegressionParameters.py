@@ -0,0 +1,239 @@
+import csv
+import os
+import re
+import sys
+
+from .WarmStart import writeWarmStartRecord
+
+#
+# Parameters of a regression
+#
+# Everything needed to write the input CSV and the shape4D driver file,
+# independently of the module widget so that regressions can be set up and
+# launched from scripts.
+#
+
+class regressionInputStruct(object):
+  def __init__(self, shapePath=None, timePoint=0.0, sigmaW=1.0, tris=0, weight=1.0, group=None):
+    self.shapePath = shapePath
+    self.timePoint = timePoint
+    self.sigmaW = sigmaW
+    self.tris = tris
+    self.weight = weight
+    # Cohort of the shape (e.g. diagnosis or sex) for the group regressions
+    self.group = group
+
+class RegressionParameters(object):
+
+  def __init__(self):
+    # Input shapes
+    self.inputs = []
+
+    # Time parameters
+    self.t0 = 0.0
+    self.tn = 0.0
+    self.T = 20
+
+    # Deformation parameters
+    self.sigmaV = 0.0
+    self.kernelType = 'exact'
+    self.gammaR = 0.01
+
+    # Optional parameters
+    self.estimateBaseline = False
+    self.optimizer = 'Gradient descent'
+    self.breakRatio = 0.000001
+    self.maxIters = 1000
+
+    # Warm start
+    self.useInitV0 = False
+    self.v0weight = 0.0
+    self.initV0 = ''
+
+    # Output parameters
+    self.outputDirectory = ''
+    self.outputPrefix = 'Regression_output_'
+    self.saveEveryN = 50
+
+  @property
+  def useFista(self):
+    return self.optimizer == 'FISTA'
+
+  def setDefaultTimeRange(self):
+    """ Set t0 and tn to the earliest and latest time points of the inputs """
+    timePoints = [float(regressionInput.timePoint) for regressionInput in self.inputs]
+    self.t0 = min(timePoints)
+    self.tn = max(timePoints)
+
+  def checkInputs(self):
+    """ Return an error message if the regression can not be run, None otherwise """
+    if len(self.inputs) == 0:
+      return 'No shape input found'
+    if len(self.inputs) == 1:
+      return 'Only one shape input found. The module need at least 2 shape inputs.'
+    if self.outputDirectory == '' or not os.path.isdir(self.outputDirectory):
+      return 'The output directory {} does not exist.'.format(self.outputDirectory)
+    if self.useInitV0 and not os.path.isfile(self.initV0):
+      return 'The initial velocity file {} does not exist.'.format(self.initV0)
+    return None
+
+  def sortInputsByTimePoint(self):
+    self.inputs.sort(key=lambda regressionInput: float(regressionInput.timePoint))
+
+  @property
+  def CSVFilePath(self):
+    return os.path.join(self.outputDirectory, "CSVInputshapesparameters.csv")
+
+  @property
+  def driverFilePath(self):
+    return os.path.join(self.outputDirectory, "driver.xml")
+
+def readInputsCSV(pathToCSV):
+  """ Read the inputs from a CSV file with one row per shape: path, time point,
+  sigmaW, tris, weight and optionally group
+  """
+  inputs = []
+  with open(pathToCSV) as csvfile:
+    allRows = csv.reader(csvfile, delimiter=',', quotechar='|')
+    for row in allRows:
+      if len(row) == 0:
+        continue
+      inputs.append(regressionInputStruct(shapePath=row[0].strip(),
+                                          timePoint=float(row[1].strip()),
+                                          sigmaW=float(row[2].strip()),
+                                          tris=int(float(row[3].strip())),
+                                          weight=float(row[4].strip()),
+                                          group=row[5].strip() if len(row) > 5 and row[5].strip() != '' else None))
+  return inputs
+
+def writeInputsCSV(inputs, pathToCSV):
+  with open(pathToCSV, 'w') as csvfile:
+    cw = csv.writer(csvfile, delimiter=',', lineterminator='\n')
+    for regressionInput in inputs:
+      row = [regressionInput.shapePath, regressionInput.timePoint, regressionInput.sigmaW,
+             regressionInput.tris, regressionInput.weight]
+      if regressionInput.group is not None:
+        row.append(regressionInput.group)
+      cw.writerow(row)
+  return pathToCSV
+
+def driverFileContents(parameters):
+  if sys.platform == 'win32':
+    experimentName = "/ShapeRegression"
+    outputDir = parameters.outputDirectory
+    prefix = "/" + parameters.outputPrefix
+  else:
+    experimentName = "ShapeRegression/"
+    outputDir = parameters.outputDirectory + "/"
+    prefix = parameters.outputPrefix
+
+  fileContents = ""
+
+  fileContents += "<?xml version=\"1.0\">\n"
+  fileContents += "<experiment name=\"" + experimentName + "\">\n"
+
+  fileContents += "  <algorithm name=\"RegressionAccel\">\n"
+  fileContents += "    <source>\n"
+  fileContents += "      <input>\n"
+  fileContents += "        <shape> " + parameters.inputs[0].shapePath + " </shape>\n"
+  fileContents += "      </input>\n"
+  fileContents += "      <sigmaV> " + str(parameters.sigmaV) + " </sigmaV>\n"
+  fileContents += "      <gammaR> " + str(parameters.gammaR) + " </gammaR>\n"
+  fileContents += "      <t0> " + str(parameters.t0) + " </t0>\n"
+  fileContents += "      <tn> " + str(parameters.tn) + " </tn>\n"
+  fileContents += "      <T> " + str(parameters.T) + " </T>\n"
+  fileContents += "      <kernelType> " + parameters.kernelType + " </kernelType>\n"
+  fileContents += "      <useInitV0> " + str(int(parameters.useInitV0)) + " </useInitV0>\n"
+  fileContents += "      <v0weight> " + str(parameters.v0weight) + " </v0weight>\n"
+  if parameters.useInitV0:
+    fileContents += "      <initV0> " + parameters.initV0 + " </initV0>\n"
+  fileContents += "      <estimateBaseline> " + str(int(parameters.estimateBaseline)) + " </estimateBaseline>\n"
+  fileContents += "      <useFista> " + str(int(parameters.useFista)) + " </useFista>\n"
+  fileContents += "      <maxIters> " + str(parameters.maxIters) + " </maxIters>\n"
+  fileContents += "      <breakRatio> " + str(parameters.breakRatio) + " </breakRatio>\n"
+  fileContents += "      <output>\n"
+  fileContents += "        <saveProgress> " + str(parameters.saveEveryN) + " </saveProgress>\n"
+  fileContents += "        <dir> " + outputDir + " </dir>\n"
+  fileContents += "        <prefix> " + prefix + " </prefix>\n"
+  fileContents += "      </output>\n"
+  fileContents += "    </source>\n"
+  fileContents += "    <targets>\n"
+
+  for regressionInput in parameters.inputs:
+
+    fileContents += "      <target>\n"
+    fileContents += "        <shape> " + regressionInput.shapePath + " </shape>\n"
+    fileContents += "        <type> SURFACE </type>\n"
+    fileContents += "        <tris> " + str(regressionInput.tris) + " </tris>\n"
+    fileContents += "        <sigmaW> " + str(regressionInput.sigmaW) + " </sigmaW>\n"
+    fileContents += "        <timept> " + str(regressionInput.timePoint) + " </timept>\n"
+    fileContents += "        <weight> " + str(regressionInput.weight) + " </weight>\n"
+    fileContents += "      </target>\n"
+
+  fileContents += "    </targets>\n"
+  fileContents += "  </algorithm>\n"
+  fileContents += "</experiment>\n"
+  return fileContents
+
+_driverValueExpression = re.compile(r'<(\w+)>\s*([^<]*?)\s*</\1>')
+
+def _driverValues(text):
+  return dict((match.group(1), match.group(2)) for match in _driverValueExpression.finditer(text))
+
+def readDriverFile(XMLdriverfilepath):
+  """ Read the parameters of a regression from its driver file, as written by
+  writeDriverFile. The groups of the inputs are not in the driver file.
+  Raises ValueError if the file is not a driver file.
+  """
+  with open(XMLdriverfilepath) as f:
+    contents = f.read()
+  sourceEnd = contents.find('<targets>')
+  if '<source>' not in contents or sourceEnd < 0:
+    raise ValueError('{} is not a shape4D driver file.'.format(XMLdriverfilepath))
+  source = _driverValues(contents[:sourceEnd])
+  parameters = RegressionParameters()
+  try:
+    parameters.sigmaV = float(source['sigmaV'])
+    parameters.gammaR = float(source['gammaR'])
+    parameters.t0 = float(source['t0'])
+    parameters.tn = float(source['tn'])
+    parameters.T = int(source['T'])
+    parameters.kernelType = source['kernelType']
+    parameters.useInitV0 = bool(int(source['useInitV0']))
+    parameters.v0weight = float(source['v0weight'])
+    parameters.initV0 = source.get('initV0', '')
+    parameters.estimateBaseline = bool(int(source['estimateBaseline']))
+    parameters.optimizer = 'FISTA' if int(source['useFista']) else 'Gradient descent'
+    parameters.maxIters = int(source['maxIters'])
+    parameters.breakRatio = float(source['breakRatio'])
+    parameters.saveEveryN = int(source['saveProgress'])
+    # As written by driverFileContents, with a separator on the side of the platform
+    parameters.outputDirectory = source['dir'].rstrip('/')
+    parameters.outputPrefix = source['prefix'].lstrip('/')
+    for target in contents[sourceEnd:].split('<target>')[1:]:
+      values = _driverValues(target)
+      parameters.inputs.append(regressionInputStruct(shapePath=values['shape'],
+                                                     timePoint=float(values['timept']),
+                                                     sigmaW=float(values['sigmaW']),
+                                                     tris=int(float(values['tris'])),
+                                                     weight=float(values['weight'])))
+  except KeyError as e:
+    raise ValueError('{} is not a shape4D driver file, {} is missing.'.format(XMLdriverfilepath, e))
+  return parameters
+
+def writeDriverFile(parameters, XMLdriverfilepath=None):
+  if XMLdriverfilepath is None:
+    XMLdriverfilepath = parameters.driverFilePath
+  with open(XMLdriverfilepath, 'w') as f:
+    f.write(driverFileContents(parameters))
+  return XMLdriverfilepath
+
+def writeInputFiles(parameters):
+  """ Write the input CSV and the driver file in the output directory and
+  return the path of the driver file. The inputs are sorted by time point.
+  """
+  parameters.sortInputsByTimePoint()
+  writeInputsCSV(parameters.inputs, parameters.CSVFilePath)
+  if parameters.useInitV0:
+    writeWarmStartRecord(parameters)
+  return writeDriverFile(parameters)
@@ -0,0 +1,206 @@
+import concurrent.futures
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+
+from .Shape4DLog import Shape4DLogFileName
+from .WarmStart import WarmStartRecordFileName, findInitialVelocityFile
+
+#
+# Cache of the regression results
+#
+# The final shapes of a regression only depend on the parameters of the driver
+# file and on the content of the input shapes. They are stored in a directory
+# per regression named after a hash of both, so that running again the same
+# regression restores its results instead of running shape4D. The output
+# directory, the prefix and the progress saving frequency are not part of the
+# key as they do not change the final shapes.
+#
+# The V0 file and the log of the regression are kept with its final shapes so
+# that a cached regression can be used to warm start another one.
+#
+
+_cacheVersion = 1
+
+_keyParameters = ('t0', 'tn', 'T', 'sigmaV', 'kernelType', 'gammaR', 'estimateBaseline', 'useFista',
+                  'breakRatio', 'maxIters', 'useInitV0')
+
+def fileContentHash(filePath):
+  sha256 = hashlib.sha256()
+  with open(filePath, 'rb') as f:
+    for block in iter(lambda: f.read(1 << 20), b''):
+      sha256.update(block)
+  return sha256.hexdigest()
+
+def finalShapeFilePaths(outputDirectory, outputPrefix):
+  """ Final shapes written by shape4D in the output directory, one per time point """
+  return sorted(glob.glob(os.path.join(outputDirectory, glob.escape(outputPrefix) + 'final_time_*.vtk')))
+
+def _directorySize(directory):
+  return sum(os.path.getsize(os.path.join(directory, fileName)) for fileName in os.listdir(directory))
+
+class RegressionResultCache(object):
+
+  def __init__(self, cacheDirectory, maximumSize=10 * 1024 ** 3, linkFiles=True):
+    self.cacheDirectory = cacheDirectory
+    self.maximumSize = maximumSize
+    # Restore the results as hard links when possible. The restored files then
+    # share their content with the cache and must not be modified in place.
+    self.linkFiles = linkFiles
+    self.entries = dict()
+    self.fileHashes = dict()
+    self.load()
+
+  @property
+  def indexFilePath(self):
+    return os.path.join(self.cacheDirectory, 'index.json')
+
+  def load(self):
+    self.entries = dict()
+    self.fileHashes = dict()
+    if not os.path.exists(self.indexFilePath):
+      return
+    try:
+      with open(self.indexFilePath) as indexFile:
+        content = json.load(indexFile)
+      if content.get('version') == _cacheVersion:
+        self.entries = content['entries']
+        self.fileHashes = content['fileHashes']
+    except (OSError, ValueError, KeyError) as e:
+      logging.warning("Ignoring the regression result cache {}: {}".format(self.cacheDirectory, e))
+
+  def save(self):
+    if not os.path.exists(self.cacheDirectory):
+      os.makedirs(self.cacheDirectory)
+    temporaryFilePath = self.indexFilePath + '.tmp'
+    with open(temporaryFilePath, 'w') as indexFile:
+      json.dump({'version': _cacheVersion, 'entries': self.entries, 'fileHashes': self.fileHashes}, indexFile)
+    os.replace(temporaryFilePath, self.indexFilePath)
+
+  @property
+  def size(self):
+    return sum(entry['size'] for entry in self.entries.values())
+
+  def _fileHash(self, filePath):
+    """ Content hash of a file, only computed again if its size or modification time changed """
+    fileStat = os.stat(filePath)
+    key = os.path.abspath(filePath)
+    known = self.fileHashes.get(key)
+    if known is not None and known['size'] == fileStat.st_size and known['mtime'] == fileStat.st_mtime_ns:
+      return known['sha256']
+    sha256 = fileContentHash(filePath)
+    self.fileHashes[key] = {'size': fileStat.st_size, 'mtime': fileStat.st_mtime_ns, 'sha256': sha256}
+    return sha256
+
+  def key(self, parameters):
+    """ Hash of the normalized driver parameters and of the content of the input shapes """
+    inputs = sorted(parameters.inputs, key=lambda regressionInput: float(regressionInput.timePoint))
+    shapePaths = sorted(set(regressionInput.shapePath for regressionInput in inputs))
+    if parameters.useInitV0:
+      shapePaths = sorted(set(shapePaths + [parameters.initV0]))
+    # hashlib releases the GIL on large buffers so the shapes are hashed in threads
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(8, len(shapePaths)) or 1) as executor:
+      shapeHashes = dict(zip(shapePaths, executor.map(self._fileHash, shapePaths)))
+    description = {name: getattr(parameters, name) for name in _keyParameters}
+    for name in ('t0', 'tn', 'sigmaV', 'gammaR', 'breakRatio'):
+      description[name] = float(description[name])
+    description['source'] = shapeHashes[inputs[0].shapePath]
+    description['targets'] = [[shapeHashes[regressionInput.shapePath], int(regressionInput.tris),
+                                float(regressionInput.sigmaW), float(regressionInput.timePoint),
+                                float(regressionInput.weight)] for regressionInput in inputs]
+    if parameters.useInitV0:
+      description['initV0'] = [shapeHashes[parameters.initV0], float(parameters.v0weight)]
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+  def restore(self, parameters, key=None):
+    """ Restore the final shapes of the regression in its output directory.
+    Returns the restored file paths, or None if the regression is not cached.
+    """
+    if key is None:
+      key = self.key(parameters)
+    entry = self.entries.get(key)
+    entryDirectory = self.entryDirectory(key)
+    if entry is None:
+      self.save()
+      return None
+    if not os.path.isdir(entryDirectory):
+      # Removed from the disk outside of the cache
+      del self.entries[key]
+      self.save()
+      return None
+    restoredFilePaths = []
+    for fileName in entry['files']:
+      cachedFilePath = os.path.join(entryDirectory, fileName)
+      restoredFilePath = os.path.join(parameters.outputDirectory, parameters.outputPrefix + fileName)
+      if os.path.exists(restoredFilePath):
+        os.remove(restoredFilePath)
+      try:
+        if not self.linkFiles:
+          raise OSError
+        os.link(cachedFilePath, restoredFilePath)
+      except OSError:
+        shutil.copy2(cachedFilePath, restoredFilePath)
+      restoredFilePaths.append(restoredFilePath)
+    entry['lastAccess'] = time.time()
+    entry['hits'] = entry.get('hits', 0) + 1
+    self.save()
+    logging.info("Regression results restored from the cache ({} shapes)".format(len(restoredFilePaths)))
+    return restoredFilePaths
+
+  def entryDirectory(self, key):
+    return os.path.join(self.cacheDirectory, key)
+
+  def store(self, parameters, key=None):
+    """ Copy the final shapes of a completed regression in the cache """
+    if key is None:
+      key = self.key(parameters)
+    finalShapes = finalShapeFilePaths(parameters.outputDirectory, parameters.outputPrefix)
+    if len(finalShapes) == 0:
+      return
+    entryDirectory = self.entryDirectory(key)
+    if os.path.exists(entryDirectory):
+      shutil.rmtree(entryDirectory)
+    os.makedirs(entryDirectory)
+    fileNames = []
+    for finalShape in finalShapes:
+      fileName = os.path.basename(finalShape)[len(parameters.outputPrefix):]
+      shutil.copy2(finalShape, os.path.join(entryDirectory, fileName))
+      fileNames.append(fileName)
+    solutionFilePaths = [findInitialVelocityFile(parameters.outputDirectory),
+                         os.path.join(parameters.outputDirectory, Shape4DLogFileName),
+                         os.path.join(parameters.outputDirectory, WarmStartRecordFileName)]
+    for solutionFilePath in solutionFilePaths:
+      if solutionFilePath is not None and os.path.exists(solutionFilePath):
+        shutil.copy2(solutionFilePath, os.path.join(entryDirectory, os.path.basename(solutionFilePath)))
+    self.entries[key] = {
+      'files': fileNames,
+      'size': _directorySize(entryDirectory),
+      'lastAccess': time.time(),
+      'hits': 0,
+    }
+    self.evict()
+    self.save()
+
+  def evict(self):
+    """ Remove the least recently used regressions above the maximum size of the cache """
+    size = self.size
+    for key in sorted(self.entries, key=lambda key: self.entries[key]['lastAccess']):
+      if size <= self.maximumSize:
+        break
+      size -= self.entries[key]['size']
+      del self.entries[key]
+      shutil.rmtree(os.path.join(self.cacheDirectory, key), ignore_errors=True)
+    # Forget the hashes of the shapes that do not exist anymore
+    for filePath in [filePath for filePath in self.fileHashes if not os.path.exists(filePath)]:
+      del self.fileHashes[filePath]
+
+  def clear(self):
+    for key in list(self.entries):
+      shutil.rmtree(os.path.join(self.cacheDirectory, key), ignore_errors=True)
+    self.entries = dict()
+    self.fileHashes = dict()
+    self.save()
@@ -0,0 +1,229 @@
+import collections
+import concurrent.futures
+import csv
+import logging
+import os
+import re
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from .Alignment import readPoints
+from .Multiresolution import readPolyData, writePolyData
+from .ParameterSweep import ParameterSweep
+from .RegressionParameters import regressionInputStruct
+from .RegressionResultCache import finalShapeFilePaths
+from .ShapeScan import defaultNumberOfWorkers
+from .WarmStart import setWarmStart
+
+#
+# Confidence of a regression by resampling of the subjects
+#
+# Replicates of the regression are run on leave-one-subject-out or bootstrap
+# variants of its inputs, as a parameter sweep on the inputs: the runs share
+# the core budget of the sweep, can be restored from the result cache and can
+# be warm started from the regression on all the subjects. The shape of the
+# earliest time point is the source of the regression and is kept in every
+# replicate, so that the trajectories of the replicates are in point to point
+# correspondence. Their spread is then computed time point by time point with
+# running sums over the replicates, so that the memory of the statistics does
+# not grow with the number of replicates:
+#   - the mean trajectory, with the standard deviation of each point;
+#   - the volume of the shapes, with its percentile confidence band.
+#
+
+ResamplingDirectoryName = 'Resampling'
+ResamplingMethods = ('leave-one-out', 'bootstrap')
+
+def subjectOfInput(regressionInput, subjectPattern=None):
+  """ Subject of an input shape: the first group of subjectPattern searched in
+  the file name, or the shape itself if there is no pattern or no match
+  """
+  if subjectPattern:
+    match = re.search(subjectPattern, os.path.basename(regressionInput.shapePath))
+    if match is not None:
+      return match.group(1) if match.groups() else match.group(0)
+  return regressionInput.shapePath
+
+def _groupInputsBySubject(inputs, subjectPattern):
+  """ Inputs of the subject of the source shape, kept in every replicate, and inputs of the other subjects """
+  inputs = sorted(inputs, key=lambda regressionInput: float(regressionInput.timePoint))
+  sourceSubject = subjectOfInput(inputs[0], subjectPattern)
+  sourceInputs = []
+  subjects = collections.OrderedDict()
+  for regressionInput in inputs:
+    subject = subjectOfInput(regressionInput, subjectPattern)
+    if subject == sourceSubject:
+      sourceInputs.append(regressionInput)
+    else:
+      subjects.setdefault(subject, []).append(regressionInput)
+  return sourceInputs, subjects
+
+def leaveOneOutReplicates(inputs, subjectPattern=None):
+  """ Inputs of the replicates without each subject, but the one of the source shape.
+  Returns a list of (description, inputs).
+  """
+  sourceInputs, subjects = _groupInputsBySubject(inputs, subjectPattern)
+  replicates = []
+  for leftOutSubject in subjects:
+    replicateInputs = sourceInputs + [regressionInput for subject, subjectInputs in subjects.items() if subject != leftOutSubject
+                                  for regressionInput in subjectInputs]
+    replicates.append(('without {}'.format(os.path.basename(leftOutSubject)), replicateInputs))
+  return replicates
+
+def bootstrapReplicates(inputs, numberOfReplicates, subjectPattern=None, seed=0):
+  """ Inputs of replicates drawing the subjects with replacement. A subject
+  drawn several times is given a weight multiplied by the number of draws.
+  Returns a list of (description, inputs).
+  """
+  sourceInputs, subjects = _groupInputsBySubject(inputs, subjectPattern)
+  subjectNames = list(subjects.keys())
+  if len(subjectNames) == 0:
+    return []
+  randomState = np.random.RandomState(seed)
+  replicates = []
+  for replicate in range(numberOfReplicates):
+    draws = np.bincount(randomState.randint(len(subjectNames), size=len(subjectNames)), minlength=len(subjectNames))
+    replicateInputs = list(sourceInputs)
+    for subject, count in zip(subjectNames, draws):
+      if count == 0:
+        continue
+      for regressionInput in subjects[subject]:
+        replicateInputs.append(regressionInputStruct(regressionInput.shapePath, regressionInput.timePoint,
+                                                     regressionInput.sigmaW, regressionInput.tris,
+                                                     regressionInput.weight * int(count), regressionInput.group))
+    replicates.append(('bootstrap {} ({} subjects)'.format(replicate, int((draws > 0).sum())), replicateInputs))
+  return replicates
+
+def triangleVolumes(points, triangles):
+  """ Volume enclosed by closed triangle meshes, for points of shape (..., N, 3) """
+  p0 = points[..., triangles[:, 0], :]
+  p1 = points[..., triangles[:, 1], :]
+  p2 = points[..., triangles[:, 2], :]
+  return np.abs((p0 * np.cross(p1, p2)).sum(axis=-1).sum(axis=-1)) / 6.0
+
+def _triangles(polyData):
+  triangleFilter = vtk.vtkTriangleFilter()
+  triangleFilter.SetInputData(polyData)
+  triangleFilter.Update()
+  cells = numpy_support.vtk_to_numpy(triangleFilter.GetOutput().GetPolys().GetData())
+  return cells.reshape(-1, 4)[:, 1:]
+
+class ResamplingRegression(ParameterSweep):
+
+  def __init__(self, baseParameters, method='leave-one-out', numberOfReplicates=100, subjectPattern=None, seed=0,
+               warmStartDirectory=None, executable=None, numberOfCores=None, numberOfConcurrentRuns=None,
+               resultCache=None, startProcess=None):
+    if method not in ResamplingMethods:
+      raise ValueError('Unknown resampling method {}, expected one of {}.'.format(method, ', '.join(ResamplingMethods)))
+    if method == 'bootstrap':
+      replicates = bootstrapReplicates(baseParameters.inputs, numberOfReplicates, subjectPattern, seed)
+    else:
+      replicates = leaveOneOutReplicates(baseParameters.inputs, subjectPattern)
+    self.method = method
+    resamplingDirectory = os.path.join(baseParameters.outputDirectory, ResamplingDirectoryName)
+    ParameterSweep.__init__(self, baseParameters, [{'inputs': replicateInputs} for description, replicateInputs in replicates],
+                            resamplingDirectory, executable, numberOfCores, numberOfConcurrentRuns, resultCache,
+                            runNames=['replicate_{:03d}'.format(index) for index in range(len(replicates))],
+                            startProcess=startProcess)
+    # The inputs are described instead of being written in the summary
+    self.parameterNames = ['replicate']
+    for run, (description, replicateInputs) in zip(self.runs, replicates):
+      run.overrides = {'replicate': description}
+      if warmStartDirectory:
+        setWarmStart(run.parameters, warmStartDirectory, run.parameters.v0weight or 1.0)
+
+  @property
+  def resamplingDirectory(self):
+    return self.sweepDirectory
+
+  @property
+  def volumesFilePath(self):
+    return os.path.join(self.resamplingDirectory, 'resamplingVolumes.csv')
+
+  def start(self):
+    if len(self.runs) < 2:
+      raise ValueError('The resampling needs at least 2 replicates, found {}.'.format(len(self.runs)))
+    return ParameterSweep.start(self)
+
+  def finishedOutputDirectories(self):
+    return [run.parameters.outputDirectory for run in self.runs if run.status in ('Completed', 'Restored')]
+
+  def computeStatistics(self, confidence=0.95, numberOfWorkers=None):
+    """ Mean trajectory and spread of the finished replicates, see resamplingStatistics """
+    return resamplingStatistics(self.finishedOutputDirectories(), self.baseParameters.outputPrefix,
+                                self.resamplingDirectory, confidence, numberOfWorkers)
+
+def resamplingStatistics(outputDirectories, outputPrefix, statisticsDirectory, confidence=0.95, numberOfWorkers=None):
+  """ Write the mean shape of the replicates at each time step, with the
+  standard deviation of its points as point data, and the volume of the
+  replicates with its confidence band. Returns the path of the volume CSV file.
+  """
+  trajectories = [finalShapeFilePaths(outputDirectory, outputPrefix) for outputDirectory in outputDirectories]
+  numberOfTimeSteps = max(len(trajectory) for trajectory in trajectories) if len(trajectories) > 0 else 0
+  trajectories = [trajectory for trajectory in trajectories if len(trajectory) == numberOfTimeSteps]
+  if len(trajectories) < 2:
+    raise ValueError('The statistics need at least 2 finished replicates, found {}.'.format(len(trajectories)))
+  referenceShape = readPolyData(trajectories[0][0])
+  numberOfPoints = referenceShape.GetNumberOfPoints()
+  triangles = _triangles(referenceShape)
+
+  # Volume of each replicate at each time step
+  volumes = np.full((len(trajectories), numberOfTimeSteps), np.nan)
+  numberOfReplicatesUsed = 0
+  with concurrent.futures.ThreadPoolExecutor(max_workers=numberOfWorkers or defaultNumberOfWorkers()) as executor:
+    for timeStep in range(numberOfTimeSteps):
+      # Sums of the deviations from the first replicate, for the precision of the variance
+      shift = None
+      pointsSum = np.zeros((numberOfPoints, 3))
+      pointsSquaredSum = np.zeros((numberOfPoints, 3))
+      count = 0
+      shapes = [trajectory[timeStep] for trajectory in trajectories]
+      for replicate, points in enumerate(executor.map(readPoints, shapes)):
+        if points.shape != (numberOfPoints, 3):
+          logging.warning("{} is not in correspondence with the other replicates".format(shapes[replicate]))
+          continue
+        if shift is None:
+          shift = points
+        pointsSum += points - shift
+        pointsSquaredSum += (points - shift) ** 2
+        volumes[replicate, timeStep] = triangleVolumes(points, triangles)
+        count += 1
+      if count == 0:
+        logging.warning("No replicate is in correspondence with the reference at time step {}, it is skipped".format(timeStep))
+        continue
+      meanDeviation = pointsSum / count
+      variance = np.maximum(pointsSquaredSum / count - meanDeviation ** 2, 0.0) * count / max(count - 1, 1)
+      standardDeviation = np.sqrt(variance.sum(axis=1))
+      _writeMeanShape(referenceShape, shift + meanDeviation, standardDeviation,
+                      os.path.join(statisticsDirectory, '{}mean_time_{:03d}.vtk'.format(outputPrefix, timeStep)))
+      numberOfReplicatesUsed = max(numberOfReplicatesUsed, count)
+
+  lowerPercentile = 50.0 * (1.0 - confidence)
+  volumesFilePath = os.path.join(statisticsDirectory, 'resamplingVolumes.csv')
+  with open(volumesFilePath, 'w') as csvfile:
+    cw = csv.writer(csvfile, delimiter=',', lineterminator='\n')
+    cw.writerow(['timeStep', 'meanVolume', 'standardDeviation', 'lowerBound', 'upperBound', 'replicates'])
+    for timeStep in range(numberOfTimeSteps):
+      timeStepVolumes = volumes[:, timeStep][~np.isnan(volumes[:, timeStep])]
+      if len(timeStepVolumes) == 0:
+        continue
+      cw.writerow([timeStep, timeStepVolumes.mean(), timeStepVolumes.std(ddof=1),
+                   np.percentile(timeStepVolumes, lowerPercentile), np.percentile(timeStepVolumes, 100.0 - lowerPercentile),
+                   len(timeStepVolumes)])
+  logging.info("Resampling statistics of {} replicates written in {}".format(numberOfReplicatesUsed, statisticsDirectory))
+  return volumesFilePath
+
+def _writeMeanShape(referenceShape, meanPoints, standardDeviation, filePath):
+  shape = vtk.vtkPolyData()
+  shape.DeepCopy(referenceShape)
+  shape.GetPointData().Initialize()
+  vtkPoints = vtk.vtkPoints()
+  vtkPoints.SetData(numpy_support.numpy_to_vtk(np.ascontiguousarray(meanPoints), deep=True))
+  shape.SetPoints(vtkPoints)
+  standardDeviationArray = numpy_support.numpy_to_vtk(standardDeviation, deep=True)
+  standardDeviationArray.SetName('StandardDeviation')
+  shape.GetPointData().AddArray(standardDeviationArray)
+  shape.GetPointData().SetActiveScalars('StandardDeviation')
+  return writePolyData(shape, filePath)
@@ -0,0 +1,242 @@
+import csv
+import logging
+import os
+import time
+
+#
+# Resources used by a running shape4D
+#
+# The memory (resident set size), the CPU utilization, the number of threads
+# and the bytes read from and written to the storage of shape4D are sampled
+# from /proc at a fixed interval. The process is given by its pid, or, for the
+# runs of the CLI module whose pid is not known, found among the descendants
+# of Slicer by an argument of its command line (the driver file). The samples
+# are appended to a CSV file in the output directory as they are taken.
+#
+# With a memory limit the monitor tells to stop the run before the limit is
+# crossed: when the memory is above a margin of the limit, or would be above
+# the limit at the next sample if it keeps growing at the same rate.
+#
+# /proc only exists on Linux: elsewhere the monitor takes no sample.
+#
+
+ResourceUsageFileName = 'resourceUsage.csv'
+
+# Fraction of the memory limit at which the run is stopped
+MemoryLimitMargin = 0.95
+
+_procDirectory = '/proc'
+
+class resourceSampleStruct(object):
+  def __init__(self):
+    # Seconds since the start of the monitor
+    self.time = None
+    self.numberOfProcesses = 0
+    # Bytes
+    self.residentMemory = 0
+    # Percent of one core
+    self.cpuPercent = None
+    self.numberOfThreads = 0
+    # Bytes read from and written to the storage, None if /proc/<pid>/io can not be read
+    self.readBytes = None
+    self.writtenBytes = None
+
+class _processStatStruct(object):
+  def __init__(self):
+    self.parentPid = None
+    self.cpuTicks = 0
+    self.numberOfThreads = 0
+    self.residentPages = 0
+
+def isSupported():
+  return os.path.isdir(os.path.join(_procDirectory, 'self'))
+
+def readProcessStat(pid):
+  """ Parent, CPU time, threads and memory of a process from /proc/<pid>/stat,
+  or None if the process does not exist anymore
+  """
+  try:
+    with open(os.path.join(_procDirectory, str(pid), 'stat')) as statFile:
+      stat = statFile.read()
+  except OSError:
+    return None
+  # The name of the command, in parentheses, may contain spaces
+  fields = stat[stat.rfind(')') + 2:].split()
+  processStat = _processStatStruct()
+  processStat.parentPid = int(fields[1])
+  processStat.cpuTicks = int(fields[11]) + int(fields[12])
+  processStat.numberOfThreads = int(fields[17])
+  processStat.residentPages = int(fields[21])
+  return processStat
+
+def readProcessIO(pid):
+  """ Bytes read from and written to the storage by a process, or None if
+  /proc/<pid>/io can not be read (e.g. process of another user)
+  """
+  try:
+    with open(os.path.join(_procDirectory, str(pid), 'io')) as ioFile:
+      values = dict(line.split(':', 1) for line in ioFile if ':' in line)
+    return int(values['read_bytes']), int(values['write_bytes'])
+  except (OSError, KeyError, ValueError):
+    return None
+
+def _commandLine(pid):
+  try:
+    with open(os.path.join(_procDirectory, str(pid), 'cmdline'), 'rb') as cmdlineFile:
+      return cmdlineFile.read().decode(errors='replace').split('\0')
+  except OSError:
+    return []
+
+def _childrenByParent():
+  childrenByParent = dict()
+  for entry in os.listdir(_procDirectory):
+    if not entry.isdigit():
+      continue
+    processStat = readProcessStat(int(entry))
+    if processStat is not None:
+      childrenByParent.setdefault(processStat.parentPid, []).append(int(entry))
+  return childrenByParent
+
+def _descendants(pid, childrenByParent):
+  descendants = []
+  stack = list(childrenByParent.get(pid, []))
+  while len(stack) > 0:
+    child = stack.pop()
+    descendants.append(child)
+    stack.extend(childrenByParent.get(child, []))
+  return descendants
+
+def findProcesses(commandLineArgument, parentPid=None):
+  """ Descendants of parentPid (this process by default) with the argument in
+  their command line, and their own descendants
+  """
+  childrenByParent = _childrenByParent()
+  pids = []
+  for pid in _descendants(parentPid or os.getpid(), childrenByParent):
+    if pid not in pids and commandLineArgument in _commandLine(pid):
+      pids.append(pid)
+      pids.extend(descendant for descendant in _descendants(pid, childrenByParent) if descendant not in pids)
+  return pids
+
+class ResourceMonitor(object):
+  """ Sample the resources used by a process and its children. sample() is
+  called regularly, e.g. from a timer, and takes a sample at most every
+  samplingInterval seconds.
+  """
+
+  def __init__(self, pid=None, commandLineArgument=None, parentPid=None, samplingInterval=1.0, memoryLimit=None,
+               outputFilePath=None):
+    self.pid = pid
+    self.commandLineArgument = commandLineArgument
+    self.parentPid = parentPid
+    self.samplingInterval = samplingInterval
+    # Bytes, None for no limit
+    self.memoryLimit = memoryLimit
+    self.outputFilePath = outputFilePath
+    self.samples = []
+    self.stopReason = None
+    self.startTime = time.time()
+    self.supported = isSupported()
+    self._pids = []
+    self._previousCPU = None
+    self._pageSize = os.sysconf('SC_PAGE_SIZE') if self.supported else None
+    self._ticksPerSecond = os.sysconf('SC_CLK_TCK') if self.supported else None
+    if not self.supported:
+      logging.info("Resource monitoring needs /proc, it is not available on this platform")
+
+  def _processes(self):
+    if self.pid is not None:
+      return [self.pid] + _descendants(self.pid, _childrenByParent())
+    # The process is looked for until it is found, and again if it is gone
+    if len(self._pids) == 0 or all(readProcessStat(pid) is None for pid in self._pids):
+      self._pids = findProcesses(self.commandLineArgument, self.parentPid)
+    return self._pids
+
+  def sample(self, now=None):
+    """ Take a sample if samplingInterval elapsed since the previous one.
+    Returns the latest sample, None if there is none.
+    """
+    if now is None:
+      now = time.time()
+    if not self.supported:
+      return None
+    if len(self.samples) > 0 and now - self.startTime - self.samples[-1].time < self.samplingInterval:
+      return self.samples[-1]
+    sample = resourceSampleStruct()
+    sample.time = now - self.startTime
+    cpuTicks = 0
+    for pid in self._processes():
+      processStat = readProcessStat(pid)
+      if processStat is None:
+        continue
+      sample.numberOfProcesses += 1
+      sample.residentMemory += processStat.residentPages * self._pageSize
+      sample.numberOfThreads += processStat.numberOfThreads
+      cpuTicks += processStat.cpuTicks
+      processIO = readProcessIO(pid)
+      if processIO is not None:
+        sample.readBytes = (sample.readBytes or 0) + processIO[0]
+        sample.writtenBytes = (sample.writtenBytes or 0) + processIO[1]
+    if sample.numberOfProcesses == 0:
+      return self.samples[-1] if len(self.samples) > 0 else None
+    cpuTime = float(cpuTicks) / self._ticksPerSecond
+    if self._previousCPU is not None and now > self._previousCPU[0]:
+      # Processes that ended take their CPU time with them
+      sample.cpuPercent = max(100.0 * (cpuTime - self._previousCPU[1]) / (now - self._previousCPU[0]), 0.0)
+    self._previousCPU = (now, cpuTime)
+    self.samples.append(sample)
+    self._writeSample(sample)
+    self._checkMemoryLimit()
+    return sample
+
+  def _writeSample(self, sample):
+    if self.outputFilePath is None:
+      return
+    writeHeader = len(self.samples) == 1
+    try:
+      with open(self.outputFilePath, 'w' if writeHeader else 'a') as csvfile:
+        cw = csv.writer(csvfile, delimiter=',', lineterminator='\n')
+        if writeHeader:
+          cw.writerow(['time', 'processes', 'residentMemory', 'cpuPercent', 'threads', 'readBytes', 'writtenBytes'])
+        cw.writerow(['{:.3f}'.format(sample.time), sample.numberOfProcesses, sample.residentMemory,
+                     '' if sample.cpuPercent is None else '{:.1f}'.format(sample.cpuPercent), sample.numberOfThreads,
+                     '' if sample.readBytes is None else sample.readBytes,
+                     '' if sample.writtenBytes is None else sample.writtenBytes])
+    except OSError as e:
+      logging.warning("The resource usage could not be written in {}: {}".format(self.outputFilePath, e))
+      self.outputFilePath = None
+
+  def _checkMemoryLimit(self):
+    if not self.memoryLimit or self.stopReason is not None:
+      return
+    residentMemory = self.samples[-1].residentMemory
+    projectedMemory = residentMemory
+    if len(self.samples) > 1:
+      previous = self.samples[-2]
+      growth = residentMemory - previous.residentMemory
+      if growth > 0 and self.samples[-1].time > previous.time:
+        projectedMemory += growth * self.samplingInterval / (self.samples[-1].time - previous.time)
+    if residentMemory >= MemoryLimitMargin * self.memoryLimit or projectedMemory >= self.memoryLimit:
+      self.stopReason = 'Memory {:.2f} GB, growing to {:.2f} GB, is about to cross the limit of {:.2f} GB'.format(
+        residentMemory / 1024.0 ** 3, projectedMemory / 1024.0 ** 3, self.memoryLimit / 1024.0 ** 3)
+      logging.error("Shape4D: {}".format(self.stopReason))
+
+  @property
+  def peakMemory(self):
+    return max([sample.residentMemory for sample in self.samples] or [None])
+
+  def statusText(self):
+    """ One line summary of the latest sample, for display """
+    if len(self.samples) == 0:
+      return 'Resources: waiting for shape4D' if self.supported else 'Resources: not available on this platform'
+    sample = self.samples[-1]
+    text = 'Memory {:.2f} GB (peak {:.2f} GB'.format(sample.residentMemory / 1024.0 ** 3, self.peakMemory / 1024.0 ** 3)
+    if self.memoryLimit:
+      text += ', limit {:.1f} GB'.format(self.memoryLimit / 1024.0 ** 3)
+    text += ')'
+    if sample.cpuPercent is not None:
+      text += ', CPU {:.0f}%'.format(sample.cpuPercent)
+    text += ', {} threads'.format(sample.numberOfThreads)
+    if sample.readBytes is not None:
+      text += ', read {:.1f} MB, written {:.1f} MB'.format(sample.readBytes / 1024.0 ** 2, sample.writtenBytes / 1024.0 ** 2)
+    return text
@@ -0,0 +1,215 @@
+import copy
+import glob
+import json
+import logging
+import os
+import shutil
+import time
+
+from .ConvergenceTelemetry import ConvergenceFileName, progressSnapshotFilePaths, snapshotIteration
+from .LegacyVTKReader import readLegacyVTKInformation
+from .RegressionParameters import readDriverFile
+from .Shape4DLog import Shape4DLogFileName, readShape4DLog
+from .WarmStart import isInitialVelocityFile
+
+#
+# Resume of an interrupted regression
+#
+# shape4D saves progress snapshots, the V0 among them, every saveProgress
+# iterations. A regression interrupted by a crash or a cancel is resumed from
+# the V0 of its latest complete snapshot, for the iterations left of its
+# budget, in the same output directory. The snapshots, the log and the
+# convergence of the interrupted run are first moved in a checkpoint
+# directory, Checkpoints/checkpoint_<iteration>, so that the iterations of the
+# resumed run, numbered from 0 by shape4D, are not mixed with them.
+#
+# The lineage of the regression is kept in resume.json: one segment per run,
+# with the iteration of the regression it started from, and the checkpoint and
+# the iteration it was interrupted at. Only V0 is restored, the optimizer
+# (step size, FISTA momentum) starts again at each segment.
+#
+
+ResumeRecordFileName = 'resume.json'
+CheckpointsDirectoryName = 'Checkpoints'
+
+class checkpointStruct(object):
+  def __init__(self):
+    # Iteration of the snapshot, counted from the start of the regression
+    self.iteration = None
+    # Iteration of the snapshot in the run that saved it
+    self.runIteration = None
+    self.initV0 = None
+    # All the files of the snapshot, V0 included
+    self.filePaths = []
+
+def readResumeRecord(outputDirectory):
+  """ Lineage of the regression in the directory, or None if it was never resumed """
+  try:
+    with open(os.path.join(outputDirectory, ResumeRecordFileName)) as recordFile:
+      return json.load(recordFile)
+  except (OSError, ValueError):
+    return None
+
+def writeResumeRecord(outputDirectory, record):
+  recordFilePath = os.path.join(outputDirectory, ResumeRecordFileName)
+  with open(recordFilePath, 'w') as recordFile:
+    json.dump(record, recordFile, indent=2)
+  return recordFilePath
+
+def _segmentStartIteration(record):
+  if record is None or len(record['segments']) == 0:
+    return 0
+  return record['segments'][-1]['startIteration']
+
+def isCompleteSnapshotFile(filePath):
+  """ Whether a snapshot was written completely: a crash can leave the last one truncated """
+  if os.path.getsize(filePath) == 0:
+    return False
+  information = readLegacyVTKInformation(filePath)
+  # Files the fast reader does not handle are trusted
+  return information is None or information.numberOfPoints > 0
+
+def findLatestCheckpoint(outputDirectory, outputPrefix):
+  """ Latest progress snapshot of the regression in the directory with a
+  complete V0 file, or None if there is none.
+  """
+  snapshots = dict()
+  for filePath in progressSnapshotFilePaths(outputDirectory, outputPrefix):
+    snapshots.setdefault(snapshotIteration(filePath, outputPrefix), []).append(filePath)
+  startIteration = _segmentStartIteration(readResumeRecord(outputDirectory))
+  for iteration in sorted(snapshots, reverse=True):
+    initV0FilePaths = [filePath for filePath in snapshots[iteration] if isInitialVelocityFile(filePath)]
+    if len(initV0FilePaths) == 0 or not isCompleteSnapshotFile(initV0FilePaths[0]):
+      continue
+    checkpoint = checkpointStruct()
+    checkpoint.runIteration = iteration
+    checkpoint.iteration = startIteration + iteration
+    checkpoint.initV0 = initV0FilePaths[0]
+    checkpoint.filePaths = snapshots[iteration]
+    return checkpoint
+  return None
+
+def isCompleted(outputDirectory, outputPrefix):
+  """ Whether the regression in the directory saved its final shapes """
+  filePaths = glob.glob(os.path.join(outputDirectory, glob.escape(outputPrefix) + '*.vtk'))
+  return any('final' in os.path.basename(filePath)[len(outputPrefix):] for filePath in filePaths)
+
+def isResumedRun(parameters):
+  """ Whether the regression starts from a checkpoint of its own output directory """
+  if not parameters.useInitV0:
+    return False
+  checkpointsDirectory = os.path.join(os.path.abspath(parameters.outputDirectory), CheckpointsDirectoryName)
+  return os.path.abspath(parameters.initV0).startswith(checkpointsDirectory + os.sep)
+
+def _lastLoggedIteration(outputDirectory):
+  try:
+    records = readShape4DLog(os.path.join(outputDirectory, Shape4DLogFileName))
+  except OSError:
+    return None
+  return records[-1].iteration if len(records) > 0 else None
+
+def resumeParameters(outputDirectory, parameters=None):
+  """ Parameters continuing the interrupted regression in the directory from
+  its latest checkpoint, for the iterations left of its budget. The parameters
+  are read from the driver file of the directory if not given. The snapshots
+  of the interrupted run are moved in a checkpoint directory and the lineage
+  is updated. Raises ValueError if the regression can not be resumed.
+  """
+  if parameters is None:
+    parameters = readDriverFile(os.path.join(outputDirectory, 'driver.xml'))
+  parameters = copy.deepcopy(parameters)
+  parameters.outputDirectory = outputDirectory
+  if isCompleted(outputDirectory, parameters.outputPrefix):
+    raise ValueError('The regression in {} is completed, there is nothing to resume.'.format(outputDirectory))
+
+  record = readResumeRecord(outputDirectory)
+  checkpoint = findLatestCheckpoint(outputDirectory, parameters.outputPrefix)
+  if checkpoint is None:
+    if record is not None and len(record['segments']) > 0:
+      # The resumed run was interrupted before its first snapshot: resume it again
+      segment = record['segments'][-1]
+      logging.info("No new checkpoint since iteration {}, resume from it again".format(segment['startIteration']))
+      parameters.useInitV0 = True
+      parameters.initV0 = segment['initV0']
+      parameters.v0weight = segment['v0weight']
+      parameters.maxIters = segment['maxIters']
+      return parameters
+    raise ValueError('No progress snapshot with a V0 file found in {}, the regression can not be resumed. '
+                     'Snapshots are saved every "Save every N" iterations.'.format(outputDirectory))
+
+  if record is None:
+    record = {
+      'maxIters': parameters.maxIters,
+      'segments': [{
+        'startIteration': 0,
+        'initV0': parameters.initV0 if parameters.useInitV0 else None,
+        'maxIters': parameters.maxIters,
+      }],
+    }
+  remainingIterations = record['maxIters'] - checkpoint.iteration
+  if remainingIterations <= 0:
+    raise ValueError('The regression in {} reached its {} iterations, there is nothing to resume.'.format(
+      outputDirectory, record['maxIters']))
+
+  # Keep the interrupted run out of the way of the resumed one
+  checkpointDirectory = os.path.join(outputDirectory, CheckpointsDirectoryName, 'checkpoint_{:06d}'.format(checkpoint.iteration))
+  if not os.path.isdir(checkpointDirectory):
+    os.makedirs(checkpointDirectory)
+  lastLoggedIteration = _lastLoggedIteration(outputDirectory)
+  filePaths = progressSnapshotFilePaths(outputDirectory, parameters.outputPrefix)
+  filePaths += [os.path.join(outputDirectory, fileName) for fileName in (Shape4DLogFileName, ConvergenceFileName)]
+  for filePath in filePaths:
+    if os.path.exists(filePath):
+      shutil.move(filePath, os.path.join(checkpointDirectory, os.path.basename(filePath)))
+  initV0 = os.path.join(checkpointDirectory, os.path.basename(checkpoint.initV0))
+
+  interruptedSegment = record['segments'][-1]
+  interruptedSegment['endIteration'] = checkpoint.iteration
+  interruptedSegment['lastLoggedIteration'] = (None if lastLoggedIteration is None
+                                               else interruptedSegment['startIteration'] + lastLoggedIteration)
+  interruptedSegment['checkpointDirectory'] = checkpointDirectory
+  interruptedSegment['status'] = 'Interrupted'
+  record['segments'].append({
+    'startIteration': checkpoint.iteration,
+    'initV0': initV0,
+    'v0weight': parameters.v0weight or 1.0,
+    'maxIters': remainingIterations,
+    'resumeTime': time.time(),
+  })
+  writeResumeRecord(outputDirectory, record)
+
+  parameters.useInitV0 = True
+  parameters.initV0 = initV0
+  parameters.v0weight = parameters.v0weight or 1.0
+  parameters.maxIters = remainingIterations
+  logging.info("Resume the regression in {} at iteration {}, {} iterations left".format(
+    outputDirectory, checkpoint.iteration, remainingIterations))
+  return parameters
+
+def finishResumedRun(outputDirectory, status):
+  """ Record the final status of the last segment of a resumed regression """
+  record = readResumeRecord(outputDirectory)
+  if record is None or len(record['segments']) == 0:
+    return None
+  segment = record['segments'][-1]
+  segment['status'] = status
+  lastLoggedIteration = _lastLoggedIteration(outputDirectory)
+  if lastLoggedIteration is not None:
+    segment['lastLoggedIteration'] = segment['startIteration'] + lastLoggedIteration
+  return writeResumeRecord(outputDirectory, record)
+
+def resumeReport(outputDirectory):
+  """ One line per segment of the lineage of the regression in the directory """
+  record = readResumeRecord(outputDirectory)
+  if record is None:
+    return None
+  lines = []
+  for index, segment in enumerate(record['segments']):
+    line = 'Run {}: from iteration {}'.format(index, segment['startIteration'])
+    if segment.get('endIteration') is not None:
+      line += ' to checkpoint {}'.format(segment['endIteration'])
+    if segment.get('lastLoggedIteration') is not None:
+      line += ' (last iteration {})'.format(segment['lastLoggedIteration'])
+    line += ', {}'.format(segment.get('status', 'Running').lower())
+    lines.append(line)
+  return '\n'.join(lines)
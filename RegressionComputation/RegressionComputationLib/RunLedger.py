@@ -0,0 +1,267 @@
+import concurrent.futures
+import json
+import logging
+import os
+import re
+import socket
+import sqlite3
+import subprocess
+import time
+
+from .CostPlanner import shapeMetadataForInputs
+from .JobQueue import parametersToDict
+from .RegressionResultCache import fileContentHash
+from .Shape4DLog import readShape4DLog
+
+#
+# Ledger of the regressions run
+#
+# Every regression run by the module appends a row to a SQLite ledger: its
+# driver parameters, the content hashes of its input shapes, the number of
+# subjects and of vertices, the wall time, the number of iterations, the final
+# objective, the peak memory, the exit status and the version of shape4D. The
+# ledger is queried for the slowest runs, the time per vertex and per
+# iteration of each kernel type, and its trend across the versions of shape4D
+# to spot the performance regressions after an upgrade.
+#
+# The content hashes are only computed again when the size or the
+# modification time of a file changed, as in the result cache. The version of
+# shape4D is read in the background, and written in the rows of the runs
+# recorded meanwhile when it is known.
+#
+
+RunLedgerFileName = 'RunLedger.sqlite'
+
+# A version of shape4D is reported as a performance regression when it is this
+# much slower per vertex and per iteration than the previous one
+PerformanceRegressionTolerance = 0.2
+
+_runColumns = ('id', 'time', 'launcher', 'outputDirectory', 'parameters', 'inputHashes', 'numberOfSubjects',
+               'numberOfSourceVertices', 'numberOfVertices', 'kernelType', 'T', 'maxIters', 'wallTime', 'iterations',
+               'finalObjective', 'peakMemory', 'status', 'shape4DVersion', 'host')
+
+_versionExpression = re.compile(r'<version>\s*(.*?)\s*</version>', re.DOTALL)
+
+# (path, size, modification time) -> future of the version, as the executable
+# is asked once. The versions are read in a thread not to block the caller,
+# e.g. the module at the end of a run, for up to the timeout of --xml.
+_shape4DVersionFutures = dict()
+_shape4DVersionExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+def _readShape4DVersion(executable):
+  version = 'unknown'
+  try:
+    description = subprocess.run([executable, '--xml'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                 timeout=30).stdout.decode(errors='replace')
+    match = _versionExpression.search(description)
+    if match is not None:
+      version = match.group(1)
+  except (OSError, subprocess.SubprocessError) as e:
+    logging.debug("The version of {} could not be read: {}".format(executable, e))
+  return '{} ({})'.format(version, fileContentHash(executable)[:8])
+
+def shape4DVersionFuture(executable):
+  """ Future of shape4DVersion, read in the background the first time an
+  executable is asked. None if there is no executable.
+  """
+  if not executable or not os.path.isfile(executable):
+    return None
+  fileStat = os.stat(executable)
+  key = (os.path.abspath(executable), fileStat.st_size, fileStat.st_mtime_ns)
+  if key not in _shape4DVersionFutures:
+    _shape4DVersionFutures[key] = _shape4DVersionExecutor.submit(_readShape4DVersion, executable)
+  return _shape4DVersionFutures[key]
+
+def shape4DVersion(executable):
+  """ Version of shape4D from its CLI description (--xml), with the beginning
+  of the hash of the executable to tell the builds of the same version apart
+  """
+  future = shape4DVersionFuture(executable)
+  return future.result() if future is not None else None
+
+class ledgerTableStruct(object):
+  """ Result of a query of the ledger: the names of the columns and the rows """
+  def __init__(self, columns=None, rows=None):
+    self.columns = columns if columns is not None else []
+    self.rows = rows if rows is not None else []
+
+class RunLedger(object):
+
+  def __init__(self, ledgerFilePath):
+    self.ledgerFilePath = ledgerFilePath
+    ledgerDirectory = os.path.dirname(os.path.abspath(ledgerFilePath))
+    if not os.path.isdir(ledgerDirectory):
+      os.makedirs(ledgerDirectory)
+    # Each statement is committed at once: the ledger may be shared by several processes
+    self.connection = sqlite3.connect(ledgerFilePath, timeout=30.0, isolation_level=None)
+    self.connection.execute('CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY AUTOINCREMENT, time REAL, '
+                            'launcher TEXT, outputDirectory TEXT, parameters TEXT, inputHashes TEXT, '
+                            'numberOfSubjects INTEGER, numberOfSourceVertices INTEGER, numberOfVertices INTEGER, '
+                            'kernelType TEXT, T INTEGER, maxIters INTEGER, wallTime REAL, iterations INTEGER, '
+                            'finalObjective REAL, peakMemory INTEGER, status TEXT, shape4DVersion TEXT, host TEXT)')
+    self.connection.execute('CREATE TABLE IF NOT EXISTS fileHashes (path TEXT PRIMARY KEY, size INTEGER, '
+                            'mtime INTEGER, sha256 TEXT)')
+    # Recorded runs whose version of shape4D is being read: id -> future of the version
+    self.pendingVersions = dict()
+
+  def close(self):
+    """ Close the ledger, once the versions of shape4D being read are written """
+    if self.connection is not None:
+      self.updatePendingVersions(wait=True)
+      self.connection.close()
+      self.connection = None
+
+  def _fileHash(self, filePath):
+    """ Content hash of a file recorded in the ledger, or None if the file is
+    not recorded or its size or modification time changed since
+    """
+    fileStat = os.stat(filePath)
+    key = os.path.abspath(filePath)
+    row = self.connection.execute('SELECT size, mtime, sha256 FROM fileHashes WHERE path = ?', (key,)).fetchone()
+    if row is not None and row[0] == fileStat.st_size and row[1] == fileStat.st_mtime_ns:
+      return row[2]
+    return None
+
+  def inputHashes(self, parameters):
+    """ Content hash of the input shapes, in the order of the inputs """
+    shapePaths = sorted(set(regressionInput.shapePath for regressionInput in parameters.inputs))
+    shapeHashes = dict((shapePath, self._fileHash(shapePath)) for shapePath in shapePaths)
+    shapePathsToHash = [shapePath for shapePath in shapePaths if shapeHashes[shapePath] is None]
+    if len(shapePathsToHash) > 0:
+      # hashlib releases the GIL on large buffers so the shapes are hashed in threads
+      with concurrent.futures.ThreadPoolExecutor(max_workers=min(8, len(shapePathsToHash))) as executor:
+        for shapePath, sha256 in zip(shapePathsToHash, executor.map(fileContentHash, shapePathsToHash)):
+          fileStat = os.stat(shapePath)
+          self.connection.execute('INSERT OR REPLACE INTO fileHashes VALUES (?, ?, ?, ?)',
+                                  (os.path.abspath(shapePath), fileStat.st_size, fileStat.st_mtime_ns, sha256))
+          shapeHashes[shapePath] = sha256
+    return [shapeHashes[regressionInput.shapePath] for regressionInput in parameters.inputs]
+
+  def recordRun(self, parameters, status, wallTime, iterations=None, finalObjective=None, peakMemory=None,
+                executable=None, launcher='single', shapeMetadataCache=None):
+    """ Append a run to the ledger. Returns its id. """
+    try:
+      inputHashes = self.inputHashes(parameters)
+    except OSError as e:
+      logging.warning("The input shapes could not be hashed for the run ledger: {}".format(e))
+      inputHashes = []
+    metadata = shapeMetadataForInputs(parameters.inputs, shapeMetadataCache)
+    numberOfPoints = [metadata[regressionInput.shapePath].numberOfPoints for regressionInput in parameters.inputs]
+    description = parametersToDict(parameters)
+    del description['inputs']
+    row = {
+      'time': time.time(),
+      'launcher': launcher,
+      'outputDirectory': parameters.outputDirectory,
+      'parameters': json.dumps(description, sort_keys=True),
+      'inputHashes': json.dumps(inputHashes),
+      'numberOfSubjects': len(parameters.inputs),
+      'numberOfSourceVertices': numberOfPoints[0] if len(numberOfPoints) > 0 else None,
+      'numberOfVertices': sum(numberOfPoints) if None not in numberOfPoints else None,
+      'kernelType': parameters.kernelType,
+      'T': parameters.T,
+      'maxIters': parameters.maxIters,
+      'wallTime': wallTime,
+      'iterations': iterations,
+      'finalObjective': finalObjective,
+      'peakMemory': peakMemory,
+      'status': status,
+      'shape4DVersion': None,
+      'host': socket.gethostname(),
+    }
+    columns = _runColumns[1:]
+    cursor = self.connection.execute('INSERT INTO runs ({}) VALUES ({})'.format(', '.join(columns), ', '.join('?' * len(columns))),
+                                     [row[column] for column in columns])
+    versionFuture = shape4DVersionFuture(executable)
+    if versionFuture is not None:
+      self.pendingVersions[cursor.lastrowid] = versionFuture
+    self.updatePendingVersions()
+    return cursor.lastrowid
+
+  def updatePendingVersions(self, wait=False):
+    """ Write the versions of shape4D read since their runs were recorded,
+    all of them once read if wait is True
+    """
+    for runId, versionFuture in list(self.pendingVersions.items()):
+      if not wait and not versionFuture.done():
+        continue
+      del self.pendingVersions[runId]
+      try:
+        version = versionFuture.result()
+      except OSError as e:
+        logging.warning("The version of shape4D could not be read for the run ledger: {}".format(e))
+        continue
+      self.connection.execute('UPDATE runs SET shape4DVersion = ? WHERE id = ?', (version, runId))
+
+  def recordProcessRuns(self, runs, executable=None, launcher='sweep', shapeMetadataCache=None):
+    """ Append the runs of a sweep, a multiresolution or an automatic T
+    regression, i.e. the objects with parameters, process, status and wallTime,
+    that were started. The iterations and the objective are read from their log.
+    """
+    runIds = []
+    for run in runs:
+      if run.process is None:
+        continue
+      try:
+        records = readShape4DLog(run.process.logFilePath)
+      except OSError:
+        records = []
+      runIds.append(self.recordRun(run.parameters, run.status, run.wallTime,
+                                   records[-1].iteration if len(records) > 0 else None,
+                                   records[-1].objective if len(records) > 0 else None,
+                                   executable=executable, launcher=launcher, shapeMetadataCache=shapeMetadataCache))
+    return runIds
+
+  def query(self, sql, arguments=()):
+    self.updatePendingVersions()
+    cursor = self.connection.execute(sql, arguments)
+    return ledgerTableStruct([column[0] for column in cursor.description], cursor.fetchall())
+
+  def runs(self, limit=None):
+    """ The runs, the latest first """
+    return self.query('SELECT {} FROM runs ORDER BY time DESC LIMIT ?'.format(', '.join(_runColumns)),
+                      (-1 if limit is None else limit,))
+
+  def slowestRuns(self, limit=20):
+    return self.query("SELECT id, datetime(time, 'unixepoch', 'localtime') AS date, wallTime, kernelType, numberOfSubjects, "
+                      "numberOfVertices, T, iterations, peakMemory, status, shape4DVersion, outputDirectory "
+                      "FROM runs ORDER BY wallTime DESC LIMIT ?", (limit,))
+
+  # Seconds per vertex and per iteration of the completed runs
+  _timePerVertexIteration = 'wallTime / (numberOfVertices * iterations)'
+  _completedRuns = "status = 'Completed' AND iterations > 0 AND numberOfVertices > 0"
+
+  def timePerVertexIterationByKernel(self):
+    return self.query('SELECT kernelType, COUNT(*) AS runs, AVG({0}) AS meanTimePerVertexIteration, '
+                      'MIN({0}) AS minimumTimePerVertexIteration, MAX({0}) AS maximumTimePerVertexIteration, '
+                      'MAX(peakMemory) AS peakMemory FROM runs WHERE {1} GROUP BY kernelType '
+                      'ORDER BY kernelType'.format(self._timePerVertexIteration, self._completedRuns))
+
+  def versionTrends(self, kernelType=None):
+    """ Time per vertex and per iteration of each version of shape4D and
+    kernel type, in the order the versions were first used
+    """
+    condition = self._completedRuns
+    arguments = ()
+    if kernelType is not None:
+      condition += ' AND kernelType = ?'
+      arguments = (kernelType,)
+    return self.query("SELECT shape4DVersion, kernelType, datetime(MIN(time), 'unixepoch', 'localtime') AS firstUsed, "
+                      'COUNT(*) AS runs, AVG({0}) AS meanTimePerVertexIteration, AVG(peakMemory) AS meanPeakMemory '
+                      'FROM runs WHERE {1} GROUP BY shape4DVersion, kernelType '
+                      'ORDER BY kernelType, MIN(time)'.format(self._timePerVertexIteration, condition), arguments)
+
+  def performanceRegressions(self, tolerance=PerformanceRegressionTolerance):
+    """ Versions of shape4D slower per vertex and per iteration than the
+    previous version with the same kernel type, as (kernelType, previous
+    version, version, ratio of the times)
+    """
+    regressions = []
+    trends = self.versionTrends()
+    previousByKernel = dict()
+    for shape4DVersion, kernelType, firstUsed, runs, meanTime, meanPeakMemory in trends.rows:
+      previous = previousByKernel.get(kernelType)
+      if previous is not None and previous[1] > 0 and meanTime > (1.0 + tolerance) * previous[1]:
+        regressions.append((kernelType, previous[0], shape4DVersion, meanTime / previous[1]))
+      previousByKernel[kernelType] = (shape4DVersion, meanTime)
+    return regressions
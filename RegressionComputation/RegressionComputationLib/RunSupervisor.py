@@ -0,0 +1,117 @@
+import json
+import logging
+import os
+import shutil
+import time
+
+from .ConvergenceTelemetry import progressSnapshotFilePaths, snapshotFinalFileName, snapshotIteration
+
+#
+# Early stopping of a regression
+#
+# The supervisor follows the convergence telemetry of a running regression and
+# tells when it should be stopped: when it runs longer than a wall-clock
+# budget, or when the objective improved by less than a given percentage over
+# the last iterations. The run is then cancelled and the latest progress
+# snapshot is kept as its result.
+#
+
+SupervisorRecordFileName = 'supervisor.json'
+
+class RunSupervisor(object):
+
+  def __init__(self, wallClockBudget=None, plateauImprovement=None, plateauIterations=None):
+    # Seconds, None for no budget
+    self.wallClockBudget = wallClockBudget
+    # Stop if the objective improved by less than plateauImprovement percent
+    # over the last plateauIterations iterations
+    self.plateauImprovement = plateauImprovement
+    self.plateauIterations = plateauIterations
+    self.stopReason = None
+
+  @property
+  def enabled(self):
+    return bool(self.wallClockBudget) or bool(self.plateauImprovement and self.plateauIterations)
+
+  def plateauReached(self, telemetry):
+    if not (self.plateauImprovement and self.plateauIterations) or len(telemetry.records) == 0:
+      return False
+    last = telemetry.records[-1]
+    windowStart = last.iteration - self.plateauIterations
+    # The window has to be covered by the records
+    if telemetry.records[0].iteration > windowStart:
+      return False
+    first = None
+    for record in reversed(telemetry.records):
+      if record.iteration <= windowStart:
+        first = record
+        break
+    if first.objective == 0:
+      return True
+    improvement = 100.0 * (first.objective - last.objective) / abs(first.objective)
+    return improvement < self.plateauImprovement
+
+  def check(self, telemetry, now=None):
+    """ Return the reason to stop the regression, or None to let it run """
+    if self.stopReason is not None:
+      return self.stopReason
+    if self.wallClockBudget and telemetry.elapsedTime(now) > self.wallClockBudget:
+      self.stopReason = 'Wall-clock budget of {:.0f}s exceeded'.format(self.wallClockBudget)
+    elif self.plateauReached(telemetry):
+      self.stopReason = 'Less than {}% improvement over the last {} iterations'.format(self.plateauImprovement,
+                                                                                      self.plateauIterations)
+    return self.stopReason
+
+def promoteLatestSnapshot(outputDirectory, outputPrefix):
+  """ Copy the shapes of the latest progress snapshot as the final shapes of the
+  regression, named as shape4D names them. Returns the paths of the final shapes.
+  """
+  snapshots = progressSnapshotFilePaths(outputDirectory, outputPrefix)
+  iterations = [snapshotIteration(filePath, outputPrefix) for filePath in snapshots]
+  if len(iterations) == 0:
+    return []
+  latestIteration = max(iterations)
+  finalShapes = []
+  for filePath in snapshots:
+    if snapshotIteration(filePath, outputPrefix) != latestIteration:
+      continue
+    finalFileName = snapshotFinalFileName(os.path.basename(filePath)[len(outputPrefix):])
+    finalShape = os.path.join(outputDirectory, outputPrefix + finalFileName)
+    shutil.copy2(filePath, finalShape)
+    finalShapes.append(finalShape)
+  return finalShapes
+
+def writeSupervisorRecord(outputDirectory, supervisor, telemetry, finalShapes):
+  record = {
+    'stopReason': supervisor.stopReason,
+    'iteration': telemetry.iteration,
+    'objective': telemetry.objective,
+    'snapshotIteration': telemetry.snapshotIteration,
+    'elapsedTime': telemetry.elapsedTime(),
+    'finalShapes': finalShapes,
+  }
+  recordFilePath = os.path.join(outputDirectory, SupervisorRecordFileName)
+  with open(recordFilePath, 'w') as recordFile:
+    json.dump(record, recordFile, indent=2)
+  return recordFilePath
+
+def stopEarly(outputDirectory, outputPrefix, supervisor, telemetry):
+  """ Keep the latest snapshot of a regression stopped by its supervisor """
+  telemetry.updateSnapshots()
+  finalShapes = promoteLatestSnapshot(outputDirectory, outputPrefix)
+  writeSupervisorRecord(outputDirectory, supervisor, telemetry, finalShapes)
+  logging.info("Shape4D stopped early at iteration {}: {}".format(telemetry.iteration, supervisor.stopReason))
+  return finalShapes
+
+def superviseProcess(process, parameters, supervisor, telemetry, pollingInterval=5.0):
+  """ Wait for a Shape4DProcess, cancelling it when the supervisor tells to stop """
+  while process.isBusy():
+    telemetry.updateFromLogFile(process.logFilePath)
+    if supervisor.check(telemetry) is not None:
+      process.cancel()
+      telemetry.updateFromLogFile(process.logFilePath)
+      stopEarly(parameters.outputDirectory, parameters.outputPrefix, supervisor, telemetry)
+      break
+    time.sleep(pollingInterval)
+  telemetry.updateFromLogFile(process.logFilePath)
+  return process
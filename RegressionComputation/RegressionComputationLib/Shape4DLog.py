@@ -0,0 +1,60 @@
+import logging
+import re
+
+#
+# Parsing of the shape4D standard output
+#
+# shape4D reports its progress with one line per iteration:
+#
+#   Iter 5 E = 7.210923e+03 Data = 6.875066e+03 Reg = 3.358571e+02 Step = 2.488320e-02
+#
+# giving the iteration number, the value of the objective function, its data
+# and regularity terms and the step size. Only lines of exactly this format
+# are iteration lines; the other lines of the output (settings, progress
+# snapshots, convergence messages) are ignored.
+#
+
+# Name of the file in which the output of shape4D is saved in the output directory
+Shape4DLogFileName = 'shape4D.log'
+
+# Numbers as written by the C++ streams of shape4D, including nan and inf
+_number = r'([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?|[-+]?(?:nan|inf))'
+
+_iterationLineExpression = re.compile(
+  r'^Iter (\d+) E = {0} Data = {0} Reg = {0} Step = {0}$'.format(_number))
+
+class iterationRecordStruct(object):
+  def __init__(self):
+    self.iteration = None
+    self.objective = None
+    self.dataTerm = None
+    self.regularityTerm = None
+    self.stepSize = None
+
+def parseIterationLine(line):
+  """ Return an iterationRecordStruct for a line reporting an iteration, None otherwise """
+  match = _iterationLineExpression.match(line.strip())
+  if match is None:
+    return None
+  record = iterationRecordStruct()
+  record.iteration = int(match.group(1))
+  record.objective, record.dataTerm, record.regularityTerm, record.stepSize = [float(value) for value in match.groups()[1:]]
+  return record
+
+def parseShape4DLog(text):
+  records = []
+  numberOfUnrecognizedLines = 0
+  for line in text.splitlines():
+    record = parseIterationLine(line)
+    if record is not None:
+      records.append(record)
+    elif line.startswith('Iter '):
+      numberOfUnrecognizedLines += 1
+  # Iteration lines in another format: the output of shape4D has changed
+  if numberOfUnrecognizedLines > 0:
+    logging.warning('{} lines of the shape4D output start with "Iter" but are not iteration lines'.format(numberOfUnrecognizedLines))
+  return records
+
+def readShape4DLog(logFilePath):
+  with open(logFilePath, errors='replace') as logFile:
+    return parseShape4DLog(logFile.read())
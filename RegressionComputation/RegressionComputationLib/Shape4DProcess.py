@@ -0,0 +1,155 @@
+import logging
+import os
+import shutil
+import subprocess
+import time
+
+from .RegressionParameters import writeInputFiles
+from .Shape4DLog import Shape4DLogFileName
+
+#
+# shape4D run outside of the Slicer CLI infrastructure
+#
+# Used to run regressions from scripts (e.g. PythonSlicer on a compute node)
+# where no CLI module node is available. The status strings are the ones of
+# vtkMRMLCommandLineModuleNode so that both kinds of runs can be handled the
+# same way.
+#
+
+Shape4DExecutableEnvironmentVariable = 'SHAPE4D_EXECUTABLE'
+
+def findShape4DExecutable():
+  executable = os.environ.get(Shape4DExecutableEnvironmentVariable)
+  if executable:
+    return executable
+  return shutil.which('shape4D')
+
+def shape4DCommandLine(executable, XMLdriverfilepath):
+  # The driver file is the only (positional) argument of the CLI
+  return [executable, XMLdriverfilepath]
+
+def threadsEnvironment(numberOfThreads):
+  environment = dict(os.environ)
+  if numberOfThreads:
+    environment['ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS'] = str(numberOfThreads)
+    environment['OMP_NUM_THREADS'] = str(numberOfThreads)
+  return environment
+
+def shape4DProcessStarter(executable=None):
+  """ Function starting a Shape4DProcess of executable (findShape4DExecutable
+  by default) on a driver file with a number of threads, the default way of
+  starting the runs of the sweeps, the multiresolution and the automatic T
+  regressions. Raises ValueError if the executable is not found.
+  """
+  if executable is None:
+    executable = findShape4DExecutable()
+  if executable is None:
+    raise ValueError('shape4D executable not found, set the {} environment variable.'.format(Shape4DExecutableEnvironmentVariable))
+  def startProcess(XMLdriverfilepath, numberOfThreads=None):
+    return Shape4DProcess(executable, XMLdriverfilepath, numberOfThreads=numberOfThreads).start()
+  return startProcess
+
+class Shape4DProcess(object):
+
+  def __init__(self, executable, XMLdriverfilepath, logFilePath=None, numberOfThreads=None):
+    self.executable = executable
+    self.XMLdriverfilepath = XMLdriverfilepath
+    if logFilePath is None:
+      logFilePath = os.path.join(os.path.dirname(XMLdriverfilepath), Shape4DLogFileName)
+    self.logFilePath = logFilePath
+    self.numberOfThreads = numberOfThreads
+    self.process = None
+    self.logFile = None
+    self.cancelled = False
+    self.startTime = None
+    self.endTime = None
+
+  def start(self):
+    logging.info("Running {}".format(' '.join(shape4DCommandLine(self.executable, self.XMLdriverfilepath))))
+    self.logFile = open(self.logFilePath, 'w')
+    self.startTime = time.time()
+    self.process = subprocess.Popen(shape4DCommandLine(self.executable, self.XMLdriverfilepath),
+                                    stdout=self.logFile, stderr=subprocess.STDOUT,
+                                    env=threadsEnvironment(self.numberOfThreads))
+    return self
+
+  @property
+  def pid(self):
+    return self.process.pid if self.process is not None else None
+
+  def isBusy(self):
+    return self.process is not None and self.poll() is None
+
+  def poll(self):
+    returnCode = self.process.poll()
+    if returnCode is not None:
+      self._finish()
+    return returnCode
+
+  def wait(self, timeout=None):
+    returnCode = self.process.wait(timeout)
+    self._finish()
+    return returnCode
+
+  def cancel(self):
+    if not self.isBusy():
+      return
+    self.cancelled = True
+    self.process.terminate()
+    try:
+      self.process.wait(10)
+    except subprocess.TimeoutExpired:
+      self.process.kill()
+      self.process.wait()
+    self._finish()
+
+  def _finish(self):
+    if self.endTime is None:
+      self.endTime = time.time()
+    if self.logFile is not None:
+      self.logFile.close()
+      self.logFile = None
+
+  @property
+  def wallTime(self):
+    if self.startTime is None:
+      return 0.0
+    return (self.endTime or time.time()) - self.startTime
+
+  def statusString(self):
+    if self.process is None:
+      return 'Idle'
+    returnCode = self.process.poll()
+    if returnCode is None:
+      return 'Running'
+    if self.cancelled:
+      return 'Cancelled'
+    if returnCode == 0:
+      return 'Completed'
+    return 'Completed with errors'
+
+def runRegression(parameters, executable=None, wait=True, numberOfThreads=None, resultCache=None):
+  """ Write the input files of the regression in its output directory and run
+  shape4D on them. Returns the Shape4DProcess, finished if wait is True.
+  If a RegressionResultCache is given and holds the results of the same
+  regression, they are restored in the output directory and None is returned.
+  """
+  errorMessage = parameters.checkInputs()
+  if errorMessage is not None:
+    raise ValueError(errorMessage)
+  if executable is None:
+    executable = findShape4DExecutable()
+  if executable is None:
+    raise ValueError('shape4D executable not found, set the {} environment variable.'.format(Shape4DExecutableEnvironmentVariable))
+
+  XMLdriverfilepath = writeInputFiles(parameters)
+  if resultCache is not None:
+    resultCacheKey = resultCache.key(parameters)
+    if resultCache.restore(parameters, resultCacheKey) is not None:
+      return None
+  process = Shape4DProcess(executable, XMLdriverfilepath, numberOfThreads=numberOfThreads).start()
+  if wait:
+    process.wait()
+    if resultCache is not None and process.statusString() == 'Completed':
+      resultCache.store(parameters, resultCacheKey)
+  return process
@@ -0,0 +1,113 @@
+import json
+import logging
+import os
+import time
+
+from .ShapeScan import shapeMetadataStruct
+
+#
+# Persistent cache of the shape metadata
+#
+# The metadata read during the scan of an input directory are stored in a JSON
+# index keyed by the absolute path of each shape. An entry is only used if the
+# size and the modification time of the file did not change since it was read.
+#
+
+_cacheVersion = 1
+
+_metadataAttributes = ('bounds', 'numberOfPoints', 'numberOfCells', 'sigmaW', 'timePoint')
+
+class ShapeMetadataCache(object):
+
+  def __init__(self, cacheFilePath, maximumNumberOfEntries=100000):
+    self.cacheFilePath = cacheFilePath
+    self.maximumNumberOfEntries = maximumNumberOfEntries
+    self.entries = dict()
+    self.modified = False
+    self.load()
+
+  def load(self):
+    self.entries = dict()
+    self.modified = False
+    if not os.path.exists(self.cacheFilePath):
+      return
+    try:
+      with open(self.cacheFilePath) as cacheFile:
+        content = json.load(cacheFile)
+      if content.get('version') == _cacheVersion:
+        self.entries = content['entries']
+    except (OSError, ValueError, KeyError) as e:
+      logging.warning("Ignoring the shape metadata cache {}: {}".format(self.cacheFilePath, e))
+
+  def save(self):
+    if not self.modified:
+      return
+    self.evict()
+    cacheDirectory = os.path.dirname(self.cacheFilePath)
+    if cacheDirectory and not os.path.exists(cacheDirectory):
+      os.makedirs(cacheDirectory)
+    # Write to a temporary file first so that the cache is never left half written
+    temporaryFilePath = self.cacheFilePath + '.tmp'
+    with open(temporaryFilePath, 'w') as cacheFile:
+      json.dump({'version': _cacheVersion, 'entries': self.entries}, cacheFile)
+    os.replace(temporaryFilePath, self.cacheFilePath)
+    self.modified = False
+
+  def get(self, shapeFilePath):
+    """ Return the cached metadata of the shape or None if it is unknown or out of date """
+    key = os.path.abspath(shapeFilePath)
+    entry = self.entries.get(key)
+    if entry is None:
+      return None
+    try:
+      fileStat = os.stat(shapeFilePath)
+    except OSError:
+      return None
+    if entry['size'] != fileStat.st_size or entry['mtime'] != fileStat.st_mtime_ns:
+      return None
+    entry['lastAccess'] = time.time()
+    self.modified = True
+
+    metadata = shapeMetadataStruct()
+    metadata.filePath = shapeFilePath
+    metadata.rootname = os.path.splitext(os.path.basename(shapeFilePath))[0]
+    for attribute in _metadataAttributes:
+      setattr(metadata, attribute, entry[attribute])
+    metadata.bounds = tuple(metadata.bounds)
+    return metadata
+
+  def put(self, metadata):
+    try:
+      fileStat = os.stat(metadata.filePath)
+    except OSError:
+      return
+    entry = {
+      'size': fileStat.st_size,
+      'mtime': fileStat.st_mtime_ns,
+      'lastAccess': time.time(),
+    }
+    for attribute in _metadataAttributes:
+      entry[attribute] = getattr(metadata, attribute)
+    self.entries[os.path.abspath(metadata.filePath)] = entry
+    self.modified = True
+
+  def evict(self):
+    """ Drop the least recently used entries above the maximum number of entries """
+    numberOfEntriesToRemove = len(self.entries) - self.maximumNumberOfEntries
+    if numberOfEntriesToRemove <= 0:
+      return
+    leastRecentlyUsed = sorted(self.entries, key=lambda key: self.entries[key]['lastAccess'])
+    for key in leastRecentlyUsed[:numberOfEntriesToRemove]:
+      del self.entries[key]
+    self.modified = True
+
+  def invalidate(self, directory=None):
+    """ Forget the entries of the shapes in the directory, or all of them """
+    if directory is None:
+      self.entries = dict()
+    else:
+      directory = os.path.join(os.path.abspath(directory), '')
+      for key in [key for key in self.entries if key.startswith(directory)]:
+        del self.entries[key]
+    self.modified = True
+    self.save()
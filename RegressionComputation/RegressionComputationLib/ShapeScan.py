@@ -0,0 +1,159 @@
+import concurrent.futures
+import logging
+import os
+import queue
+import re
+
+import vtk
+
+from .LegacyVTKReader import readLegacyVTKInformation
+
+#
+# Scan of an input shapes directory
+#
+# Reading the shapes is the expensive part of populating the input parameters
+# table, so it is done in a pool of workers and the results are handed back to
+# the GUI thread, which is the only one allowed to touch the widgets.
+#
+
+class shapeMetadataStruct(object):
+  def __init__(self):
+    self.filePath = None
+    self.rootname = None
+    self.bounds = None
+    self.numberOfPoints = None
+    self.numberOfCells = None
+    self.sigmaW = None
+    self.timePoint = None
+
+def listInputShapes(inputShapesDirectory):
+  shapeFilePaths = []
+  for curFile in sorted(os.listdir(inputShapesDirectory)):
+    if curFile.endswith(".vtk"):
+      shapeFilePaths.append(os.path.join(inputShapesDirectory, curFile))
+  return shapeFilePaths
+
+def defaultNumberOfWorkers():
+  return max(1, min(32, (os.cpu_count() or 1)))
+
+def timePointFromFilename(filename):
+  # We assume the final number in the filename is the time point
+  numsInFilename = re.findall(r'[-+]?\d*\.\d+|\d+', os.path.basename(filename))
+  if len(numsInFilename) > 0:
+    return float(numsInFilename[-1])
+  return 0.0
+
+def sigmaWFromBounds(shapeBounds):
+  # The default kernel width is half of the smallest extent of the shape
+  xRange = shapeBounds[1] - shapeBounds[0]
+  yRange = shapeBounds[3] - shapeBounds[2]
+  zRange = shapeBounds[5] - shapeBounds[4]
+  smallestRange = min(xRange, yRange, zRange)
+  return int(smallestRange*0.50)
+
+def readShapeMetadata(shapeFilePath):
+  metadata = shapeMetadataStruct()
+  metadata.filePath = shapeFilePath
+  metadata.rootname = os.path.splitext(os.path.basename(shapeFilePath))[0]
+  metadata.timePoint = timePointFromFilename(shapeFilePath)
+
+  # Only the points are needed: try to get them without parsing the whole shape
+  information = readLegacyVTKInformation(shapeFilePath)
+  if information is not None and information.numberOfCells is not None:
+    metadata.numberOfPoints = information.numberOfPoints
+    metadata.bounds = information.bounds
+    metadata.numberOfCells = information.numberOfCells
+  else:
+    polyReader = vtk.vtkPolyDataReader()
+    polyReader.SetFileName(shapeFilePath)
+    polyReader.Update()
+    shape = polyReader.GetOutput()
+    metadata.numberOfPoints = shape.GetNumberOfPoints()
+    metadata.numberOfCells = shape.GetNumberOfCells()
+    metadata.bounds = tuple(shape.GetBounds())
+
+  metadata.sigmaW = sigmaWFromBounds(metadata.bounds)
+  return metadata
+
+class ShapeDirectoryScanner(object):
+  """ Read the metadata of a list of shapes in a pool of worker threads.
+
+  The results are queued as each shape is read; the owner polls them with
+  takeFinished() from its own thread. The shapes read before a cancellation
+  are still taken; the others are counted in numberOfNotRead.
+  """
+
+  def __init__(self, numberOfWorkers=None, readFunction=readShapeMetadata):
+    self.numberOfWorkers = numberOfWorkers or defaultNumberOfWorkers()
+    self.readFunction = readFunction
+    self.executor = None
+    self.finishedQueue = queue.Queue()
+    self.numberOfShapes = 0
+    self.numberOfCompleted = 0
+    self.numberOfFailed = 0
+    self.cancelled = False
+
+  @property
+  def numberOfNotRead(self):
+    """ Number of shapes not read, or not taken yet, e.g. after a cancellation """
+    return self.numberOfShapes - self.numberOfCompleted
+
+  def reset(self):
+    """ Cancel the scan and clear its counts. Returns the metadata of the
+    shapes read and not taken yet.
+    """
+    self.cancel()
+    finished = self.takeFinished()
+    self.finishedQueue = queue.Queue()
+    self.numberOfShapes = 0
+    self.numberOfCompleted = 0
+    self.numberOfFailed = 0
+    self.cancelled = False
+    return finished
+
+  def start(self, shapeFilePaths):
+    finished = self.reset()
+    if len(finished) > 0:
+      logging.warning("{} shape(s) read by the previous scan were not taken".format(len(finished)))
+    self.numberOfShapes = len(shapeFilePaths)
+    self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.numberOfWorkers)
+    finishedQueue = self.finishedQueue
+    for shapeFilePath in shapeFilePaths:
+      future = self.executor.submit(self.readFunction, shapeFilePath)
+      future.shapeFilePath = shapeFilePath
+      future.add_done_callback(lambda f, q=finishedQueue: q.put(f))
+
+  def takeFinished(self):
+    """ Return the metadata of the shapes read since the last call """
+    finished = []
+    while True:
+      try:
+        future = self.finishedQueue.get_nowait()
+      except queue.Empty:
+        break
+      if future.cancelled():
+        continue
+      self.numberOfCompleted += 1
+      exception = future.exception()
+      if exception is not None:
+        self.numberOfFailed += 1
+        logging.error("Unable to read {}: {}".format(future.shapeFilePath, exception))
+        continue
+      finished.append(future.result())
+    if self.executor is not None and self.numberOfCompleted >= self.numberOfShapes:
+      self.executor.shutdown(wait=False)
+      self.executor = None
+    return finished
+
+  def isRunning(self):
+    return self.executor is not None
+
+  def cancel(self):
+    """ Stop reading the shapes. The shapes being read are waited for, so
+    that all the shapes read are then returned by takeFinished().
+    """
+    if self.executor is None:
+      return
+    self.cancelled = True
+    self.executor.shutdown(wait=True, cancel_futures=True)
+    self.executor = None
@@ -0,0 +1,269 @@
+import concurrent.futures
+import json
+import logging
+import mmap
+import os
+import struct
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from .Multiresolution import readPolyData
+from .RegressionResultCache import finalShapeFilePaths
+from .ShapeScan import defaultNumberOfWorkers
+
+#
+# Single file container of a regressed trajectory
+#
+# shape4D writes one legacy VTK file per time step, all with the same cells.
+# The container packs them in one file holding the cells once, the points of
+# all the time steps as one (T, N, 3) float32 block, the point data arrays as
+# (T, N, C) blocks and the time values. The file is a small JSON header
+# followed by raw little endian blocks aligned on 64 bytes, so that the blocks
+# are read directly from a memory map of the file without copy.
+#
+# With quantization, the points are stored as the first time step followed by
+# the 16 bit quantized displacements from one time step to the next, each with
+# its own scale. The displacements are quantized from the decoded previous
+# time step, so that the error does not accumulate along the trajectory. The
+# points are then decoded when loaded.
+#
+
+TrajectoryFileExtension = '.s4dt'
+
+_magic = b'S4DTRAJ\0'
+_version = 1
+_alignment = 64
+# Cell types of vtkPolyData, stored in the legacy layout (n, id_0, ..., id_n-1)
+_cellTypes = ('Verts', 'Lines', 'Polys', 'Strips')
+# NumPy type of vtkIdType, 32 or 64 bits depending on the build of VTK
+_idType = np.dtype(numpy_support.get_vtk_to_numpy_typemap()[vtk.VTK_ID_TYPE])
+
+def _readShape(shapeFilePath):
+  polyData = readPolyData(shapeFilePath)
+  points = numpy_support.vtk_to_numpy(polyData.GetPoints().GetData())
+  pointData = dict()
+  for index in range(polyData.GetPointData().GetNumberOfArrays()):
+    array = polyData.GetPointData().GetArray(index)
+    if array is not None and array.GetName():
+      values = numpy_support.vtk_to_numpy(array)
+      pointData[array.GetName()] = values.reshape(len(points), -1)
+  return polyData, points, pointData
+
+def _legacyCells(cellArray):
+  return numpy_support.vtk_to_numpy(cellArray.GetData()).astype('<i8')
+
+class _BlockWriter(object):
+  """ Lay out the blocks of the container after its header """
+
+  def __init__(self):
+    self.blocks = []
+    self.size = 0
+
+  def add(self, array):
+    array = np.ascontiguousarray(array)
+    array = array.astype(array.dtype.newbyteorder('<'), copy=False)
+    self.size = -(-self.size // _alignment) * _alignment
+    description = {'offset': self.size, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+    self.blocks.append((self.size, array))
+    self.size += array.nbytes
+    return description
+
+def quantizeTrajectory(points):
+  """ First time step and 16 bit displacements between the time steps, with their scales """
+  scales = np.ones(len(points) - 1)
+  displacements = np.zeros((len(points) - 1,) + points.shape[1:], dtype=np.int16)
+  decoded = points[0].astype(np.float64)
+  for timeStep in range(1, len(points)):
+    displacement = points[timeStep] - decoded
+    maximumDisplacement = np.abs(displacement).max()
+    if maximumDisplacement > 0:
+      scales[timeStep - 1] = maximumDisplacement / 32767.0
+    displacements[timeStep - 1] = np.rint(displacement / scales[timeStep - 1])
+    decoded = decoded + displacements[timeStep - 1] * scales[timeStep - 1]
+  return points[0].astype(np.float32), displacements, scales
+
+def dequantizeTrajectory(firstPoints, displacements, scales):
+  steps = displacements * scales[:, None, None]
+  points = np.empty((len(displacements) + 1,) + firstPoints.shape, dtype=np.float32)
+  points[0] = firstPoints
+  points[1:] = firstPoints + np.cumsum(steps, axis=0)
+  return points
+
+def packTrajectory(shapeFilePaths, containerFilePath, timeValues=None, quantize=False, numberOfWorkers=None):
+  """ Pack the shapes of a trajectory, all with the same cells, in a single
+  container file. Returns the path of the container.
+  """
+  if len(shapeFilePaths) == 0:
+    raise ValueError('No shape to pack in {}.'.format(containerFilePath))
+  if timeValues is None:
+    timeValues = range(len(shapeFilePaths))
+  with concurrent.futures.ThreadPoolExecutor(max_workers=numberOfWorkers or defaultNumberOfWorkers()) as executor:
+    shapes = list(executor.map(_readShape, shapeFilePaths))
+  referenceShape, referencePoints, referencePointData = shapes[0]
+  for shapeFilePath, (polyData, points, pointData) in zip(shapeFilePaths, shapes):
+    if points.shape != referencePoints.shape:
+      raise ValueError('{} does not have the points of {}.'.format(shapeFilePath, shapeFilePaths[0]))
+  # Only the arrays of every time step are kept
+  arrayNames = [name for name in referencePointData
+                if all(name in pointData and pointData[name].shape == referencePointData[name].shape
+                       for polyData, points, pointData in shapes)]
+
+  blockWriter = _BlockWriter()
+  header = {
+    'version': _version,
+    'numberOfTimeSteps': len(shapes),
+    'numberOfPoints': len(referencePoints),
+    'times': blockWriter.add(np.asarray(list(timeValues), dtype=np.float64)),
+    'cells': dict(),
+    'pointData': dict(),
+  }
+  for cellType in _cellTypes:
+    cellArray = getattr(referenceShape, 'Get' + cellType)()
+    if cellArray.GetNumberOfCells() > 0:
+      header['cells'][cellType] = {'numberOfCells': cellArray.GetNumberOfCells(),
+                                   'legacyCells': blockWriter.add(_legacyCells(cellArray))}
+  points = np.stack([shapePoints for polyData, shapePoints, pointData in shapes])
+  if quantize and len(shapes) > 1:
+    firstPoints, displacements, scales = quantizeTrajectory(points)
+    header['points'] = {'encoding': 'delta16', 'first': blockWriter.add(firstPoints),
+                        'displacements': blockWriter.add(displacements), 'scales': blockWriter.add(scales)}
+  else:
+    header['points'] = {'encoding': 'raw', 'block': blockWriter.add(points.astype(np.float32))}
+  for name in arrayNames:
+    values = np.stack([pointData[name] for polyData, shapePoints, pointData in shapes])
+    if values.dtype == np.float64:
+      values = values.astype(np.float32)
+    header['pointData'][name] = blockWriter.add(values)
+
+  headerBytes = json.dumps(header).encode()
+  dataStart = -(-(len(_magic) + 8 + len(headerBytes)) // _alignment) * _alignment
+  temporaryFilePath = containerFilePath + '.tmp'
+  with open(temporaryFilePath, 'wb') as containerFile:
+    containerFile.write(_magic)
+    containerFile.write(struct.pack('<Q', dataStart))
+    containerFile.write(headerBytes)
+    for offset, array in blockWriter.blocks:
+      containerFile.seek(dataStart + offset)
+      containerFile.write(array.tobytes())
+    containerFile.truncate(dataStart + blockWriter.size)
+  os.replace(temporaryFilePath, containerFilePath)
+  return containerFilePath
+
+def packRegressionOutputs(outputDirectory, outputPrefix, t0=None, tn=None, quantize=False, containerFilePath=None):
+  """ Pack the final shapes of a regression in its output directory. The time
+  values are evenly spaced between t0 and tn if they are given.
+  Returns the path of the container.
+  """
+  shapeFilePaths = finalShapeFilePaths(outputDirectory, outputPrefix)
+  if containerFilePath is None:
+    containerFilePath = os.path.join(outputDirectory, outputPrefix + 'trajectory' + TrajectoryFileExtension)
+  timeValues = None
+  if t0 is not None and tn is not None:
+    timeValues = np.linspace(t0, tn, len(shapeFilePaths))
+  packTrajectory(shapeFilePaths, containerFilePath, timeValues, quantize)
+  shapesSize = sum(os.path.getsize(shapeFilePath) for shapeFilePath in shapeFilePaths)
+  logging.info("Packed {} shapes ({:.1f} MB) in {} ({:.1f} MB)".format(
+    len(shapeFilePaths), shapesSize / 1024.0 ** 2, containerFilePath, os.path.getsize(containerFilePath) / 1024.0 ** 2))
+  return containerFilePath
+
+class TrajectoryContainer(object):
+  """ Trajectory of a container file. The arrays are views of a memory map of
+  the file, valid until the container is closed.
+  """
+
+  def __init__(self, containerFilePath):
+    self.filePath = containerFilePath
+    self._file = open(containerFilePath, 'rb')
+    # Copy on write: the arrays are writable, as VTK expects, but the file is never modified
+    self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_COPY)
+    if self._mmap[:len(_magic)] != _magic:
+      self.close()
+      raise ValueError('{} is not a trajectory container.'.format(containerFilePath))
+    self._dataStart = struct.unpack('<Q', self._mmap[len(_magic):len(_magic) + 8])[0]
+    self.header = json.loads(self._mmap[len(_magic) + 8:self._dataStart].rstrip(b'\0').decode())
+    if self.header['version'] > _version:
+      self.close()
+      raise ValueError('{} was written by a newer version (version {}).'.format(containerFilePath, self.header['version']))
+    self._points = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def close(self):
+    # The views of the arrays have to be released before the map is closed
+    self._points = None
+    if self._mmap is not None:
+      try:
+        self._mmap.close()
+      except BufferError:
+        logging.debug("{} is still in use, it is closed with its last array".format(self.filePath))
+      self._mmap = None
+    if self._file is not None:
+      self._file.close()
+      self._file = None
+
+  def _block(self, description):
+    return np.frombuffer(self._mmap, dtype=np.dtype(description['dtype']), count=int(np.prod(description['shape'])),
+                         offset=self._dataStart + description['offset']).reshape(description['shape'])
+
+  @property
+  def numberOfTimeSteps(self):
+    return self.header['numberOfTimeSteps']
+
+  @property
+  def numberOfPoints(self):
+    return self.header['numberOfPoints']
+
+  @property
+  def times(self):
+    return self._block(self.header['times'])
+
+  @property
+  def points(self):
+    """ Points of all the time steps, (T, N, 3), decoded once if they are quantized """
+    if self._points is None:
+      description = self.header['points']
+      if description['encoding'] == 'raw':
+        self._points = self._block(description['block'])
+      else:
+        self._points = dequantizeTrajectory(self._block(description['first']), self._block(description['displacements']),
+                                            self._block(description['scales']))
+    return self._points
+
+  @property
+  def pointDataNames(self):
+    return list(self.header['pointData'].keys())
+
+  def pointData(self, name):
+    """ Values of a point data array at all the time steps, (T, N, C) """
+    return self._block(self.header['pointData'][name])
+
+  def cells(self, cellType='Polys'):
+    """ Cells in the legacy layout (n, id_0, ..., id_n-1), or None if there are none of this type """
+    description = self.header['cells'].get(cellType)
+    return self._block(description['legacyCells']) if description is not None else None
+
+  def polyData(self, timeStep):
+    """ vtkPolyData of a time step, sharing the memory of the container when possible """
+    polyData = vtk.vtkPolyData()
+    points = vtk.vtkPoints()
+    points.SetData(numpy_support.numpy_to_vtk(self.points[timeStep], deep=False))
+    polyData.SetPoints(points)
+    for cellType, description in self.header['cells'].items():
+      legacyCells = self._block(description['legacyCells'])
+      if _idType != legacyCells.dtype:
+        legacyCells = legacyCells.astype(_idType)
+      cellArray = vtk.vtkCellArray()
+      cellArray.SetCells(description['numberOfCells'], numpy_support.numpy_to_vtkIdTypeArray(legacyCells, deep=False))
+      getattr(polyData, 'Set' + cellType)(cellArray)
+    for name in self.pointDataNames:
+      values = self.pointData(name)[timeStep]
+      array = numpy_support.numpy_to_vtk(values if values.shape[1] > 1 else values[:, 0], deep=False)
+      array.SetName(name)
+      polyData.GetPointData().AddArray(array)
+    return polyData
@@ -0,0 +1,95 @@
+import glob
+import json
+import os
+import re
+
+from .Shape4DLog import Shape4DLogFileName, readShape4DLog
+
+#
+# Initialization of a regression with the solution of a previous one
+#
+# shape4D can start the optimization from the initial velocity field (V0) of a
+# previous regression instead of zero. The previous regression is given by its
+# output directory, or by a directory of the result cache, in which its V0 file
+# is looked for. The number of iterations of the cold start is kept with each
+# warm started regression so that the iterations saved can be reported.
+#
+
+WarmStartRecordFileName = 'warmStart.json'
+
+_initialVelocityExpression = re.compile(r'(^|[^a-z0-9])v0([^a-z0-9]|$)', re.IGNORECASE)
+
+def isInitialVelocityFile(filePath):
+  return _initialVelocityExpression.search(os.path.splitext(os.path.basename(filePath))[0]) is not None
+
+def findInitialVelocityFile(directory):
+  """ Return the V0 file of the regression in the directory, the final one if
+  several were saved, or None if there is none.
+  """
+  filePaths = [filePath for filePath in glob.glob(os.path.join(directory, '*.vtk')) if isInitialVelocityFile(filePath)]
+  if len(filePaths) == 0:
+    return None
+  finalFilePaths = [filePath for filePath in filePaths if 'final' in os.path.basename(filePath).lower()]
+  if len(finalFilePaths) > 0:
+    return sorted(finalFilePaths)[-1]
+  # Otherwise the progress snapshot of the latest iteration
+  return max(filePaths, key=lambda filePath: [int(number) for number in re.findall(r'\d+', os.path.basename(filePath))])
+
+def setWarmStart(parameters, previousDirectory, v0weight=1.0):
+  """ Initialize the regression with the V0 of the regression in previousDirectory.
+  Raises ValueError if no V0 file is found.
+  """
+  initV0 = findInitialVelocityFile(previousDirectory)
+  if initV0 is None:
+    raise ValueError('No initial velocity (V0) file found in {}.'.format(previousDirectory))
+  parameters.useInitV0 = True
+  parameters.initV0 = initV0
+  parameters.v0weight = v0weight
+  return initV0
+
+def numberOfIterations(outputDirectory):
+  """ Number of iterations of the regression in the directory, from its shape4D log """
+  try:
+    records = readShape4DLog(os.path.join(outputDirectory, Shape4DLogFileName))
+  except OSError:
+    return None
+  if len(records) == 0:
+    return None
+  return records[-1].iteration
+
+def coldStartIterations(outputDirectory):
+  """ Number of iterations of the cold start at the origin of the regression in the directory """
+  try:
+    with open(os.path.join(outputDirectory, WarmStartRecordFileName)) as recordFile:
+      return json.load(recordFile)['coldStartIterations']
+  except (OSError, ValueError, KeyError):
+    return numberOfIterations(outputDirectory)
+
+def writeWarmStartRecord(parameters):
+  previousDirectory = os.path.dirname(parameters.initV0)
+  record = {
+    'initV0': parameters.initV0,
+    'v0weight': parameters.v0weight,
+    'previousDirectory': previousDirectory,
+    'coldStartIterations': coldStartIterations(previousDirectory),
+  }
+  recordFilePath = os.path.join(parameters.outputDirectory, WarmStartRecordFileName)
+  with open(recordFilePath, 'w') as recordFile:
+    json.dump(record, recordFile, indent=2)
+  return recordFilePath
+
+def warmStartReport(outputDirectory):
+  """ Iterations of the warm started regression in the directory compared with
+  its cold start, or None if it was not warm started.
+  """
+  try:
+    with open(os.path.join(outputDirectory, WarmStartRecordFileName)) as recordFile:
+      record = json.load(recordFile)
+  except (OSError, ValueError):
+    return None
+  record['iterations'] = numberOfIterations(outputDirectory)
+  if record['iterations'] is not None and record.get('coldStartIterations') is not None:
+    record['iterationsSaved'] = record['coldStartIterations'] - record['iterations']
+  else:
+    record['iterationsSaved'] = None
+  return record
@@ -0,0 +1,97 @@
+import csv
+import os
+import unittest
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from TestUtilities import TemporaryDirectoryTestCase, sphere
+from RegressionComputationLib.InputValidation import validateInputs, validateShape
+from RegressionComputationLib.RegressionParameters import RegressionParameters, regressionInputStruct
+
+#
+# Validation of the input shapes of a regression
+#
+
+class InputValidationTest(TemporaryDirectoryTestCase):
+
+  def issueCodes(self, validation):
+    return [(issue.severity, issue.code) for issue in validation.issues]
+
+  def test_validShape(self):
+    validation = validateShape(self.writeShape(sphere(2.0), 'sphere.vtk'))
+    self.assertEqual(validation.status, 'ok')
+    self.assertEqual(validation.numberOfPoints, 50)
+    self.assertAlmostEqual(validation.scale, 2.0, places=5)
+
+  def test_invalidShapes(self):
+    self.assertEqual(self.issueCodes(validateShape(os.path.join(self.directory, 'missing.vtk'))), [('error', 'missing')])
+
+    emptyFilePath = os.path.join(self.directory, 'empty.vtk')
+    open(emptyFilePath, 'w').close()
+    self.assertEqual(self.issueCodes(validateShape(emptyFilePath)), [('error', 'empty')])
+
+    shape = sphere()
+    numpy_support.vtk_to_numpy(shape.GetPoints().GetData())[3] = np.nan
+    shape.GetPoints().Modified()
+    self.assertEqual(self.issueCodes(validateShape(self.writeShape(shape, 'nan.vtk'))), [('error', 'nan')])
+
+    plane = vtk.vtkPlaneSource()
+    plane.SetResolution(2, 2)
+    plane.Update()
+    validation = validateShape(self.writeShape(plane.GetOutput(), 'quads.vtk'))
+    self.assertEqual(self.issueCodes(validation), [('error', 'cells')])
+    self.assertIn('4 of 4 cells are not triangles', validation.issues[0].message)
+
+    # Two points of a triangle at the same position
+    shape = sphere()
+    points = numpy_support.vtk_to_numpy(shape.GetPoints().GetData())
+    triangle = numpy_support.vtk_to_numpy(shape.GetPolys().GetData())[1:4]
+    points[triangle[1]] = points[triangle[0]]
+    shape.GetPoints().Modified()
+    self.assertIn(('warning', 'degenerate'), self.issueCodes(validateShape(self.writeShape(shape, 'degenerate.vtk'))))
+
+  def test_validateInputs(self):
+    parameters = RegressionParameters()
+    parameters.t0 = 0.0
+    parameters.tn = 2.0
+    unitSphere = self.writeShape(sphere(), 'sphere.vtk')
+    otherSphere = self.writeShape(sphere(1.2), 'otherSphere.vtk')
+    largeSphere = self.writeShape(sphere(30.0), 'largeSphere.vtk')
+    parameters.inputs = [regressionInputStruct(unitSphere, 0.0),
+                         regressionInputStruct(otherSphere, 1.0),
+                         regressionInputStruct(otherSphere, 1.0),
+                         regressionInputStruct(largeSphere, 2.0, sigmaW=0.0),
+                         regressionInputStruct(unitSphere, 3.0, weight=-1.0)]
+    report = validateInputs(parameters, numberOfWorkers=2)
+    self.assertTrue(report.hasErrors)
+    self.assertEqual([shape.status for shape in report.shapes], ['ok', 'error', 'error', 'error', 'error'])
+    self.assertEqual(self.issueCodes(report.shapes[1]), [('error', 'duplicate')])
+    self.assertEqual(self.issueCodes(report.shapes[3]), [('error', 'sigmaW'), ('error', 'scale')])
+    self.assertEqual(self.issueCodes(report.shapes[4]), [('error', 'weight'), ('warning', 'timePoint')])
+    self.assertEqual(report.issues, [])
+
+    reportFilePath = report.writeReport(os.path.join(self.directory, 'inputValidation.csv'))
+    with open(reportFilePath) as csvfile:
+      rows = list(csv.DictReader(csvfile))
+    self.assertEqual(len(rows), 5)
+    self.assertEqual(rows[0]['status'], 'ok')
+    self.assertIn('listed 2 times', rows[1]['issues'])
+
+  def test_timePoints(self):
+    parameters = RegressionParameters()
+    unitSphere = self.writeShape(sphere(), 'sphere.vtk')
+    otherSphere = self.writeShape(sphere(1.1), 'otherSphere.vtk')
+    parameters.inputs = [regressionInputStruct(unitSphere, 1.0), regressionInputStruct(otherSphere, 1.0)]
+    report = validateInputs(parameters)
+    self.assertEqual([(issue.severity, issue.code) for issue in report.issues], [('error', 'timePoint')])
+
+    parameters.inputs.append(regressionInputStruct(unitSphere, 2.0))
+    report = validateInputs(parameters)
+    self.assertFalse(report.hasErrors)
+    self.assertEqual([(issue.severity, issue.code) for issue in report.issues], [('warning', 'timePoint')])
+    self.assertIn('the source is the first one', report.text())
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,136 @@
+import os
+import socket
+import subprocess
+import sys
+import unittest
+
+from TestUtilities import TemporaryDirectoryTestCase
+from RegressionComputationLib.JobQueue import JobQueue, JobRunner
+from RegressionComputationLib.RegressionParameters import RegressionParameters, regressionInputStruct
+
+#
+# Claim, cancellation and requeue of the jobs of a queue, with processes
+# standing for shape4D
+#
+
+class _FakeProcess(object):
+  def __init__(self):
+    self.finished = False
+    self.cancelled = False
+
+  def poll(self):
+    return 0 if self.finished or self.cancelled else None
+
+  def statusString(self):
+    return 'Cancelled' if self.cancelled else 'Completed'
+
+  def cancel(self):
+    self.cancelled = True
+
+class JobQueueTest(TemporaryDirectoryTestCase):
+
+  def setUp(self):
+    TemporaryDirectoryTestCase.setUp(self)
+    self.queue = JobQueue(os.path.join(self.directory, 'queue.sqlite'))
+    self.parameters = RegressionParameters()
+    self.parameters.inputs = [regressionInputStruct('shape_00.vtk', 0.0), regressionInputStruct('shape_01.vtk', 1.0)]
+    self.parameters.outputDirectory = self.directory
+
+  def tearDown(self):
+    self.queue.close()
+    TemporaryDirectoryTestCase.tearDown(self)
+
+  def test_submit(self):
+    job = self.queue.submit(self.parameters, name='first')
+    self.assertEqual(job.status, 'Queued')
+    self.assertEqual(job.name, 'first')
+    self.assertEqual(job.parameters.outputDirectory, os.path.join(self.directory, 'Jobs', 'job_0001'))
+    self.assertEqual([regressionInput.shapePath for regressionInput in job.parameters.inputs], ['shape_00.vtk', 'shape_01.vtk'])
+    # The parameters of the caller are not modified
+    self.assertEqual(self.parameters.outputDirectory, self.directory)
+    self.parameters.inputs = self.parameters.inputs[:1]
+    with self.assertRaises(ValueError):
+      self.queue.submit(self.parameters)
+
+  def test_claimNextJob(self):
+    low = self.queue.submit(self.parameters, priority=0)
+    high = self.queue.submit(self.parameters, priority=5)
+    last = self.queue.submit(self.parameters, priority=0)
+    job = self.queue.claimNextJob('owner', maximumRunningJobs=2)
+    self.assertEqual(job.id, high.id)
+    self.assertEqual(job.status, 'Running')
+    self.assertEqual(job.owner, 'owner')
+    self.assertEqual(job.attempts, 1)
+    self.assertEqual(self.queue.claimNextJob('other', maximumRunningJobs=2).id, low.id)
+    # The limit counts the jobs running in all the processes
+    self.assertIsNone(self.queue.claimNextJob('owner', maximumRunningJobs=2))
+    self.queue.finishJob(high.id, 'Completed')
+    self.assertTrue(self.queue.job(high.id).isFinished)
+    self.assertEqual(self.queue.claimNextJob('owner', maximumRunningJobs=2).id, last.id)
+    self.assertIsNone(self.queue.claimNextJob('owner', maximumRunningJobs=3))
+
+  def test_requeueJob(self):
+    job = self.queue.submit(self.parameters)
+    self.queue.claimNextJob('owner', 1)
+    self.queue.requeueJob(job.id)
+    job = self.queue.job(job.id)
+    self.assertEqual(job.status, 'Queued')
+    self.assertIsNone(job.owner)
+    job = self.queue.claimNextJob('owner', 1)
+    self.assertEqual(job.attempts, 2)
+
+  def test_recoverJobs(self):
+    job = self.queue.submit(self.parameters)
+    # A process of this host that exited
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    self.queue.claimNextJob('{}:{}'.format(socket.gethostname(), process.pid), 1)
+    self.queue.close()
+    self.queue = JobQueue(os.path.join(self.directory, 'queue.sqlite'))
+    self.assertEqual(self.queue.job(job.id).status, 'Queued')
+
+  def test_cancel(self):
+    queued = self.queue.submit(self.parameters)
+    running = self.queue.submit(self.parameters, priority=1)
+    self.queue.claimNextJob('owner', 1)
+    self.queue.cancel(queued.id)
+    self.queue.cancel(running.id)
+    self.assertEqual(self.queue.job(queued.id).status, 'Cancelled')
+    self.assertEqual(self.queue.job(running.id).status, 'Running')
+    self.assertEqual(self.queue.cancelRequestedJobIds('owner'), [running.id])
+    self.assertEqual(self.queue.cancelRequestedJobIds('other'), [])
+    self.queue.retry(queued.id)
+    self.assertEqual(self.queue.job(queued.id).status, 'Queued')
+
+  def test_JobRunner(self):
+    processes = dict()
+    def startJob(job):
+      processes[job.id] = _FakeProcess()
+      return processes[job.id]
+    first = self.queue.submit(self.parameters)
+    second = self.queue.submit(self.parameters)
+    runner = JobRunner(self.queue, maximumRunningJobs=1, startJob=startJob)
+    self.assertTrue(runner.poll())
+    self.assertEqual(list(processes), [first.id])
+    processes[first.id].finished = True
+    self.assertTrue(runner.poll())
+    self.assertEqual(self.queue.job(first.id).status, 'Completed')
+    self.assertEqual(list(processes), [first.id, second.id])
+
+    # Cancellation requested in the queue, applied by the runner
+    self.queue.cancel(second.id)
+    runner.poll()
+    self.assertTrue(processes[second.id].cancelled)
+    self.assertFalse(runner.poll())
+    self.assertEqual(self.queue.job(second.id).status, 'Cancelled')
+
+    # A stopped runner queues its jobs again
+    third = self.queue.submit(self.parameters)
+    runner.poll()
+    runner.stop()
+    self.assertTrue(processes[third.id].cancelled)
+    self.assertEqual(self.queue.job(third.id).status, 'Queued')
+    self.assertFalse(runner.isRunning())
+
+if __name__ == '__main__':
+  unittest.main()
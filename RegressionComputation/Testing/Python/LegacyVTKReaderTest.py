@@ -0,0 +1,82 @@
+import os
+import unittest
+
+import vtk
+
+from TestUtilities import TemporaryDirectoryTestCase, sphere
+from RegressionComputationLib.LegacyVTKReader import readLegacyVTKInformation
+
+#
+# Header-only reader of legacy VTK files, against the bounds and the number of
+# cells given by VTK
+#
+
+class LegacyVTKReaderTest(TemporaryDirectoryTestCase):
+
+  def setUp(self):
+    TemporaryDirectoryTestCase.setUp(self)
+    # Lines as well, to count the cells of every section
+    append = vtk.vtkAppendPolyData()
+    append.AddInputData(sphere(5.0, center=(1.0, -2.0, 3.0)))
+    line = vtk.vtkLineSource()
+    line.SetPoint1(-10.0, 0.0, 0.0)
+    line.SetPoint2(10.0, 0.0, 0.0)
+    line.Update()
+    append.AddInputData(line.GetOutput())
+    append.Update()
+    self.polyData = append.GetOutput()
+
+  def writeLegacyFile(self, fileName, binary, fileVersion=None):
+    filePath = os.path.join(self.directory, fileName)
+    writer = vtk.vtkPolyDataWriter()
+    writer.SetFileName(filePath)
+    writer.SetInputData(self.polyData)
+    if binary:
+      writer.SetFileTypeToBinary()
+    else:
+      writer.SetFileTypeToASCII()
+    if fileVersion is not None:
+      writer.SetFileVersion(fileVersion)
+    writer.Write()
+    return filePath
+
+  def checkInformation(self, filePath):
+    information = readLegacyVTKInformation(filePath)
+    self.assertIsNotNone(information)
+    self.assertEqual(information.numberOfPoints, self.polyData.GetNumberOfPoints())
+    self.assertEqual(information.numberOfCells, self.polyData.GetNumberOfCells())
+    # The points are written as float
+    for bound, expectedBound in zip(information.bounds, self.polyData.GetBounds()):
+      self.assertAlmostEqual(bound, expectedBound, places=5)
+
+  def test_ASCII(self):
+    self.checkInformation(self.writeLegacyFile('ascii.vtk', binary=False))
+
+  def test_binary(self):
+    self.checkInformation(self.writeLegacyFile('binary.vtk', binary=True))
+
+  def test_version4(self):
+    self.checkInformation(self.writeLegacyFile('ascii42.vtk', binary=False, fileVersion=42))
+    self.checkInformation(self.writeLegacyFile('binary42.vtk', binary=True, fileVersion=42))
+
+  def test_emptyShape(self):
+    self.polyData = vtk.vtkPolyData()
+    self.polyData.SetPoints(vtk.vtkPoints())
+    information = readLegacyVTKInformation(self.writeLegacyFile('empty.vtk', binary=True))
+    self.assertEqual(information.numberOfPoints, 0)
+    self.assertEqual(information.bounds, (1.0, -1.0, 1.0, -1.0, 1.0, -1.0))
+
+  def test_unsupportedFile(self):
+    filePath = os.path.join(self.directory, 'notVTK.vtk')
+    with open(filePath, 'w') as shapeFile:
+      shapeFile.write('solid triangle\nendsolid\n')
+    self.assertIsNone(readLegacyVTKInformation(filePath))
+    self.assertIsNone(readLegacyVTKInformation(os.path.join(self.directory, 'missing.vtk')))
+
+    filePath = os.path.join(self.directory, 'badPoints.vtk')
+    with open(filePath, 'w') as shapeFile:
+      shapeFile.write('# vtk DataFile Version 3.0\nbad points\nASCII\nDATASET POLYDATA\nPOINTS 1 float\n0 one 2\n')
+    self.assertIsNone(readLegacyVTKInformation(filePath))
+
+if __name__ == '__main__':
+  unittest.main()
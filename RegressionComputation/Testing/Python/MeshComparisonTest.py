@@ -0,0 +1,102 @@
+import os
+import unittest
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from TestUtilities import TemporaryDirectoryTestCase, sphere
+from RegressionComputationLib.MeshComparison import (compareArrays, compareDirectories, compareMeshFiles, comparePolyData,
+                                                     writeComparisonReport)
+from RegressionComputationLib.Multiresolution import writePolyData
+
+#
+# Comparison of meshes and of directories of meshes with tolerances
+#
+
+def _points(shape):
+  return numpy_support.vtk_to_numpy(shape.GetPoints().GetData())
+
+class MeshComparisonTest(TemporaryDirectoryTestCase):
+
+  def test_compareArrays(self):
+    values = np.array([1.0, 2.0, np.nan, 4.0])
+    comparison = compareArrays('values', values, values.copy())
+    self.assertTrue(comparison.equal)
+    self.assertEqual(comparison.maximumError, 0.0)
+
+    comparison = compareArrays('values', values, np.array([1.0, 2.5, np.nan, 4.0]))
+    self.assertEqual(comparison.numberOfMismatches, 1)
+    self.assertAlmostEqual(comparison.maximumError, 0.5)
+    # The errors are computed over the finite values
+    self.assertAlmostEqual(comparison.rootMeanSquareError, np.sqrt(0.25 / 3))
+    self.assertTrue(compareArrays('values', values, np.array([1.0, 2.5, np.nan, 4.0]), absoluteTolerance=0.5).equal)
+    self.assertTrue(compareArrays('values', values, np.array([1.0, 2.5, np.nan, 4.0]), relativeTolerance=0.2).equal)
+
+    # NaN is only equal to NaN
+    comparison = compareArrays('values', values, np.array([1.0, 2.0, 3.0, 4.0]), absoluteTolerance=1e6)
+    self.assertEqual(comparison.numberOfMismatches, 1)
+    self.assertEqual(comparison.maximumError, 0.0)
+
+    # Infinite values are only equal to the same infinite value
+    values = np.array([1.0, np.inf, -np.inf, 4.0])
+    comparison = compareArrays('values', values, values.copy())
+    self.assertTrue(comparison.equal)
+    self.assertEqual(comparison.rootMeanSquareError, 0.0)
+    comparison = compareArrays('values', values, np.array([1.5, -np.inf, np.nan, 4.0]), absoluteTolerance=1e6)
+    self.assertEqual(comparison.numberOfMismatches, 2)
+    self.assertAlmostEqual(comparison.maximumError, 0.5)
+    self.assertTrue(compareArrays('empty', np.zeros(0), np.zeros(0)).equal)
+
+  def test_comparePolyData(self):
+    shape = sphere()
+    other = sphere()
+    self.assertTrue(comparePolyData(shape, other).equal)
+
+    _points(other)[0] += 1e-3
+    other.GetPoints().Modified()
+    comparison = comparePolyData(shape, other)
+    self.assertFalse(comparison.equal)
+    self.assertIn('Points: 3 values differ', comparison.text())
+    self.assertTrue(comparePolyData(shape, other, absoluteTolerance=1e-2).equal)
+
+    other.GetPointData().RemoveArray('Normals')
+    comparison = comparePolyData(shape, other, absoluteTolerance=1e-2)
+    self.assertEqual(comparison.differences, ['point data array Normals only in the first mesh'])
+
+    decimate = vtk.vtkDecimatePro()
+    decimate.SetInputData(shape)
+    decimate.SetTargetReduction(0.5)
+    decimate.Update()
+    comparison = comparePolyData(shape, decimate.GetOutput())
+    self.assertFalse(comparison.equal)
+    self.assertIn('points !=', comparison.text())
+
+  def test_compareDirectories(self):
+    directory1 = os.path.join(self.directory, 'first')
+    directory2 = os.path.join(self.directory, 'second')
+    os.makedirs(directory1)
+    os.makedirs(directory2)
+    shape = sphere()
+    for directory in (directory1, directory2):
+      writePolyData(shape, os.path.join(directory, 'same.vtk'))
+    writePolyData(shape, os.path.join(directory1, 'moved.vtk'))
+    _points(shape)[:] += 0.5
+    shape.GetPoints().Modified()
+    writePolyData(shape, os.path.join(directory2, 'moved.vtk'))
+    writePolyData(shape, os.path.join(directory2, 'onlySecond.vtk'))
+
+    self.assertFalse(compareMeshFiles(os.path.join(directory1, 'moved.vtk'), os.path.join(directory2, 'moved.vtk')).equal)
+    comparisons = compareDirectories(directory1, directory2, numberOfWorkers=2)
+    self.assertEqual([comparison.name for comparison in comparisons], ['moved.vtk', 'onlySecond.vtk', 'same.vtk'])
+    self.assertEqual([comparison.equal for comparison in comparisons], [False, False, True])
+    self.assertTrue(compareDirectories(directory1, directory2, absoluteTolerance=0.501)[0].equal)
+
+    reportFilePath = writeComparisonReport(comparisons, os.path.join(self.directory, 'comparison.csv'))
+    with open(reportFilePath) as reportFile:
+      rows = reportFile.read().splitlines()
+    self.assertEqual(rows[0], 'mesh,array,equal,mismatches,maximumError,rootMeanSquareError,differences')
+    self.assertTrue(any(row.startswith('onlySecond.vtk,,0') for row in rows))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,98 @@
+import os
+import unittest
+
+from TestUtilities import TemporaryDirectoryTestCase, sphere
+from RegressionComputationLib.GroupRegression import GroupRegression
+from RegressionComputationLib.ParameterSweep import (ParameterSweep, expandParameterGrid, parseParameterGrid, parseParameterSets,
+                                                     sweepRunName)
+from RegressionComputationLib.RegressionParameters import RegressionParameters, regressionInputStruct
+from RegressionComputationLib.Resampling import ResamplingRegression
+
+#
+# Parsing of the grids of parameters of a sweep, and scheduling of its runs
+#
+
+class _FinishedProcess(object):
+  def __init__(self, XMLdriverfilepath, numberOfThreads):
+    self.XMLdriverfilepath = XMLdriverfilepath
+    self.numberOfThreads = numberOfThreads
+    self.logFilePath = os.path.join(os.path.dirname(XMLdriverfilepath), 'shape4D.log')
+    self.wallTime = 1.0
+
+  def poll(self):
+    return 0
+
+  def statusString(self):
+    return 'Completed'
+
+class ParameterSweepTest(TemporaryDirectoryTestCase):
+
+  def test_parseParameterGrid(self):
+    grid = parseParameterGrid('sigmaV = 50, 70; gammaR = 0.01,0.1 ; T = 20 ; kernelType = p3m, exact; estimateBaseline = yes')
+    self.assertEqual(grid, {'sigmaV': [50.0, 70.0], 'gammaR': [0.01, 0.1], 'T': [20], 'kernelType': ['p3m', 'exact'],
+                            'estimateBaseline': [True]})
+    self.assertIsInstance(grid['T'][0], int)
+    self.assertEqual(parseParameterGrid(' ; '), dict())
+
+  def test_invalidParameters(self):
+    for text in ('sigmaV 50', 'unknown = 1', 'inputs = a.vtk', 'outputDirectory = /tmp',
+                 'useFista = 1', 'checkInputs = 1', 'T = ten'):
+      with self.assertRaises(ValueError, msg=text):
+        parseParameterGrid(text)
+
+  def test_parseParameterSets(self):
+    parameterSets = parseParameterSets('# Kernel widths\nsigmaV = 50, 70; gammaR = 0.01, 0.1\n\nT = 40\n')
+    self.assertEqual(len(parameterSets), 5)
+    self.assertIn({'sigmaV': 70.0, 'gammaR': 0.01}, parameterSets)
+    self.assertEqual(parameterSets[-1], {'T': 40})
+    self.assertEqual(expandParameterGrid(dict()), [dict()])
+
+  def test_sweepRunName(self):
+    self.assertEqual(sweepRunName(3, {'sigmaV': 50.0, 'kernelType': 'p3m'}), 'run_003_sigmaV-50.0_kernelType-p3m')
+    self.assertEqual(sweepRunName(0, {'outputPrefix': 'a/b c'}), 'run_000_outputPrefix-abc')
+
+  def test_runs(self):
+    parameters = RegressionParameters()
+    parameters.outputDirectory = '/output'
+    parameters.inputs = [regressionInputStruct('shape_{}.vtk'.format(index), float(index), group='AB'[index % 2])
+                         for index in range(4)]
+    sweep = ParameterSweep(parameters, [{'sigmaV': 50.0}, {'inputs': parameters.inputs[:2]}], runNames=['first', 'second'])
+    self.assertEqual([run.name for run in sweep.runs], ['first', 'second'])
+    self.assertEqual(sweep.runs[1].parameters.outputDirectory, os.path.join('/output', 'Sweep', 'second'))
+    # Each run has its own inputs
+    self.assertEqual([regressionInput.shapePath for regressionInput in sweep.runs[1].parameters.inputs], ['shape_0.vtk', 'shape_1.vtk'])
+    for run in sweep.runs:
+      for regressionInput in run.parameters.inputs:
+        self.assertNotIn(regressionInput, parameters.inputs)
+
+    resampling = ResamplingRegression(parameters)
+    self.assertEqual([run.name for run in resampling.runs], ['replicate_000', 'replicate_001', 'replicate_002'])
+    self.assertEqual(resampling.runs[0].parameters.outputDirectory, os.path.join('/output', 'Resampling', 'replicate_000'))
+    self.assertIsNot(resampling.runs[0].parameters.inputs[0], resampling.runs[1].parameters.inputs[0])
+
+    groups = GroupRegression(parameters)
+    self.assertEqual([run.name for run in groups.runs], ['group_A', 'group_B'])
+    self.assertEqual(groups.runs[1].parameters.outputDirectory, os.path.join('/output', 'Groups', 'group_B'))
+
+  def test_startProcess(self):
+    parameters = RegressionParameters()
+    parameters.outputDirectory = self.directory
+    parameters.inputs = [regressionInputStruct(self.writeShape(sphere(radius), 'shape_{}.vtk'.format(index)), float(index))
+                         for index, radius in enumerate((1.0, 2.0))]
+    processes = []
+    def startProcess(XMLdriverfilepath, numberOfThreads):
+      processes.append(_FinishedProcess(XMLdriverfilepath, numberOfThreads))
+      return processes[-1]
+    sweep = ParameterSweep(parameters, [{'sigmaV': 50.0}, {'sigmaV': 70.0}, {'sigmaV': 90.0}], numberOfCores=4,
+                           numberOfConcurrentRuns=2, startProcess=startProcess)
+    sweep.start()
+    self.assertEqual([process.XMLdriverfilepath for process in processes], [run.parameters.driverFilePath for run in sweep.runs[:2]])
+    self.assertEqual([process.numberOfThreads for process in processes], [2, 2])
+    # The third run is started when the first ones are finished
+    self.assertTrue(sweep.poll())
+    self.assertEqual(len(processes), 3)
+    self.assertFalse(sweep.poll())
+    self.assertEqual([run.status for run in sweep.runs], ['Completed'] * 3)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,34 @@
+import os
+import unittest
+from unittest import mock
+
+from TestUtilities import TemporaryDirectoryTestCase, sphere
+from RegressionComputationLib import Preprocessing
+from RegressionComputationLib.Preprocessing import PreprocessedShapeCache, preprocessingSettingsStruct
+
+#
+# Keys of the cache of the preprocessed shapes
+#
+
+class PreprocessingTest(TemporaryDirectoryTestCase):
+
+  def test_key(self):
+    shapePath = self.writeShape(sphere(), 'shape.vtk')
+    settings = preprocessingSettingsStruct()
+    cacheDirectory = os.path.join(self.directory, 'cache')
+    with mock.patch.object(Preprocessing, 'fileContentHash', wraps=Preprocessing.fileContentHash) as fileContentHash:
+      cache = PreprocessedShapeCache(cacheDirectory)
+      key = cache.key(shapePath, 5.0, settings)
+      self.assertNotEqual(cache.key(shapePath, 10.0, settings), key)
+      cache.save()
+      # The hash of the shape is kept in the index of the cache
+      self.assertEqual(PreprocessedShapeCache(cacheDirectory).key(shapePath, 5.0, settings), key)
+      self.assertEqual(fileContentHash.call_count, 1)
+      # and computed again when the shape changed
+      self.writeShape(sphere(2.0), 'shape.vtk')
+      os.utime(shapePath, ns=(0, 0))
+      self.assertNotEqual(PreprocessedShapeCache(cacheDirectory).key(shapePath, 5.0, settings), key)
+      self.assertEqual(fileContentHash.call_count, 2)
+
+if __name__ == '__main__':
+  unittest.main()
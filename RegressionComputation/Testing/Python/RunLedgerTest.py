@@ -0,0 +1,60 @@
+import os
+import stat
+import sys
+import unittest
+
+from TestUtilities import TemporaryDirectoryTestCase, sphere
+from RegressionComputationLib.RegressionParameters import RegressionParameters, regressionInputStruct
+from RegressionComputationLib.RunLedger import RunLedger
+
+#
+# Recording of the runs in the ledger, with a script standing for shape4D
+# that is slow to describe itself
+#
+
+class RunLedgerTest(TemporaryDirectoryTestCase):
+
+  def setUp(self):
+    TemporaryDirectoryTestCase.setUp(self)
+    self.executable = os.path.join(self.directory, 'shape4D')
+    with open(self.executable, 'w') as executableFile:
+      executableFile.write('#!{}\nimport time\ntime.sleep(0.5)\nprint("<executable><version>1.2.3</version></executable>")\n'.format(
+        sys.executable))
+    os.chmod(self.executable, os.stat(self.executable).st_mode | stat.S_IXUSR)
+    self.parameters = RegressionParameters()
+    self.parameters.outputDirectory = self.directory
+    self.parameters.inputs = [regressionInputStruct(self.writeShape(sphere(radius), 'shape_{}.vtk'.format(index)), float(index))
+                              for index, radius in enumerate((1.0, 2.0))]
+    self.ledger = RunLedger(os.path.join(self.directory, 'RunLedger.sqlite'))
+
+  def tearDown(self):
+    self.ledger.close()
+    TemporaryDirectoryTestCase.tearDown(self)
+
+  def shape4DVersions(self):
+    return [row[0] for row in self.ledger.query('SELECT shape4DVersion FROM runs ORDER BY id').rows]
+
+  def test_shape4DVersion(self):
+    # The run is recorded before shape4D describes itself
+    self.ledger.recordRun(self.parameters, 'Completed', 10.0, 100, 1.5, executable=self.executable)
+    self.assertEqual(self.shape4DVersions(), [None])
+    self.ledger.updatePendingVersions(wait=True)
+    versions = self.shape4DVersions()
+    self.assertTrue(versions[0].startswith('1.2.3 ('), msg=versions[0])
+    # The version is read once
+    self.ledger.recordRun(self.parameters, 'Stopped by the supervisor: plateau', 5.0, 50, 2.0, executable=self.executable)
+    self.assertEqual(self.shape4DVersions(), versions * 2)
+    self.assertEqual(self.ledger.query('SELECT status FROM runs ORDER BY id').rows[1][0], 'Stopped by the supervisor: plateau')
+
+  def test_inputHashes(self):
+    hashes = self.ledger.inputHashes(self.parameters)
+    self.assertEqual(len(hashes), 2)
+    self.assertEqual(self.ledger._fileHash(self.parameters.inputs[0].shapePath), hashes[0])
+    # A modified shape is hashed again
+    self.writeShape(sphere(3.0), 'shape_0.vtk')
+    os.utime(self.parameters.inputs[0].shapePath, ns=(0, 0))
+    self.assertIsNone(self.ledger._fileHash(self.parameters.inputs[0].shapePath))
+    self.assertNotEqual(self.ledger.inputHashes(self.parameters)[0], hashes[0])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,91 @@
+import os
+import unittest
+
+from TestUtilities import DataDirectory, TemporaryDirectoryTestCase
+from RegressionComputationLib.ConvergenceTelemetry import progressSnapshotFilePaths, snapshotFinalFileName, snapshotIteration
+from RegressionComputationLib.Shape4DLog import parseIterationLine, parseShape4DLog, readShape4DLog
+from RegressionComputationLib.WarmStart import isInitialVelocityFile
+
+#
+# Parsing of the output of shape4D and of the names of its output files
+#
+# shape4D.log follows the output of shape4D for the sphere to ellipsoid data
+# of the module test (p3m, T=10, a progress snapshot every 5 iterations), with
+# its iteration lines in the format of Shape4DLog. It was not captured from a
+# run: test_Shape4D of the module test parses the log of an actual run of
+# shape4D in the same way, and fails if no iteration line is recognized.
+#
+
+class Shape4DLogTest(TemporaryDirectoryTestCase):
+
+  def test_readShape4DLog(self):
+    records = readShape4DLog(os.path.join(DataDirectory, 'shape4D.log'))
+    self.assertEqual([record.iteration for record in records], list(range(11)))
+    self.assertAlmostEqual(records[0].objective, 1.734201e+04)
+    self.assertAlmostEqual(records[-1].objective, 6.461190e+03)
+    self.assertAlmostEqual(records[1].dataTerm, 1.498771e+04)
+    self.assertAlmostEqual(records[1].regularityTerm, 3.547120e+01)
+    self.assertAlmostEqual(records[1].stepSize, 1.200000e-02)
+
+  def test_parseIterationLine(self):
+    record = parseIterationLine('Iter 12 E = nan Data = -nan Reg = 0 Step = 1e-05\n')
+    self.assertEqual(record.iteration, 12)
+    self.assertNotEqual(record.objective, record.objective)
+    self.assertNotEqual(record.dataTerm, record.dataTerm)
+    self.assertEqual(record.regularityTerm, 0.0)
+    self.assertEqual(record.stepSize, 1e-05)
+
+  def test_unrecognizedLines(self):
+    for line in ('Saving progress at iter 5: regression_iter_0005_V0.vtk',
+                 'Optimizer: gradient descent, breakRatio = 1e-05, maxIters = 3000',
+                 'Converged: relative change of the energy below breakRatio after 10 iterations',
+                 'iteration: 12, energy = 1.5',
+                 'Iter 5: E = 1.5 Data = 1.0 Reg = 0.5 Step = 0.01',
+                 'Iter 5 E = 1.5 Data = 1.0',
+                 'Iter 5 E = 1.5 Data = 1.0 Reg = 0.5 Step = 0.01 Time = 2.0',
+                 'Iter five E = 1.5 Data = 1.0 Reg = 0.5 Step = 0.01',
+                 ''):
+      self.assertIsNone(parseIterationLine(line), msg=line)
+    # Iteration lines in another format are reported
+    with self.assertLogs(level='WARNING') as logs:
+      records = parseShape4DLog('Iter 0 E = 2 Data = 2 Reg = 0 Step = 0.01\nIter 1: E = 1.5\nIter 2: E = 1.2\n')
+    self.assertEqual([record.iteration for record in records], [0])
+    self.assertIn('2 lines', logs.output[0])
+
+  def test_snapshotIteration(self):
+    self.assertEqual(snapshotIteration('/output/regression_iter_0005_time_000.vtk', 'regression_'), 5)
+    self.assertEqual(snapshotIteration('/output/regression_iter_0010_V0.vtk', 'regression_'), 10)
+    self.assertEqual(snapshotIteration('iter_0120_time_009.vtk'), 120)
+    # Only the names of the snapshots of the regression
+    for fileName in ('regression_final_time_000.vtk', 'regression_iteration-120_time_009.vtk', 'regression_iter_0005.vtk',
+                     'regression_iter_0005_time_000.vtk.bak', 'other_iter_0005_V0.vtk'):
+      self.assertIsNone(snapshotIteration(fileName, 'regression_'), msg=fileName)
+    self.assertIsNone(snapshotIteration('/input/SphereToEllipsoid_03.vtk', 'SphereToEllipsoid_'))
+
+  def test_snapshotFinalFileName(self):
+    self.assertEqual(snapshotFinalFileName('iter_0005_time_003.vtk'), 'final_time_003.vtk')
+    self.assertEqual(snapshotFinalFileName('iter_0010_V0.vtk'), 'final_V0.vtk')
+    self.assertIsNone(snapshotFinalFileName('final_time_003.vtk'))
+
+  def test_progressSnapshotFilePaths(self):
+    for fileName in ('regression_iter_0005_time_000.vtk', 'regression_iter_0005_V0.vtk',
+                     'regression_final_time_000.vtk', 'regression_final_V0.vtk', 'other_iter_0005_V0.vtk',
+                     'regression_iter_notes.vtk'):
+      open(os.path.join(self.directory, fileName), 'w').close()
+    fileNames = [os.path.basename(filePath) for filePath in progressSnapshotFilePaths(self.directory, 'regression_')]
+    self.assertEqual(fileNames, ['regression_iter_0005_V0.vtk', 'regression_iter_0005_time_000.vtk'])
+    # The input shapes are not progress snapshots, whatever the numbers in their names
+    for fileName in ('SphereToEllipsoid_00.vtk', 'SphereToEllipsoid_03.vtk'):
+      open(os.path.join(self.directory, fileName), 'w').close()
+    self.assertEqual(progressSnapshotFilePaths(self.directory, 'SphereToEllipsoid_'), [])
+
+  def test_isInitialVelocityFile(self):
+    self.assertTrue(isInitialVelocityFile('/output/regression_iter_0010_V0.vtk'))
+    self.assertTrue(isInitialVelocityFile('/output/regression_final_V0.vtk'))
+    self.assertTrue(isInitialVelocityFile('v0.vtk'))
+    self.assertFalse(isInitialVelocityFile('/output/regression_final_time_000.vtk'))
+    self.assertFalse(isInitialVelocityFile('/output/regression_iter_0010_V01.vtk'))
+    self.assertFalse(isInitialVelocityFile('/output/cv0_time_000.vtk'))
+
+if __name__ == '__main__':
+  unittest.main()
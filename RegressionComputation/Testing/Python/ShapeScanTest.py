@@ -0,0 +1,49 @@
+import threading
+import unittest
+
+import TestUtilities
+from RegressionComputationLib.ShapeScan import ShapeDirectoryScanner
+
+#
+# Cancellation of a scan, with a read function standing for the shape reader
+#
+
+class ShapeScanTest(unittest.TestCase):
+
+  def setUp(self):
+    self.started = threading.Semaphore(0)
+    self.release = threading.Event()
+
+  def readShape(self, shapeFilePath):
+    # The reads block until released, to cancel the scan while shapes are being read
+    self.started.release()
+    self.release.wait(10)
+    return shapeFilePath
+
+  def startScan(self, scanner, numberOfShapes):
+    scanner.start(['shape_{:02d}.vtk'.format(index) for index in range(numberOfShapes)])
+    for worker in range(scanner.numberOfWorkers):
+      self.assertTrue(self.started.acquire(timeout=10))
+
+  def test_cancel(self):
+    scanner = ShapeDirectoryScanner(numberOfWorkers=2, readFunction=self.readShape)
+    self.startScan(scanner, 5)
+    threading.Timer(0.1, self.release.set).start()
+    scanner.cancel()
+    # The shapes being read when the scan was cancelled are taken
+    self.assertEqual(sorted(scanner.takeFinished()), ['shape_00.vtk', 'shape_01.vtk'])
+    self.assertTrue(scanner.cancelled)
+    self.assertFalse(scanner.isRunning())
+    self.assertEqual(scanner.numberOfNotRead, 3)
+
+  def test_reset(self):
+    scanner = ShapeDirectoryScanner(numberOfWorkers=2, readFunction=self.readShape)
+    self.startScan(scanner, 5)
+    threading.Timer(0.1, self.release.set).start()
+    # The shapes read and not taken are returned when the scan is restarted
+    self.assertEqual(sorted(scanner.reset()), ['shape_00.vtk', 'shape_01.vtk'])
+    self.assertEqual(scanner.numberOfShapes, 0)
+    self.assertEqual(scanner.takeFinished(), [])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,48 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import vtk
+
+#
+# Common setup of the tests of RegressionComputationLib
+#
+# The tests import RegressionComputationLib from the module directory, so that
+# they run without the Slicer application, and write their shapes in a
+# temporary directory removed after each test.
+#
+
+ModuleDirectory = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+if ModuleDirectory not in sys.path:
+  sys.path.insert(0, ModuleDirectory)
+
+DataDirectory = os.path.join(ModuleDirectory, 'Testing', 'Data', 'Input')
+
+from RegressionComputationLib.Multiresolution import writePolyData
+
+def sphere(radius=1.0, center=(0.0, 0.0, 0.0), resolution=None):
+  """ Sphere of vtkSphereSource, with 50 points by default """
+  source = vtk.vtkSphereSource()
+  source.SetRadius(radius)
+  source.SetCenter(*center)
+  if resolution is not None:
+    source.SetThetaResolution(resolution)
+    source.SetPhiResolution(resolution)
+  source.Update()
+  shape = vtk.vtkPolyData()
+  shape.DeepCopy(source.GetOutput())
+  return shape
+
+class TemporaryDirectoryTestCase(unittest.TestCase):
+  """ Test case with a temporary directory, self.directory """
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def writeShape(self, shape, fileName):
+    return writePolyData(shape, os.path.join(self.directory, fileName))
@@ -0,0 +1,74 @@
+import os
+import unittest
+
+import numpy as np
+from vtk.util import numpy_support
+
+from TestUtilities import TemporaryDirectoryTestCase, sphere
+from RegressionComputationLib.MeshComparison import comparePolyData
+from RegressionComputationLib.Multiresolution import readPolyData
+from RegressionComputationLib.TrajectoryContainer import (TrajectoryContainer, packRegressionOutputs, packTrajectory,
+                                                          quantizeTrajectory, dequantizeTrajectory)
+
+#
+# Round trip of a trajectory through the container
+#
+
+class TrajectoryContainerTest(TemporaryDirectoryTestCase):
+
+  def setUp(self):
+    TemporaryDirectoryTestCase.setUp(self)
+    self.shapeFilePaths = []
+    for timeStep in range(4):
+      shape = sphere(resolution=12)
+      points = numpy_support.vtk_to_numpy(shape.GetPoints().GetData())
+      points *= [1.0 + 0.1 * timeStep, 1.0, 1.0 - 0.05 * timeStep]
+      distance = numpy_support.numpy_to_vtk(np.linalg.norm(points, axis=1), deep=True)
+      distance.SetName('distance')
+      shape.GetPointData().AddArray(distance)
+      self.shapeFilePaths.append(self.writeShape(shape, 'regression_final_time_{:03d}.vtk'.format(timeStep)))
+
+  def checkRoundTrip(self, containerFilePath, absoluteTolerance):
+    with TrajectoryContainer(containerFilePath) as container:
+      self.assertEqual(container.numberOfTimeSteps, len(self.shapeFilePaths))
+      self.assertEqual(sorted(container.pointDataNames), ['Normals', 'distance'])
+      for timeStep, shapeFilePath in enumerate(self.shapeFilePaths):
+        shape = readPolyData(shapeFilePath)
+        self.assertEqual(container.numberOfPoints, shape.GetNumberOfPoints())
+        comparison = comparePolyData(shape, container.polyData(timeStep), absoluteTolerance=absoluteTolerance)
+        self.assertTrue(comparison.equal, comparison.text())
+      return np.array(container.times)
+
+  def test_raw(self):
+    containerFilePath = packTrajectory(self.shapeFilePaths, os.path.join(self.directory, 'raw.s4dt'), timeValues=[0, 1, 2, 4])
+    # The points of the files are float32: the raw container keeps them exactly
+    times = self.checkRoundTrip(containerFilePath, 0.0)
+    np.testing.assert_array_equal(times, [0.0, 1.0, 2.0, 4.0])
+
+  def test_quantized(self):
+    containerFilePath = packTrajectory(self.shapeFilePaths, os.path.join(self.directory, 'quantized.s4dt'), quantize=True)
+    self.checkRoundTrip(containerFilePath, 1e-4)
+
+  def test_packRegressionOutputs(self):
+    containerFilePath = packRegressionOutputs(self.directory, 'regression_', t0=10.0, tn=16.0)
+    self.assertEqual(os.path.basename(containerFilePath), 'regression_trajectory.s4dt')
+    np.testing.assert_allclose(self.checkRoundTrip(containerFilePath, 0.0), [10.0, 12.0, 14.0, 16.0])
+
+  def test_quantizeTrajectory(self):
+    points = np.cumsum(np.random.RandomState(0).normal(size=(20, 50, 3)), axis=0)
+    firstPoints, displacements, scales = quantizeTrajectory(points)
+    decodedPoints = dequantizeTrajectory(firstPoints, displacements, scales)
+    # The error does not accumulate along the trajectory
+    self.assertLess(np.abs(decodedPoints - points).max(), 2 * scales.max() + 1e-5 * np.abs(points).max())
+
+  def test_invalidInputs(self):
+    with self.assertRaises(ValueError):
+      packTrajectory([], os.path.join(self.directory, 'empty.s4dt'))
+    notContainer = os.path.join(self.directory, 'notContainer.s4dt')
+    with open(notContainer, 'wb') as containerFile:
+      containerFile.write(b'\0' * 128)
+    with self.assertRaises(ValueError):
+      TrajectoryContainer(notContainer)
+
+if __name__ == '__main__':
+  unittest.main()